@@ -2,6 +2,7 @@ import time
 import requests
 import streamlit as st
 
+from rag.model_registry import warm_up
 from rag.rag import ChatPDF
 from config import Config 
 from utils.upload_source import UploadStatus, upload_document, upload_url
@@ -48,15 +49,47 @@ def process_input():
     if st.session_state["user_input"] and len(st.session_state["user_input"].strip()) > 0:
         user_text = st.session_state["user_input"].strip()
         
-        # Get response from the assistant while displaying a "thinking" spinner
-        with st.session_state["thinking_spinner"], st.spinner(f"Thinking"):
-            agent_text = st.session_state["assistant"].ask(user_text)
+        if Config.STREAM_ANSWERS:
+            agent_text = stream_answer(user_text)
+        else:
+            # Get response from the assistant while displaying a "thinking" spinner
+            with st.session_state["thinking_spinner"], st.spinner(f"Thinking"):
+                agent_text = st.session_state["assistant"].ask(user_text)
             
         # Append user input and assistant response to the message history
         st.session_state.messages.append({"role": "user", "content": user_text})
         st.session_state.messages.append({"role": "assistant", "content": agent_text})
 
 
+def stream_answer(user_text: str):
+    """
+    Render the answer of the assistant as its tokens arrive, then replace it with the final
+    answer once the hallucination and usefulness checks are done, with the result of the checks.
+
+    Returns:
+        str: The final answer, with the note of the checks.
+    """
+    print("chatbot.py - stream_answer()")
+    
+    with st.session_state["thinking_spinner"].container():
+        st.chat_message("user").write(user_text)
+        with st.chat_message("assistant"):
+            answer_box = st.empty()
+            answer_box.markdown("Thinking...")
+            text = ""
+            for event in st.session_state["assistant"].ask_stream(user_text):
+                if event['type'] == "token":
+                    text += event['text']
+                    answer_box.markdown(text + "▌")
+                elif event['type'] == "generated":
+                    text = event['text']
+                    answer_box.markdown(f"{text}\n\n*Checking the answer...*")
+                else:
+                    text = f"{event['text']}\n\n{event['note']}" if event['note'] else event['text']
+                    answer_box.markdown(text)
+    return text
+
+
 def read_and_save_file(domain: str, source_type: str):
     """
     Process file or URL uploads and initiate document ingestion.
@@ -79,9 +112,25 @@ def read_and_save_file(domain: str, source_type: str):
     if source_type == "url":
         st.session_state["url_status"] = status['status']
     elif source_type == "document":
-        st.session_state['document_status'] = {'status': status['status'], 'file_name': status.get('file_name')}
+        st.session_state['document_status'] = {'status': status['status'], 'file_name': status.get('file_name'), 'duplicates': status.get('duplicates', 0)}
     
 
+def scope_search():
+    """
+    Restrict the retrieval to the documents selected in the sidebar, all of them when none is.
+    """
+    print("chatbot.py - scope_search()")
+    st.session_state["assistant"].set_scope(st.session_state["search_scope"])
+
+
+@st.cache_resource
+def warm_up_models():
+    """
+    Load the shared models once per server process, before the first session needs them.
+    """
+    return warm_up()
+
+
 def initialize_session_state():
     """
     Initialize the session state if it is currently empty.
@@ -96,6 +145,8 @@ def clear_session_state():
     """
         Reset the session state to default values.
     """
+    if "assistant" in st.session_state:
+        st.session_state["assistant"].close()
     st.session_state["messages"] = []
     st.session_state["assistant"] = ChatPDF()
     st.session_state["domain"] = ""
@@ -103,7 +154,7 @@ def clear_session_state():
     st.session_state['url_upload'] = "" 
     st.session_state['file_names'] = []
     st.session_state["document_status"] = None
-    st.session_state["file_hashes"] = []
+    st.session_state["file_hashes"] = set()
 
 
 @st.dialog("Show Uploaded Files")
@@ -204,6 +255,8 @@ def page():
     """
     print("chatbot.py - page()")
     
+    if Config.MODEL_WARMUP:
+        warm_up_models()
     initialize_session_state()
 
     if st.session_state["domain"].strip() == "":
@@ -269,7 +322,9 @@ def page():
             elif st.session_state.get("document_status") and st.session_state["document_status"].get('status') == UploadStatus.INVALID_DOMAIN:
                 st.error(f"The document '{st.session_state['document_status']['file_name']}' does not fall within the specified domain.")
             elif st.session_state.get("document_status") and st.session_state["document_status"].get('status') == UploadStatus.SUCCESS:
-                st.success(f"Document {st.session_state['document_status']['file_name']} uploaded successfully.")   
+                st.success(f"Document {st.session_state['document_status']['file_name']} uploaded successfully.")
+                if st.session_state['document_status'].get('duplicates'):
+                    st.info(f"Skipped {st.session_state['document_status']['duplicates']} near-duplicate chunks.")   
                 
             add_divider(padding_top=0)    
             
@@ -285,6 +340,17 @@ def page():
             
             add_divider(padding_top=0)             
             
+            if st.session_state['file_names']:
+                add_heading("🎯 Search In", level=2, padding_bottom=0)
+                st.multiselect(
+                    "Search in",
+                    st.session_state['file_names'],
+                    key="search_scope",
+                    on_change=scope_search,
+                    placeholder="All documents",
+                    label_visibility="collapsed",
+                )
+            
         st.session_state["ingestion_spinner"] = st.empty()
         display_messages()
         st.chat_input("Send message to Chatbot", key="user_input", on_submit=process_input)
@@ -7,14 +7,85 @@ class Config:
     MODEL: str = "llama3.1"
     MODEL_TEMPERATURE: float = 0.0
     KEEP_IN_MEMORY: int = -1
+    MODEL_WARMUP: bool = False
+    STREAM_ANSWERS: bool = False
+    STREAM_STEP_TIMEOUT: int = 600
 
     # Splitter parameters
+    SPLITTER_MODE: str = "recursive"
     SPLITTER_CHUNK_SIZE: int = 512
     SPLITTER_CHUNK_OVERLAP: int = 51
+    SPLITTER_TOKEN_CHUNK_SIZE: int = 500
+    SPLITTER_TOKEN_CHUNK_OVERLAP: int = 50
+
+    # Embedding parameters
+    EMBEDDING_MODEL: str = "BAAI/bge-large-en"
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_BATCH_SIZE: int = 32
+    EMBEDDING_THREADS: int = 0
+    EMBEDDING_CACHE: bool = True
+    EMBEDDING_CACHE_DIR: str = "./embedding_cache"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 100000
+
+    # Ingestion parameters
+    INGEST_WORKERS: int = 4
+    INGEST_STREAMING: bool = False
+    INGEST_BATCH_SIZE: int = 64
+    PDF_EXTRACT_WORKERS: int = 1
+    PDF_PAGES_PER_TASK: int = 8
+    PDF_PARALLEL_MIN_PAGES: int = 32
+    INGEST_QUEUE_SIZE: int = 2
+    INGEST_PROBE: bool = False
+    PROBE_PAGES: int = 3
+    PROBE_CHARS: int = 6000
+    INGEST_CACHE: bool = True
+    INGEST_CACHE_DIR: str = "./ingest_cache"
+    INGEST_CACHE_MAX_BYTES: int = 2 * 1024 ** 3
+    URL_SYNC_STATE_PATH: str = "./url_sync_state.json"
+    URL_SYNC_TIMEOUT: int = 10
+    DEDUP: bool = False
+    DEDUP_INDEX_PATH: str = "./dedup_index.npy"
+    DEDUP_NUM_PERM: int = 128
+    DEDUP_BANDS: int = 32
+    DEDUP_THRESHOLD: float = 0.8
+
+    # Domain detection parameters
+    DOMAIN_DETECTION_MODE: str = "full"
+    DOMAIN_DETECTION_SAMPLES: int = 8
+    DOMAIN_DETECTION_TOKEN_BUDGET: int = 3000
+    DOMAIN_DETECTION_MAP_TOKENS: int = 1500
 
     #Database and retriever parameters
     COLLECTION_NAME: str = "rag_chroma"
+    VECTOR_STORE_PERSIST: bool = False
+    TENANCY: str = "none"
+    VECTOR_STORE_BACKEND: str = "milvus"
+    MMAP_STORE_DIR: str = "./mmap_store"
+    MMAP_EXACT_MAX_CHUNKS: int = 50000
+    MMAP_HNSW_M: int = 16
+    MMAP_HNSW_EF_CONSTRUCTION: int = 200
+    MMAP_HNSW_EF: int = 64
     URI: str = "./vector.db"
     
     N_DDG_TO_RETRIEVE: int = 4
+    RETRIEVAL_K_STEPS: tuple = (4, 8, 16)
+    RETRIEVAL_SCORE_GATING: bool = False
+    RETRIEVAL_SCORE_HIGH: float = 0.9
+    RETRIEVAL_SCORE_FLOOR: float = 0.6
+    RETRIEVAL_MIN_CANDIDATES: int = 2
+    GRADING_MODE: str = "sequential"
+    GRADING_MAX_CONCURRENCY: int = 4
+    GRADING_EARLY_STOP: int = 0
+    GRAPH_FAN_OUT: bool = False
+    SAVE_GRAPH_IMAGE: bool = False
+    ANSWER_CACHE: bool = False
+    ANSWER_CACHE_THRESHOLD: float = 0.95
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    HYBRID_RETRIEVAL: bool = False
+    BM25_INDEX_PATH: str = "./bm25_index.json"
+    BM25_K1: float = 1.5
+    BM25_B: float = 0.75
+    HYBRID_TOP_K: int = 4
+    HYBRID_FETCH_K: int = 10
+    HYBRID_RRF_K: int = 60
     
@@ -0,0 +1,99 @@
+import copy
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.embeddings import Embeddings
+from rag.chunk_filter import ChunkFilter
+
+# The part of the final state served again for a similar question
+CACHED_KEYS = ('answer', 'question_type', 'execution_path', 'answer_useful')
+
+
+class AnswerCache:
+    """
+    Semantic cache of the final answers, in front of the graph: a question of the same domain and
+    retrieval scope whose embedding has a cosine similarity of at least ANSWER_CACHE_THRESHOLD with
+    an answered question gets the stored answer without running the graph.
+
+    The entries are tagged with the corpus version they were answered on. A successful ingestion
+    bumps the version and drops the older entries, and an answer computed while the corpus changed
+    is not stored. At most ANSWER_CACHE_MAX_ENTRIES are kept, the least recently used are evicted first.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries: int = None, threshold: float = None):
+        print("answer_cache.py - __init__()")
+        self.embeddings = embeddings
+        self.max_entries = max_entries or cfg.ANSWER_CACHE_MAX_ENTRIES
+        self.threshold = threshold if threshold is not None else cfg.ANSWER_CACHE_THRESHOLD
+        self.lock = threading.Lock()
+        self.version = 0
+        self.entries = OrderedDict()
+        self.ids = itertools.count()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+
+    def get(self, domain: str, question: str, scope: Optional[ChunkFilter] = None) -> Tuple[Optional[dict], tuple]:
+        """
+        The scope is the ChunkFilter of the retrieval, None (or an empty filter) for the whole corpus.
+        
+        Returns:
+            tuple: The cached answer of the most similar question (None on a miss) with its
+                   'cache_similarity', and the key to put() the answer of the question under.
+        """
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        scope = scope or None
+        with self.lock:
+            key = (domain, scope, vector, self.version)
+            candidates = [entry_id for entry_id, entry in self.entries.items() if entry['domain'] == domain and entry['scope'] == scope]
+            if candidates:
+                similarities = np.stack([self.entries[entry_id]['vector'] for entry_id in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.entries.move_to_end(candidates[best])
+                    self.hits += 1
+                    answer = copy.deepcopy(self.entries[candidates[best]]['answer'])
+                    return {**answer, 'cache_similarity': float(similarities[best])}, key
+            self.misses += 1
+            return None, key
+
+
+    def put(self, key: tuple, state: dict):
+        """
+        Store the answer of the final state under the key given by get(), unless the corpus
+        changed in the meantime.
+        """
+        domain, scope, vector, version = key
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[next(self.ids)] = {'domain': domain, 'scope': scope, 'vector': vector, 'answer': copy.deepcopy({k: state[k] for k in CACHED_KEYS})}
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def bump_version(self):
+        """
+        The corpus changed: the answers given on the previous one are not served any more.
+        """
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Number of cache 'hits' and 'misses', the 'hit_rate', the number of 'entries' and
+                  'evictions', and the corpus 'version'.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': len(self.entries), 'evictions': self.evictions, 'version': self.version}
@@ -1,37 +1,135 @@
-from langgraph.graph import END, StateGraph
+import inspect
+
+from config import Config as cfg
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import StreamWriter
 
 class WorkflowInitializer:
+    """
+    Compiles the question graph of a system class. The compiled graphs do not hold a system:
+    they are compiled once per graph config and shared by the sessions, and each run finds
+    the system of its session in its config, see bind().
+    """
 
-    def __init__(self, system):
+    def __init__(self, system_class):
         print('langgraph.py - __init__()')
-        self.system = system
+        self.system_class = system_class
+
+    @staticmethod
+    def bind(app, system):
+        """
+        Returns:
+            CompiledStateGraph: A shallow copy of the shared app (same nodes), running the nodes of the given system.
+        """
+        return app.with_config(configurable={"system": system})
+
+    def _node(self, name: str, use_async: bool):
+        """
+        The node method of the system, its async version '_a<name>' for the async app.
+        """
+        return self._dispatch(f"_a{name}" if use_async else f"_{name}", use_async)
+
+    def _dispatch(self, method: str, use_async: bool = False):
+        """
+        Node calling the method of the system of the run, with the stream writer if it takes one.
+        """
+        takes_writer = "writer" in inspect.signature(getattr(self.system_class, method)).parameters
+
+        def call(state, config: RunnableConfig, writer: StreamWriter):
+            node = getattr(config["configurable"]["system"], method)
+            return node(state, writer) if takes_writer else node(state)
+
+        async def acall(state, config: RunnableConfig, writer: StreamWriter):
+            return await call(state, config, writer)
+
+        return acall if use_async else call
+
+    def _graded_route(self, state):
+        """
+        After the grading: the question classification, or its speculative result when the
+        parallel branch already classified the same question.
+        """
+        if not state["grade_documents"]:
+            return "no"
+        return "speculative" if state.get("speculative_question_type") else "yes"
+
+    def _join_route(self, state):
+        if state["q_domain_relevance"] != "yes":
+            return "out_of_domain"
+        if state.get("speculative_retrieval") is None:
+            return "retrieve"
+        return self._graded_route(state)
+
+    def _add_fan_out(self, workflow, use_async: bool):
+        """
+        Domain check, retrieval + grading and question classification in parallel branches,
+        joined before the answer generation (GRAPH_FAN_OUT).
+        """
+        workflow.add_node("check_query_domain", self._node("branch_check_query_domain", use_async))
+        workflow.add_node("retrieve_and_grade", self._node("branch_retrieve", use_async))
+        workflow.add_node("classify_question", self._node("branch_question_classifier", use_async))
+        workflow.add_node("join_branches", self._dispatch("_join_branches"))
+        workflow.add_node("use_question_classification", self._dispatch("_use_question_classification"))
+
+        for branch in ("check_query_domain", "retrieve_and_grade", "classify_question"):
+            workflow.add_edge(START, branch)
+        workflow.add_edge(["check_query_domain", "retrieve_and_grade", "classify_question"], "join_branches")
 
-    def initialize(self):
-        print('langgraph.py - initialize()')    
-        workflow = StateGraph(self.system.GraphState)
-
-        workflow.set_entry_point("check_query_domain")
-        workflow.add_node("check_query_domain", self.system._check_query_domain)
-        workflow.add_node("rephrase_based_history", self.system._rephrase_query)
-        workflow.add_node("retrieve", self.system._retrieve)   
-        workflow.add_node("grade_docs", self.system._grade_documents) 
-        workflow.add_node("grade_ddg_docs", self.system._grade_documents)     
-        workflow.add_node("check_query_domain_end", self.system._check_query_domain)
-        workflow.add_node("generate", self.system._generate)
-        workflow.add_node("ddg_search", self.system._ddg_search)
-        workflow.add_node("answer_check", self.system._answer_check)
-        workflow.add_node("hallucination_check", self.system._hallucination_check)
-        workflow.add_node("question_classification", self.system._question_classifier)
-        workflow.add_node("math_generate", self.system._math_generate)
-        
         workflow.add_conditional_edges(
-            "check_query_domain",
-            lambda state: state["q_domain_relevance"],
+            "join_branches",
+            self._join_route,
             {
-                "yes": "retrieve",
-                "no": "rephrase_based_history",
+                "out_of_domain": "rephrase_based_history",
+                "retrieve": "retrieve",
+                "yes": "question_classification",
+                "speculative": "use_question_classification",
+                "no": "ddg_search",
             },
         )
+
+        workflow.add_conditional_edges(
+            "use_question_classification",
+            lambda state: state["question_type"],
+            {
+                "yes": "math_generate",
+                "no": "generate",
+                "error": END,
+            }
+        )
+
+    def initialize(self, use_async: bool = False):
+        """
+        Compile the graph, with the async nodes when use_async is set (to run with app.ainvoke()).
+        """
+        print('langgraph.py - initialize()')    
+        workflow = StateGraph(self.system_class.GraphState)
+
+        workflow.add_node("rephrase_based_history", self._node("rephrase_query", use_async))
+        workflow.add_node("retrieve", self._node("retrieve", use_async))   
+        workflow.add_node("grade_docs", self._node("grade_documents", use_async)) 
+        workflow.add_node("grade_ddg_docs", self._node("grade_documents", use_async))     
+        workflow.add_node("check_query_domain_end", self._node("check_query_domain", use_async))
+        workflow.add_node("generate", self._node("generate", use_async))
+        workflow.add_node("ddg_search", self._node("ddg_search", use_async))
+        workflow.add_node("answer_check", self._node("answer_check", use_async))
+        workflow.add_node("hallucination_check", self._node("hallucination_check", use_async))
+        workflow.add_node("question_classification", self._node("question_classifier", use_async))
+        workflow.add_node("math_generate", self._node("math_generate", use_async))
+        
+        if cfg.GRAPH_FAN_OUT:
+            self._add_fan_out(workflow, use_async)
+        else:
+            workflow.set_entry_point("check_query_domain")
+            workflow.add_node("check_query_domain", self._node("check_query_domain", use_async))
+            workflow.add_conditional_edges(
+                "check_query_domain",
+                lambda state: state["q_domain_relevance"],
+                {
+                    "yes": "retrieve",
+                    "no": "rephrase_based_history",
+                },
+            )
         
         workflow.add_edge("rephrase_based_history", "check_query_domain_end")
         workflow.add_conditional_edges(
@@ -44,22 +142,25 @@ class WorkflowInitializer:
         )
         
         workflow.add_edge("retrieve", "grade_docs")
+        speculative = {"speculative": "use_question_classification"} if cfg.GRAPH_FAN_OUT else {}
         workflow.add_conditional_edges(
             "grade_docs",
-            lambda state: "yes" if state["grade_documents"] else "no",
+            self._graded_route,
             {
                 "yes": "question_classification",
                 "no": "ddg_search",
+                **speculative,
             },
         )
         
         workflow.add_edge("ddg_search", "grade_ddg_docs")
         workflow.add_conditional_edges(
             "grade_ddg_docs",
-            lambda state: "yes" if state["grade_documents"] else "no",
+            self._graded_route,
             {
                 "yes": "question_classification",
                 "no": END,
+                **speculative,
             }
         )
         
@@ -102,8 +203,10 @@ class WorkflowInitializer:
         )
         
         app = workflow.compile()
+        if use_async or not cfg.SAVE_GRAPH_IMAGE:
+            return app
         
-        # Save the graph image
+        # Save the graph image (rendered by the mermaid.ink web service)
         try:
             image_data = app.get_graph(xray=True).draw_mermaid_png()
             with open("graph_img/output_image.png", "wb") as file:
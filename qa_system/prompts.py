@@ -82,6 +82,28 @@ grader_document_prompt = PromptTemplate(
 )
 
 
+response_schemas_grader_documents = [
+    ResponseSchema(
+        name="relevant", 
+        description="List of the numbers of the documents relevant to the question, [] if none is.",
+        type="List[int]"),
+]
+output_parser_grader_documents = StructuredOutputParser.from_response_schemas(response_schemas_grader_documents)
+format_instructions_grader_documents = output_parser_grader_documents.get_format_instructions(only_json =True)
+grader_documents_prompt = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are a grader assessing the relevance of each of the numbered documents to a user's question. \n 
+    {documents}
+    <|eot_id|><|start_header_id|>user<|end_header_id|>
+    User question: {question} 
+    <|eot_id|><|start_header_id|>assistant<|end_header_id|> 
+    format instructions: {format_instructions}
+    """,
+    input_variables=["question", "documents"],
+    partial_variables={"format_instructions": format_instructions_grader_documents} 
+)
+
+
 generate_answer = PromptTemplate(
         template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
         You are an assistant for question-answering tasks. 
@@ -95,6 +117,32 @@ generate_answer = PromptTemplate(
 )
 
 
+response_schemas_generate_answer = [
+    ResponseSchema(
+        name="answer", 
+        description="The answer to the user's question."),
+    ResponseSchema(
+        name="sources", 
+        description="The key 'sources' of the metadata of the documents used to generate the answer.",
+        type="List[str]"),
+]
+output_parser_generate_answer = StructuredOutputParser.from_response_schemas(response_schemas_generate_answer)
+format_instructions_generate_answer = output_parser_generate_answer.get_format_instructions(only_json =True)
+generate_answer_json = PromptTemplate(
+        template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+        You are an assistant for question-answering tasks. 
+        Use only the context to answer the user's question.
+        Context: {context} 
+        <|eot_id|><|begin_of_text|><|start_header_id|>user<|end_header_id|>
+        User Question: {question} 
+        <|eot_id|><|start_header_id|>assistant<|end_header_id|>
+        format instructions: {format_instructions}
+        """,
+    input_variables=["context", "question"],
+    partial_variables={"format_instructions": format_instructions_generate_answer}
+)
+
+
 hallucination_grader_prompt = PromptTemplate(
     template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
     You are a grader assessing whether an answer is grounded in / supported by a set of facts. 
@@ -160,6 +208,39 @@ math_solver = PromptTemplate(
 )
 
 
+response_schemas_math_solver = [
+    ResponseSchema(
+        name="step_wise_reasoning", 
+        description="The step wise reasoning to the arithmetic task.",
+        type="List[str]"),
+    ResponseSchema(
+        name="expr", 
+        description="A NumExpr-compatible expression, with only numbers and operators, that directly calculates the result."),
+    ResponseSchema(
+        name="sources", 
+        description="ONLY the key 'sources' of the metadata of the documents used to generate the answer.",
+        type="List[str]"),
+]
+output_parser_math_solver = StructuredOutputParser.from_response_schemas(response_schemas_math_solver)
+format_instructions_math_solver = output_parser_math_solver.get_format_instructions(only_json =True)
+math_solver_json = PromptTemplate(
+    template="""
+    <|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are an expert AI specialized in generating expressions for ne.evaluate(.) to solve arithmetic tasks.
+    Given specific numbers, write a NumExpr-compatible expression that directly calculates the result.
+    The final expression must contain only numbers and operators, with no variables.
+    
+    Related Documents: {documents}\n
+    <|eot_id|><|begin_of_text|><|start_header_id|>user<|end_header_id|>
+    Task: {question} 
+    <|eot_id|><|start_header_id|>assistant<|end_header_id|>
+    format instructions: {format_instructions}
+     """,
+    input_variables=["question", "documents"],
+    partial_variables={"format_instructions": format_instructions_math_solver}
+)
+
+
 math_solver_web = PromptTemplate(
     template="""
     <|begin_of_text|><|start_header_id|>system<|end_header_id|>
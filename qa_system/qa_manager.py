@@ -1,19 +1,22 @@
-from typing import Dict, List
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
 
 import numexpr as ne
 from config import Config as cfg
-from langchain.chains import create_history_aware_retriever
-from langchain_community.chat_models import ChatOllama
 from langchain_community.tools import DuckDuckGoSearchResults
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_experimental.llms.ollama_functions import OllamaFunctions
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
 from qa_system.lang_graph import WorkflowInitializer
+from langgraph.types import StreamWriter
 from qa_system.prompts import (answers_grader_prompt, generate_answer,
-                               grader_document_prompt,
+                               generate_answer_json, grader_document_prompt,
+                               grader_documents_prompt,
                                hallucination_grader_prompt, math_solver,
-                               math_solver_web, query_domain_check,
-                               question_classifier_prompt, rephrase_prompt)
+                               math_solver_json, math_solver_web,
+                               query_domain_check, question_classifier_prompt,
+                               rephrase_prompt)
+from rag.model_registry import get_llm, get_shared
 from qa_system.structure_answer import (AnswerHallucination, AnswerWithSources,
                                         AnswerWithSourcesMath,
                                         AnswerWithWebSourcesMath)
@@ -34,7 +37,9 @@ class KnowledgeBaseSystem:
         rephrase_question: str
         q_domain_relevance: str
         documents: List[str]
+        document_scores: List[Optional[float]]
         grade_documents: List[str]
+        grading_calls_saved: int
         domain : str
         hallucination: str
         math_score: str
@@ -42,6 +47,10 @@ class KnowledgeBaseSystem:
         execution_path: List[str] = []
         answer_useful: str
         answer: Dict
+        speculative_retrieval: Optional[Dict]
+        speculative_question_type: Optional[str]
+        stream_tokens: bool
+        standalone_question: Optional[Tuple[str, str]]
 
 
     def __init__(self, retriever):  
@@ -49,10 +58,13 @@ class KnowledgeBaseSystem:
         self.retriever = retriever
         self.chat_history = []
         self.chat_rephrased_history = []
+        # Semantic answer cache, set by ChatPDF with ANSWER_CACHE, and the retrieval scope its answers depend on
+        self.answer_cache = None
+        self.chunk_filter = None
   
-        # LLMs
-        self.json_llm = ChatOllama(model=cfg.MODEL, keep_alive=cfg.KEEP_IN_MEMORY, format="json", temperature=cfg.MODEL_TEMPERATURE)  
-        self.llm = OllamaFunctions(model=cfg.MODEL, keep_alive=cfg.KEEP_IN_MEMORY, format="json", temperature=cfg.MODEL_TEMPERATURE) 
+        # LLMs (shared by the sessions)
+        self.json_llm = get_llm("json")
+        self.llm = get_llm("functions")
         
         # STRUCTURED LLMs
         self.structured_llm = self.llm.with_structured_output(AnswerWithSources)
@@ -65,17 +77,38 @@ class KnowledgeBaseSystem:
         self.hallucination_grader_chain = hallucination_grader_prompt | self.structured_llm_hallucination
         self.chain_math_numexpr = math_solver |self.structured_llm_numexpr 
         self.chain_math_not_numexpr = math_solver_web | self.structured_llm_not_numexpr
+        # Token streaming: JSON mode, parsed into growing partial answers
+        self.generate_answer_stream = generate_answer_json | self.json_llm | JsonOutputParser()
+        self.chain_math_numexpr_stream = math_solver_json | self.json_llm | JsonOutputParser()
         self.query_domain_check = query_domain_check | self.json_llm| JsonOutputParser()
         self.rephrase_query_chain = rephrase_prompt | self.json_llm | JsonOutputParser()
+        self.rephrase_retrieval_query_chain = rephrase_prompt | self.json_llm | StrOutputParser()
         self.retrieval_grader_document_chain = grader_document_prompt | self.json_llm | JsonOutputParser()
+        self.retrieval_grader_documents_chain = grader_documents_prompt | self.json_llm | JsonOutputParser()
         self.answer_grader_chain = answers_grader_prompt | self.json_llm | JsonOutputParser()
         self.question_classifier = question_classifier_prompt | self.json_llm | JsonOutputParser()
         self.search_ddg_search_results = DuckDuckGoSearchResults(num_results = cfg.N_DDG_TO_RETRIEVE, verbose = True, keys_to_include=['snippet', 'link'])
         
-        # GRAPH APP
-        self.app = WorkflowInitializer(self).initialize()
+        # GRAPH APPS (compiled once per graph config and shared by the sessions)
+        fan_out = cfg.GRAPH_FAN_OUT
+        app = get_shared(("graph", fan_out), lambda: WorkflowInitializer(KnowledgeBaseSystem).initialize())
+        async_app = get_shared(("async_graph", fan_out), lambda: WorkflowInitializer(KnowledgeBaseSystem).initialize(use_async=True))
+        # LangGraph only streams the tokens of a node while it runs when the step has a timeout
+        stream_app = get_shared(("stream_graph", fan_out, cfg.STREAM_STEP_TIMEOUT), lambda: app.copy(update={"step_timeout": cfg.STREAM_STEP_TIMEOUT}))
+        self.app, self.async_app, self.stream_app = (WorkflowInitializer.bind(graph, self) for graph in (app, async_app, stream_app))
             
     
+    # NODES
+    # Each node has an async twin '_a<node>' for the async app (ASYNC NODES). They share the
+    # state bookkeeping below, so a twin only differs by awaiting its LLM and search calls.
+    
+    def _start_node(self, state: GraphState, header: str, node: str):
+        print(f"\n--- {header} ---")
+        
+        if "execution_path" in state:
+            state['execution_path'].extend([node])
+    
+    
     def _check_query_domain(self, state: GraphState):
         """
         Check if the query belongs to the specified domain using an LLM call.
@@ -83,24 +116,32 @@ class KnowledgeBaseSystem:
         Returns:
             state (dict): Updated state with the domain relevance score and a default answer.
         """
-        print("\n--- CHECK QUERY DOMAIN ---")
-        
-        if "execution_path" in state:
-            state['execution_path'].extend(["check_query_domain"])
-        
-        print("\nQuestion:  {}".format(state["question"]))
-        print("\nDomain:    {}".format(state["domain"]))
-
+        inputs = self._query_domain_inputs(state)
         try:
-            answer = self.query_domain_check.invoke({"question": state["question"], "domain": state["domain"]})
-            state['q_domain_relevance'] = answer['score']
-            state['answer'] = {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"}
-            print("\nResult:    {}".format(answer['score']))
+            return self._record_query_domain(state, self.query_domain_check.invoke(inputs))
         except Exception as e:
-            print(f"KeyError: {e}. _check_query_domain() - Response may not contain expected fields.")
-            state['q_domain_relevance'] = 'no'
-            state['answer'] = {'answer': "I don't know the answer to that question due to an internal error .", 'metadata': "No metadata"}
+            return self._query_domain_failed(state, e)
+    
+    
+    def _query_domain_inputs(self, state: GraphState) -> dict:
+        self._start_node(state, "CHECK QUERY DOMAIN", "check_query_domain")
         
+        print("\nQuestion:  {}".format(state["question"]))
+        print("\nDomain:    {}".format(state["domain"]))
+        return {"question": state["question"], "domain": state["domain"]}
+    
+    
+    def _record_query_domain(self, state: GraphState, answer: dict):
+        state['q_domain_relevance'] = answer['score']
+        state['answer'] = {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"}
+        print("\nResult:    {}".format(answer['score']))
+        return state
+    
+    
+    def _query_domain_failed(self, state: GraphState, e: Exception):
+        print(f"KeyError: {e}. _check_query_domain() - Response may not contain expected fields.")
+        state['q_domain_relevance'] = 'no'
+        state['answer'] = {'answer': "I don't know the answer to that question due to an internal error .", 'metadata': "No metadata"}
         return state
     
     
@@ -111,22 +152,30 @@ class KnowledgeBaseSystem:
         Returns:
             state (dict): Updates 'question' key with a re-phrased question value
         """
-        print("\n--- REPHRASE QUERY ---")
-        
-        if "execution_path" in state:
-            state['execution_path'].extend(["rephrase_based_history"])
-        
-        print("\nQuestion:         {}".format(state["question"]))
-        
+        inputs = self._rephrase_inputs(state)
         try:
-            chat_history_content = extract_limited_chat_history(self.chat_rephrased_history, max_length=3500)
-            rephrased_query = self.rephrase_query_chain.invoke({"input": state["question"], "chat_history": chat_history_content})
-            print("\nRephrased query:  {}".format(rephrased_query['question']))
-            state["question"] = rephrased_query['question']
+            return self._record_rephrase(state, self.rephrase_query_chain.invoke(inputs))
         except Exception as e:
-            print(f"KeyError: {e}. _rephrase_query() - Response may not contain expected fields.")
-            state["question"] = state["question"]
-            
+            return self._rephrase_failed(state, e)
+    
+    
+    def _rephrase_inputs(self, state: GraphState) -> dict:
+        self._start_node(state, "REPHRASE QUERY", "rephrase_based_history")
+        
+        print("\nQuestion:         {}".format(state["question"]))
+        chat_history_content = extract_limited_chat_history(self.chat_rephrased_history, max_length=3500)
+        return {"input": state["question"], "chat_history": chat_history_content}
+    
+    
+    def _record_rephrase(self, state: GraphState, rephrased_query: dict):
+        print("\nRephrased query:  {}".format(rephrased_query['question']))
+        state["question"] = rephrased_query['question']
+        return state
+    
+    
+    def _rephrase_failed(self, state: GraphState, e: Exception):
+        # The question is kept as it is
+        print(f"KeyError: {e}. _rephrase_query() - Response may not contain expected fields.")
         return state
    
     
@@ -137,94 +186,262 @@ class KnowledgeBaseSystem:
         Returns:
             state (dict): Updated state with 'documents' containing retrieved documents or an empty list if no retriever is available.
         """
-        print("\n--- RETRIEVE DOCUMENTS ---")
+        if not self._start_retrieve(state):
+            return state
+
+        # Same standalone question as create_history_aware_retriever(), kept to search again with a larger k
+        query = state["question"]
+        if self.chat_history:
+            query = self._standalone_question(state) or self.rephrase_retrieval_query_chain.invoke({"input": state["question"], "chat_history": self.chat_history})
         
-        if "execution_path" in state:
-            state['execution_path'].extend(["retrieve"])
+        for k in self._k_steps():
+            documents, scores = self._search(query, k)
+            if self._enough_candidates(k, documents, scores):
+                break
+        return self._record_retrieval(state, documents, scores)
+    
+    
+    def _start_retrieve(self, state: GraphState) -> bool:
+        """
+        Returns:
+            bool: False without a retriever, the state then holds an empty document list.
+        """
+        self._start_node(state, "RETRIEVE DOCUMENTS", "retrieve")
         
         print("\nQuestion to retrive:    {}".format(state["question"]))
         
         if self.retriever is None: 
             print("\nNo files or URLs detected. Returning an empty document list.")
             state["documents"] = []
-            return state
-
-        chat_retriever_chain = create_history_aware_retriever(self.json_llm, self.retriever, rephrase_prompt)
-        documents = chat_retriever_chain.invoke({"input": state["question"], "chat_history": self.chat_history})
-        
+            state["document_scores"] = []
+            return False
+        return True
+    
+    
+    def _k_steps(self):
+        # With score gating, k grows while too few chunks pass the score floor
+        return cfg.RETRIEVAL_K_STEPS if cfg.RETRIEVAL_SCORE_GATING else cfg.RETRIEVAL_K_STEPS[:1]
+    
+    
+    def _enough_candidates(self, k: int, documents: List, scores: List[Optional[float]]) -> bool:
+        n_candidates = sum(1 for score in scores if score is None or score >= cfg.RETRIEVAL_SCORE_FLOOR)
+        print("\nk = {}, candidates above the score floor: {}/{}".format(k, n_candidates, len(documents)))
+        return n_candidates >= cfg.RETRIEVAL_MIN_CANDIDATES or len(documents) < k
+    
+    
+    def _record_retrieval(self, state: GraphState, documents: List, scores: List[Optional[float]]):
         print("\nRetrieved Documents:    ")
         print_documents(documents)
         
         state['documents'] = documents
+        state['document_scores'] = scores
         return state
     
     
+    def _standalone_question(self, state: GraphState):
+        """
+        Returns:
+            str: The standalone question already made by the answer cache lookup, if the question was not rephrased since.
+        """
+        standalone = state.get("standalone_question")
+        if standalone and standalone[0] == state["question"]:
+            return standalone[1]
+        return None
+    
+    
+    def _search(self, query: str, k: int):
+        """
+        Search the retriever for the k nearest chunks with their cosine similarity
+        (None when the retriever gives no score).
+        
+        Returns:
+            tuple: The documents and their scores.
+        """
+        if hasattr(self.retriever, 'search_with_scores'):
+            pairs = self.retriever.search_with_scores(query, k)
+            return [doc for doc, _ in pairs], [score for _, score in pairs]
+        
+        documents = self.retriever.invoke(query)
+        return documents, [None] * len(documents)
+    
+    
     def _grade_documents(self, state: GraphState):
         """
         Determines whether the retrieved documents are relevant to the question.
+        
+        With score gating, the documents above RETRIEVAL_SCORE_HIGH are kept and the ones
+        below RETRIEVAL_SCORE_FLOOR dropped without an LLM call, only the ones in between are graded.
+        The GRADING_MODE sets how: one call per document in turn ("sequential"), waves of
+        GRADING_MAX_CONCURRENCY concurrent calls ("concurrent"), or one call for all of them
+        ("single_prompt"). With GRADING_EARLY_STOP, the per document grading stops once that
+        many relevant documents are found, the best ranked first.
             
         Returns:
-            state (dict): Updated state with 'grade_documents' key containing only relevant documents.
+            state (dict): Updated state with 'grade_documents' key containing only relevant documents
+                          and 'grading_calls_saved' with the number of skipped grading calls.
         """
-        print("\n--- GRADE RETRIEVED DOCUMENTS---")
-        if "execution_path" in state:
-            state['execution_path'].extend(["grade_docs"])
-            
-        documents = state["documents"]
-        num_documents = len(documents)
-        
-        print("\nNumber of documents:  {}".format(num_documents))
-        
+        start_time = self._start_grading(state)
+        question, documents = state["question"], state["documents"]
         try: 
-            filtered_docs = []
-            with tqdm(total=num_documents, desc="Grading Documents", ncols=100) as pbar:
-                for d in documents:
-                    score = self.retrieval_grader_document_chain.invoke({"question": state["question"], "document": d.page_content})
-                    grade = score["score"]
-                    if grade == "yes":
-                        filtered_docs.append(d)
-                    else:
-                        continue
-                    pbar.update(1)
+            relevant, pending, calls_saved = self._gate_documents(state)
+            if cfg.GRADING_MODE == "single_prompt" and pending:
+                grades = self.retrieval_grader_documents_chain.invoke(self._numbered_documents(question, documents, pending))
+                calls_saved += self._record_single_prompt(grades, pending, relevant)
+            else:
+                n_graded = 0
+                for wave in self._grading_waves(pending, relevant):
+                    grades = self.retrieval_grader_document_chain.batch(self._wave_inputs(question, documents, wave), config={"max_concurrency": self._wave_size()})
+                    n_graded += self._record_wave(grades, wave, relevant)
+                calls_saved += len(pending) - n_graded
+            filtered_docs = [documents[i] for i in sorted(relevant)]
         except Exception as e:
             print(f"KeyError: {e}. _grade_documents() - Response may not contain expected fields.")
             filtered_docs = []
-                
+            calls_saved = 0
+        
+        return self._record_grades(state, filtered_docs, calls_saved, start_time)
+    
+    
+    def _start_grading(self, state: GraphState) -> float:
+        self._start_node(state, "GRADE RETRIEVED DOCUMENTS", "grade_docs")
+        
+        print("\nNumber of documents:  {}".format(len(state["documents"])))
+        return time.time()
+    
+    
+    def _gate_documents(self, state: GraphState):
+        """
+        Split the documents by their similarity: kept, dropped or to grade.
+        
+        Returns:
+            tuple: The indices of the relevant documents, the indices of the ones to grade
+                   (in rank order) and the number of grading calls saved.
+        """
+        scores = state.get("document_scores") or [None] * len(state["documents"])
+        relevant, pending = set(), []
+        calls_saved = 0
+        for i, similarity in enumerate(scores):
+            if cfg.RETRIEVAL_SCORE_GATING and similarity is not None and similarity >= cfg.RETRIEVAL_SCORE_HIGH:
+                relevant.add(i)
+                calls_saved += 1
+            elif cfg.RETRIEVAL_SCORE_GATING and similarity is not None and similarity < cfg.RETRIEVAL_SCORE_FLOOR:
+                calls_saved += 1
+            else:
+                pending.append(i)
+        return relevant, pending, calls_saved
+    
+    
+    def _record_grades(self, state: GraphState, filtered_docs: List, calls_saved: int, start_time: float):
+        num_documents = len(state["documents"])
         print("\nRelevant document filter:   {}/{}".format(len(filtered_docs), num_documents))
+        print("\nGrading LLM calls saved:    {}/{}".format(calls_saved, num_documents))
+        print("\nGrading wall time:          {:.2f} seconds ({})".format(time.time() - start_time, cfg.GRADING_MODE))
         print("\nFiltered Documents:     ")
         print_documents(filtered_docs)
                 
         state["grade_documents"] = filtered_docs
+        state["grading_calls_saved"] = state.get("grading_calls_saved", 0) + calls_saved
         return state
     
+    
+    def _grading_waves(self, pending: List[int], relevant: set):
+        """
+        Waves of 1 ("sequential") or GRADING_MAX_CONCURRENCY concurrent grading calls, one per
+        pending document in rank order.
+        
+        Yields:
+            list: The indices of the next wave of documents to grade, until the early stop.
+        """
+        wave_size = self._wave_size()
+        with tqdm(total=len(pending), desc="Grading Documents", ncols=100) as pbar:
+            for start in range(0, len(pending), wave_size):
+                if cfg.GRADING_EARLY_STOP and len(relevant) >= cfg.GRADING_EARLY_STOP:
+                    print(f"\nEarly stop: {len(relevant)} relevant documents found")
+                    return
+                yield pending[start:start + wave_size]
+                pbar.update(len(pending[start:start + wave_size]))
+    
+    
+    def _wave_inputs(self, question: str, documents: List, wave: List[int]) -> List[dict]:
+        return [{"question": question, "document": documents[i].page_content} for i in wave]
+    
+    
+    def _wave_size(self) -> int:
+        return cfg.GRADING_MAX_CONCURRENCY if cfg.GRADING_MODE == "concurrent" else 1
+    
+    
+    def _record_wave(self, grades: List[dict], wave: List[int], relevant: set) -> int:
+        """
+        Adds the relevant documents of a graded wave to 'relevant'.
+        
+        Returns:
+            int: The number of graded documents.
+        """
+        relevant.update(i for i, grade in zip(wave, grades) if grade["score"] == "yes")
+        return len(wave)
+    
+    
+    def _numbered_documents(self, question: str, documents: List, pending: List[int]) -> dict:
+        numbered = "\n".join(f"Document {n}: {documents[i].page_content}" for n, i in enumerate(pending, start=1))
+        return {"question": question, "documents": numbered}
+    
+    
+    def _record_single_prompt(self, grades: dict, pending: List[int], relevant: set) -> int:
+        """
+        Adds the relevant documents of the multi-document prompt to 'relevant'.
+        
+        Returns:
+            int: The number of grading calls saved.
+        """
+        numbers = {int(n) for n in grades["relevant"] if str(n).strip().isdigit()}
+        relevant.update(i for n, i in enumerate(pending, start=1) if n in numbers)
+        return len(pending) - 1
+    
 
-    def _generate(self, state: GraphState):
+    def _generate(self, state: GraphState, writer: StreamWriter = None):
         """
-        Generate an answer using the provided context and question.
+        Generate an answer using the provided context and question. When 'stream_tokens' is set,
+        the answer is generated in JSON mode and its tokens are written to the graph stream.
             
         Returns:
             state (dict): Updated state key 'answer" with the new answer.
         """
-        print("\n--- GENERATE ANSWER ---")
-        
-        if "execution_path" in state:
-            state['execution_path'].extend(["generate"])
+        inputs = self._generation_inputs(state)
+        try:
+            if state.get("stream_tokens") and writer:
+                generation = AnswerWithSources(**self._stream_tokens(self.generate_answer_stream, inputs, self._render_answer, writer))
+            else:
+                generation = self.generate_answer.invoke(inputs)
+            return self._record_generation(state, generation)
+        except Exception as e:
+            return self._generation_failed(state, e)
+    
+    
+    def _generation_inputs(self, state: GraphState) -> dict:
+        self._start_node(state, "GENERATE ANSWER", "generate")
         
         print("\nQuestion:               {}".format(state["question"]))
+        return {"context": state['grade_documents'], "question": state["question"]}
+    
+    
+    def _render_answer(self, partial: dict) -> str:
+        return partial.get("answer") or ""
+    
+    
+    def _record_generation(self, state: GraphState, generation: AnswerWithSources):
+        print("\nAnswer:                 {}".format(generation))
+        metadata = ' '.join(generation.sources)
         
-        try:
-            generation = self.generate_answer.invoke({"context": state['grade_documents'], "question": state["question"]})
-            print("\nAnswer:                 {}".format(generation))
-            metadata = ' '.join(generation.sources)
-            
-            print("\nAnswer:                 {}".format(generation.answer))
-            print("\nMetadata:               {}".format(metadata))
-            
-            state ["answer"] = {'answer': generation.answer, 'metadata': metadata}
-        except Exception as e:
-            print(f"KeyError: {e}. _generate() - Response may not contain expected fields.")
-            state["answer"] = {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"}
-            
+        print("\nAnswer:                 {}".format(generation.answer))
+        print("\nMetadata:               {}".format(metadata))
+        
+        state["answer"] = {'answer': generation.answer, 'metadata': metadata}
+        return state
+    
+    
+    def _generation_failed(self, state: GraphState, e: Exception):
+        print(f"KeyError: {e}. _generate() - Response may not contain expected fields.")
+        state["answer"] = {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"}
         return state
 
     
@@ -235,81 +452,131 @@ class KnowledgeBaseSystem:
         Returns:
             state (dict): Updated state with 'question_type' key containing the classification.
         """
-        print("\n--- QUESTION CLASSIFIER ---")
-        
-        if "execution_path" in state:
-            state['execution_path'].extend(["question_classification"])
-        
+        self._start_node(state, "QUESTION CLASSIFIER", "question_classification")
         try:
-            question_type = self.question_classifier.invoke({"question": state["question"]})
-            print("\nQuestion Type: {}".format("math" if question_type['score'] == "yes" else "text"))
-            
-            state["question_type"] = question_type['score']
+            return self._record_question_type(state, self.question_classifier.invoke({"question": state["question"]}))
         except Exception as e:
-            print(f"KeyError: {e}. _question_classifier() - Response may not contain expected fields.")
-            state["question_type"] = 'error'
-            
+            return self._question_type_failed(state, e)
+    
+    
+    def _record_question_type(self, state: GraphState, question_type: dict):
+        print("\nQuestion Type: {}".format("math" if question_type['score'] == "yes" else "text"))
+        state["question_type"] = question_type['score']
+        return state
+    
+    
+    def _question_type_failed(self, state: GraphState, e: Exception):
+        print(f"KeyError: {e}. _question_classifier() - Response may not contain expected fields.")
+        state["question_type"] = 'error'
         return state
     
 
-    def _math_generate(self, state: GraphState):
+    def _math_generate(self, state: GraphState, writer: StreamWriter = None):
         """
-        Generate an arithmetic resoning answer using the provided context and question.
+        Generate an arithmetic resoning answer using the provided context and question. When
+        'stream_tokens' is set, the reasoning steps are written to the graph stream as they are generated.
         
         Returns:
             state (dict): Updated state key 'answer' with the new answer.
         """
-        print("\n--- GENERATE MATH ANSWER ---")
-        
-        if "execution_path" in state:
-            state['execution_path'].extend(["math_generate"])
-                    
+        inputs = self._math_inputs(state)
         try:
-            print("\nQuestion:                {}".format(state["question"]))
-            
-            generation = self.chain_math_numexpr.invoke({"question": state["question"], "documents": state["grade_documents"]})
-            stepwise_str = generation.step_wise_reasoning
-            expr_str = generation.expr
-            sources = ','.join(generation.sources)
-            
-            print("\nStepwise Reasoning:      {}".format(stepwise_str))
-            print("\nExpression:              {}".format(expr_str))  
-            print("\nSources:                 {}".format(sources))
-            
-            answer_to_neEvaluate = ne.evaluate(expr_str)
-            
-            print("\nAnswer to ne.evaluate:   {}".format(answer_to_neEvaluate))
-            
-            steps_str = [f"Step {i+1}: {step}\n" for i, step in enumerate(stepwise_str)]
-            stepwise_str = "💡 Solution:\n\n" + "\n".join(steps_str)
-            
-            state['answer'] = {"answer": f"{stepwise_str}\n\n Final answer: {answer_to_neEvaluate} ", "metadata": sources, "calculation": 'Computed with python'}
-            state['math_score'] = "yes"
+            if state.get("stream_tokens") and writer:
+                generation = AnswerWithSourcesMath(**self._stream_tokens(self.chain_math_numexpr_stream, inputs, self._render_math_steps, writer))
+            else:
+                generation = self.chain_math_numexpr.invoke(inputs)
+            self._set_math_answer(state, generation)
         except Exception as e:
             try:
-                answer_web = self.chain_math_not_numexpr.invoke({"question": state["question"], "documents": state["grade_documents"]})
-                print("\nAnswer Web:              {}".format(answer_web))
-                stepwise_str = answer_web.step_wise_reasoning
-                solution = answer_web.solution
-                sources = ','.join(answer_web.sources)
-                print("\nStepwise Reasoning:      {}".format(stepwise_str))
-                print("\nSolution:              {}".format(solution))  
-                print("\nSources:                 {}".format(sources))
-                
-                steps_str = [f"Step {i+1}: {step}\n" for i, step in enumerate(stepwise_str)]
-                stepwise_str = "🤔 Solution:\n\n" + "\n".join(steps_str)
-                
-                state['math_score'] = "no"
-                state['answer'] = {"answer": f"{stepwise_str}\n\n Final answer: {solution} ", "metadata": sources, "calculation": 'Not python computed or Web based solution, \n maybe not be accurate. (Check the sources)🚨'}
+                self._set_math_web_answer(state, self.chain_math_not_numexpr.invoke(inputs))
             except Exception as e:
-                state['answer'] = {
-                    "answer": "Unexpected error occurred",
-                    "metadata": "No metadata",
-                    "calculation": "Error occurred"
-                }
-                state['math_score'] = "no"
+                self._set_math_error(state)
                 
         return state
+    
+    
+    def _math_inputs(self, state: GraphState) -> dict:
+        self._start_node(state, "GENERATE MATH ANSWER", "math_generate")
+        
+        print("\nQuestion:                {}".format(state["question"]))
+        return {"question": state["question"], "documents": state["grade_documents"]}
+    
+    
+    def _render_math_steps(self, partial: dict) -> str:
+        return self._math_steps(partial["step_wise_reasoning"], "💡") if partial.get("step_wise_reasoning") else ""
+    
+    
+    def _set_math_answer(self, state: GraphState, generation: AnswerWithSourcesMath):
+        stepwise_str = generation.step_wise_reasoning
+        expr_str = generation.expr
+        sources = ','.join(generation.sources)
+        
+        print("\nStepwise Reasoning:      {}".format(stepwise_str))
+        print("\nExpression:              {}".format(expr_str))  
+        print("\nSources:                 {}".format(sources))
+        
+        answer_to_neEvaluate = ne.evaluate(expr_str)
+        
+        print("\nAnswer to ne.evaluate:   {}".format(answer_to_neEvaluate))
+        
+        stepwise_str = self._math_steps(stepwise_str, "💡")
+        
+        state['answer'] = {"answer": f"{stepwise_str}\n\n Final answer: {answer_to_neEvaluate} ", "metadata": sources, "calculation": 'Computed with python'}
+        state['math_score'] = "yes"
+    
+    
+    def _set_math_web_answer(self, state: GraphState, answer_web: AnswerWithWebSourcesMath):
+        print("\nAnswer Web:              {}".format(answer_web))
+        stepwise_str = answer_web.step_wise_reasoning
+        solution = answer_web.solution
+        sources = ','.join(answer_web.sources)
+        print("\nStepwise Reasoning:      {}".format(stepwise_str))
+        print("\nSolution:              {}".format(solution))  
+        print("\nSources:                 {}".format(sources))
+        
+        stepwise_str = self._math_steps(stepwise_str, "🤔")
+        
+        state['math_score'] = "no"
+        state['answer'] = {"answer": f"{stepwise_str}\n\n Final answer: {solution} ", "metadata": sources, "calculation": 'Not python computed or Web based solution, \n maybe not be accurate. (Check the sources)🚨'}
+    
+    
+    def _math_steps(self, steps: List[str], icon: str) -> str:
+        steps_str = [f"Step {i+1}: {step}\n" for i, step in enumerate(steps)]
+        return f"{icon} Solution:\n\n" + "\n".join(steps_str)
+    
+    
+    def _stream_tokens(self, chain, inputs: dict, render, writer: StreamWriter) -> dict:
+        """
+        Stream the partial JSON outputs of the chain and write to the graph stream the new text
+        of their rendering, render(partial), as {'token': text} chunks.
+        
+        Returns:
+            dict: The complete output.
+        """
+        streamed, output = "", {}
+        for output in chain.stream(inputs):
+            streamed = self._write_new_text(streamed, render(output), writer)
+        return output
+    
+    
+    def _write_new_text(self, streamed: str, text: str, writer: StreamWriter) -> str:
+        """
+        Returns:
+            str: The text streamed so far, after writing what the new rendering adds to it.
+        """
+        if len(text) > len(streamed) and text.startswith(streamed):
+            writer({'token': text[len(streamed):]})
+            return text
+        return streamed
+    
+    
+    def _set_math_error(self, state: GraphState):
+        state['answer'] = {
+            "answer": "Unexpected error occurred",
+            "metadata": "No metadata",
+            "calculation": "Error occurred"
+        }
+        state['math_score'] = "no"
 
 
     def _ddg_search(self, state: GraphState):
@@ -319,22 +586,29 @@ class KnowledgeBaseSystem:
         Returns:
             state (dict): Updated state with 'documents' containing retrieved documents from DDG.
         """
-        print("\n--- DDG SEARCH ---")
-        
-        state['execution_path'].extend(["ddg_search"])
-        
+        self._start_node(state, "DDG SEARCH", "ddg_search")
         try:
-            documents = self.search_ddg_search_results.invoke({"query": state["question"]})
-            documents = convert_str_to_document(documents)
-            
-            print("\nDocuments DDG:")
-            print_documents(documents)
-            
-            state["documents"] = documents
+            return self._record_ddg_documents(state, self.search_ddg_search_results.invoke({"query": state["question"]}))
         except Exception as e:
-            print(f"KeyError: {e}. _ddg_search() - Response may not contain expected fields.")
-            state["documents"] = []
+            return self._ddg_search_failed(state, e)
+    
+    
+    def _record_ddg_documents(self, state: GraphState, documents):
+        documents = convert_str_to_document(documents)
         
+        print("\nDocuments DDG:")
+        print_documents(documents)
+        
+        state["documents"] = documents
+        # The web results have no similarity score, they are all graded
+        state["document_scores"] = [None] * len(documents)
+        return state
+    
+    
+    def _ddg_search_failed(self, state: GraphState, e: Exception):
+        print(f"KeyError: {e}. _ddg_search() - Response may not contain expected fields.")
+        state["documents"] = []
+        state["document_scores"] = []
         return state
 
     
@@ -345,25 +619,31 @@ class KnowledgeBaseSystem:
         Returns:
             state (dict): Updated state with hallucination check result
         """
-        print("\n--- HALLUCINATIONS CHECK ---")
-        
-        if "execution_path" in state:
-            state['execution_path'].extend(["hallucination_check"])
-        
+        self._start_node(state, "HALLUCINATIONS CHECK", "hallucination_check")
         try:
-            is_grounded_in_facts = self.hallucination_grader_chain.invoke({"documents":  state["grade_documents"], "generation": state["answer"]}) 
-            
-            state["hallucination"] = "no" if is_grounded_in_facts.score == "yes" else "yes"
-            print("\nHallucination:      {}".format(state["hallucination"]))
-            
-            if is_grounded_in_facts.score == "no":
-                state["answer"] = {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"}
-            
-            print(f"\nDECISION: generation is {'grounded in documents' if is_grounded_in_facts.score == 'yes' else 'not grounded in documents, re-try'}")
+            return self._record_hallucination(state, self.hallucination_grader_chain.invoke(self._hallucination_inputs(state)))
         except Exception as e:
-            print(f"KeyError: {e}. _hallucination_check() - Response may not contain expected fields.")
-            state["hallucination"] = "yes"
-            
+            return self._hallucination_failed(state, e)
+    
+    
+    def _hallucination_inputs(self, state: GraphState) -> dict:
+        return {"documents":  state["grade_documents"], "generation": state["answer"]}
+    
+    
+    def _record_hallucination(self, state: GraphState, is_grounded_in_facts: AnswerHallucination):
+        state["hallucination"] = "no" if is_grounded_in_facts.score == "yes" else "yes"
+        print("\nHallucination:      {}".format(state["hallucination"]))
+        
+        if is_grounded_in_facts.score == "no":
+            state["answer"] = {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"}
+        
+        print(f"\nDECISION: generation is {'grounded in documents' if is_grounded_in_facts.score == 'yes' else 'not grounded in documents, re-try'}")
+        return state
+    
+    
+    def _hallucination_failed(self, state: GraphState, e: Exception):
+        print(f"KeyError: {e}. _hallucination_check() - Response may not contain expected fields.")
+        state["hallucination"] = "yes"
         return state
 
 
@@ -374,29 +654,239 @@ class KnowledgeBaseSystem:
         Returns:
             state (dict): Updated state 'answer_useful' key with the result of the answer check.
         """
-        print("\n--- FINAL ANSWER CHECK ---")
+        self._start_node(state, "FINAL ANSWER CHECK", "answer_check")
+        try:
+            return self._record_answer_check(state, self.answer_grader_chain.invoke(self._answer_check_inputs(state)))
+        except Exception as e:
+            return self._answer_check_failed(state, e)
+    
+    
+    def _answer_check_inputs(self, state: GraphState) -> dict:
+        print("\nQuestion:      {}".format(state["question"]))
+        print("\nAnswer:      {}".format(state["answer"]['answer']))
+        return {"question": state["question"], "generation": state["answer"]}
+    
+    
+    def _record_answer_check(self, state: GraphState, score: dict):
+        state["answer_useful"] = "useful" if score["score"] == "yes" else "not useful"
+        print(f"\nDECISION: generation {'addresses' if score['score'] == 'yes' else 'does not address'} question")
         
-        if "execution_path" in state:
-            state['execution_path'].extend(["answer_check"])
+        if score["score"] == "no":
+            state["answer"] = {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"} 
+        return state
+    
+    
+    def _answer_check_failed(self, state: GraphState, e: Exception):
+        print(f"KeyError: {e}. _answer_check() - Response may not contain expected fields.")
+        state["answer_useful"] = "not useful"
+        return state
+    
 
+    # FAN-OUT NODES
+    # With GRAPH_FAN_OUT, the domain check, the retrieval with its grading and the question
+    # classification run as parallel branches of the graph. Each branch works on a copy of the
+    # state and returns only its own keys, the join keeps the speculative results when the
+    # question is in the domain and writes the execution path the serial graph would take.
+    
+    SPECULATIVE_RETRIEVAL_KEYS = ('documents', 'document_scores', 'grade_documents', 'grading_calls_saved')
+    
+    def _branch_check_query_domain(self, state: GraphState):
+        branch = self._check_query_domain({**state, 'execution_path': []})
+        return {'q_domain_relevance': branch['q_domain_relevance'], 'answer': branch['answer']}
+    
+    
+    def _branch_retrieve(self, state: GraphState):
         try:
-            print("\nQuestion:      {}".format(state["question"]))
-            print("\nAnswer:      {}".format(state["answer"]['answer']))
+            branch = self._grade_documents(self._retrieve({**state, 'execution_path': []}))
+            return {'speculative_retrieval': {key: branch[key] for key in self.SPECULATIVE_RETRIEVAL_KEYS}}
+        except Exception as e:
+            print(f"Exception: {e}. _branch_retrieve() - Retrieval left to the serial path.")
+            return {'speculative_retrieval': None}
+    
+    
+    def _branch_question_classifier(self, state: GraphState):
+        branch = self._question_classifier({**state, 'execution_path': []})
+        return {'speculative_question_type': branch['question_type']}
+    
+    
+    def _join_branches(self, state: GraphState):
+        """
+        Fan-in of the parallel branches. Out of the domain, the speculative documents and
+        question type are discarded: the question is rephrased and goes through the serial path.
             
-            score = self.answer_grader_chain.invoke({"question": state["question"], "generation": state["answer"]})
-
-            state["answer_useful"] = "useful" if score["score"] == "yes" else "not useful"
-            print(f"\nDECISION: generation {'addresses' if score['score'] == 'yes' else 'does not address'} question")
+        Returns:
+            state (dict): Updated state with the graded documents of the speculative retrieval, if kept.
+        """
+        print("\n--- JOIN BRANCHES ---")
+        execution_path = state['execution_path'] + ["check_query_domain"]
+        
+        if state['q_domain_relevance'] != 'yes':
+            print("\nSpeculative retrieval and classification discarded")
+            return {'execution_path': execution_path, 'speculative_question_type': None}
+        if state.get('speculative_retrieval') is None:
+            return {'execution_path': execution_path}
+        return {**state['speculative_retrieval'], 'execution_path': execution_path + ["retrieve", "grade_docs"]}
+    
+    
+    def _use_question_classification(self, state: GraphState):
+        """
+        Takes the question type of the speculative classification, in place of the question_classification node.
             
-            if score["score"] == "no":
-                state["answer"] = {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"} 
-                
+        Returns:
+            state (dict): Updated state with 'question_type' key containing the classification.
+        """
+        if "execution_path" in state:
+            state['execution_path'].extend(["question_classification"])
+        
+        state["question_type"] = state["speculative_question_type"]
+        print("\nQuestion Type: {}".format("math" if state["question_type"] == "yes" else "text"))
+        return state
+    
+
+    # ASYNC NODES
+    # Same nodes for the async app, sharing their state bookkeeping: the LLM and search calls are
+    # awaited, the vector search (local and CPU bound) runs in a worker thread.
+    
+    async def _acheck_query_domain(self, state: GraphState):
+        inputs = self._query_domain_inputs(state)
+        try:
+            return self._record_query_domain(state, await self.query_domain_check.ainvoke(inputs))
         except Exception as e:
-            print(f"KeyError: {e}. _answer_check() - Response may not contain expected fields.")
-            state["answer_useful"] = "not useful"
-            
+            return self._query_domain_failed(state, e)
+    
+    
+    async def _arephrase_query(self, state: GraphState):
+        inputs = self._rephrase_inputs(state)
+        try:
+            return self._record_rephrase(state, await self.rephrase_query_chain.ainvoke(inputs))
+        except Exception as e:
+            return self._rephrase_failed(state, e)
+    
+    
+    async def _aretrieve(self, state: GraphState):
+        if not self._start_retrieve(state):
+            return state
+
+        query = state["question"]
+        if self.chat_history:
+            query = self._standalone_question(state) or await self.rephrase_retrieval_query_chain.ainvoke({"input": state["question"], "chat_history": self.chat_history})
+        
+        for k in self._k_steps():
+            documents, scores = await asyncio.to_thread(self._search, query, k)
+            if self._enough_candidates(k, documents, scores):
+                break
+        return self._record_retrieval(state, documents, scores)
+    
+    
+    async def _agrade_documents(self, state: GraphState):
+        start_time = self._start_grading(state)
+        question, documents = state["question"], state["documents"]
+        try: 
+            relevant, pending, calls_saved = self._gate_documents(state)
+            if cfg.GRADING_MODE == "single_prompt" and pending:
+                grades = await self.retrieval_grader_documents_chain.ainvoke(self._numbered_documents(question, documents, pending))
+                calls_saved += self._record_single_prompt(grades, pending, relevant)
+            else:
+                n_graded = 0
+                for wave in self._grading_waves(pending, relevant):
+                    grades = await self.retrieval_grader_document_chain.abatch(self._wave_inputs(question, documents, wave), config={"max_concurrency": self._wave_size()})
+                    n_graded += self._record_wave(grades, wave, relevant)
+                calls_saved += len(pending) - n_graded
+            filtered_docs = [documents[i] for i in sorted(relevant)]
+        except Exception as e:
+            print(f"KeyError: {e}. _agrade_documents() - Response may not contain expected fields.")
+            filtered_docs = []
+            calls_saved = 0
+        
+        return self._record_grades(state, filtered_docs, calls_saved, start_time)
+    
+    
+    async def _agenerate(self, state: GraphState, writer: StreamWriter = None):
+        inputs = self._generation_inputs(state)
+        try:
+            if state.get("stream_tokens") and writer:
+                generation = AnswerWithSources(**await self._astream_tokens(self.generate_answer_stream, inputs, self._render_answer, writer))
+            else:
+                generation = await self.generate_answer.ainvoke(inputs)
+            return self._record_generation(state, generation)
+        except Exception as e:
+            return self._generation_failed(state, e)
+    
+    
+    async def _aquestion_classifier(self, state: GraphState):
+        self._start_node(state, "QUESTION CLASSIFIER", "question_classification")
+        try:
+            return self._record_question_type(state, await self.question_classifier.ainvoke({"question": state["question"]}))
+        except Exception as e:
+            return self._question_type_failed(state, e)
+    
+    
+    async def _amath_generate(self, state: GraphState, writer: StreamWriter = None):
+        inputs = self._math_inputs(state)
+        try:
+            if state.get("stream_tokens") and writer:
+                generation = AnswerWithSourcesMath(**await self._astream_tokens(self.chain_math_numexpr_stream, inputs, self._render_math_steps, writer))
+            else:
+                generation = await self.chain_math_numexpr.ainvoke(inputs)
+            self._set_math_answer(state, generation)
+        except Exception as e:
+            try:
+                self._set_math_web_answer(state, await self.chain_math_not_numexpr.ainvoke(inputs))
+            except Exception as e:
+                self._set_math_error(state)
+                
         return state
     
+    
+    async def _astream_tokens(self, chain, inputs: dict, render, writer: StreamWriter) -> dict:
+        streamed, output = "", {}
+        async for output in chain.astream(inputs):
+            streamed = self._write_new_text(streamed, render(output), writer)
+        return output
+    
+    
+    async def _addg_search(self, state: GraphState):
+        self._start_node(state, "DDG SEARCH", "ddg_search")
+        try:
+            return self._record_ddg_documents(state, await self.search_ddg_search_results.ainvoke({"query": state["question"]}))
+        except Exception as e:
+            return self._ddg_search_failed(state, e)
+    
+    
+    async def _ahallucination_check(self, state: GraphState):
+        self._start_node(state, "HALLUCINATIONS CHECK", "hallucination_check")
+        try:
+            return self._record_hallucination(state, await self.hallucination_grader_chain.ainvoke(self._hallucination_inputs(state)))
+        except Exception as e:
+            return self._hallucination_failed(state, e)
+    
+    
+    async def _aanswer_check(self, state: GraphState):
+        self._start_node(state, "FINAL ANSWER CHECK", "answer_check")
+        try:
+            return self._record_answer_check(state, await self.answer_grader_chain.ainvoke(self._answer_check_inputs(state)))
+        except Exception as e:
+            return self._answer_check_failed(state, e)
+    
+    
+    async def _abranch_check_query_domain(self, state: GraphState):
+        branch = await self._acheck_query_domain({**state, 'execution_path': []})
+        return {'q_domain_relevance': branch['q_domain_relevance'], 'answer': branch['answer']}
+    
+    
+    async def _abranch_retrieve(self, state: GraphState):
+        try:
+            branch = await self._agrade_documents(await self._aretrieve({**state, 'execution_path': []}))
+            return {'speculative_retrieval': {key: branch[key] for key in self.SPECULATIVE_RETRIEVAL_KEYS}}
+        except Exception as e:
+            print(f"Exception: {e}. _abranch_retrieve() - Retrieval left to the serial path.")
+            return {'speculative_retrieval': None}
+    
+    
+    async def _abranch_question_classifier(self, state: GraphState):
+        branch = await self._aquestion_classifier({**state, 'execution_path': []})
+        return {'speculative_question_type': branch['question_type']}
+    
 
     def invoke(self, inputs):
         """
@@ -405,6 +895,81 @@ class KnowledgeBaseSystem:
         Returns:
             answer (dict): The answer to the question.
         """
+        self._prepare_inputs(inputs)
+        cached, cache_key = self._cached_answer(inputs)
+        if cached is not None:
+            return self._record_answer(inputs, cached)
+        try:
+            answer = self.app.invoke(inputs)
+        except Exception as e:
+            print("\nException:   {}".format(e))            
+            answer = {"answer": "I don't know the answer to that question", "metadata": "No metadata"}
+        
+        self._cache_answer(cache_key, answer)
+        return self._record_answer(inputs, answer)
+    
+    
+    async def ainvoke(self, inputs):
+        """
+        Async version of invoke(), running the async graph: the LLM and search calls are awaited,
+        so one event loop serves many conversations at once.
+
+        Returns:
+            answer (dict): The answer to the question.
+        """
+        self._prepare_inputs(inputs)
+        cached, cache_key = await asyncio.to_thread(self._cached_answer, inputs)
+        if cached is not None:
+            return self._record_answer(inputs, cached)
+        try:
+            answer = await self.async_app.ainvoke(inputs)
+        except Exception as e:
+            print("\nException:   {}".format(e))            
+            answer = {"answer": "I don't know the answer to that question", "metadata": "No metadata"}
+        
+        self._cache_answer(cache_key, answer)
+        return self._record_answer(inputs, answer)
+    
+    
+    def stream(self, inputs):
+        """
+        Streaming version of invoke(): the answer tokens are yielded while the answer is generated,
+        before the hallucination and usefulness checks.
+
+        Yields:
+            tuple: ("token", text) for each new piece of the answer, ("generated", state) once the
+                   answer is generated and ("answer", state) with the final state, after the checks.
+        """
+        self._prepare_inputs(inputs)
+        inputs['stream_tokens'] = True
+        start_time = time.time()
+        self.time_to_first_token = None
+        cached, cache_key = self._cached_answer(inputs)
+        if cached is not None:
+            yield "answer", self._record_answer(inputs, cached)
+            return
+        answer = inputs
+        try:
+            for mode, chunk in self.stream_app.stream(inputs, stream_mode=["custom", "values"]):
+                if mode == "custom":
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.time() - start_time
+                        print("\nTime to first token:    {:.2f} seconds".format(self.time_to_first_token))
+                    yield "token", chunk['token']
+                    continue
+                answer = chunk
+                if answer['execution_path'] and answer['execution_path'][-1] in ("generate", "math_generate"):
+                    yield "generated", answer
+        except Exception as e:
+            print("\nException:   {}".format(e))
+            answer = {**inputs, "answer": {"answer": "I don't know the answer to that question", "metadata": "No metadata"}}
+        
+        print("\nTime to answer:         {:.2f} seconds".format(time.time() - start_time))
+        self._cache_answer(cache_key, answer)
+        yield "answer", self._record_answer(inputs, answer)
+    
+    
+    def _prepare_inputs(self, inputs):
         print("\n--- INOVKE START ---")
         print('\nDomain:       {}'.format(inputs['domain']))
         print("\nQuestion:     {}".format(inputs['question']))
@@ -412,12 +977,47 @@ class KnowledgeBaseSystem:
         # Initialize the inputs with 'execution_path' key for the Unit Test
         inputs['execution_path'] = []
         inputs['question_type'] = 'error'
-        try:
-            answer = self.app.invoke(inputs)
-        except Exception as e:
-            print("\nException:   {}".format(e))            
-            answer = {"answer": "I don't know the answer to that question", "metadata": "No metadata"}
+        inputs['grading_calls_saved'] = 0
+    
+    
+    def _cached_answer(self, inputs):
+        """
+        Look the question up in the answer cache, within the current retrieval scope. A follow-up
+        question (with chat history) is looked up as the standalone question the retrieval searches
+        with, made here once and reused by the retrieve node.
         
+        Returns:
+            tuple: The cached final state (None on a miss or without cache) and the key to cache the answer under.
+        """
+        if self.answer_cache is None:
+            return None, None
+        
+        question = inputs['question']
+        if self.chat_history:
+            try:
+                question = self.rephrase_retrieval_query_chain.invoke({"input": question, "chat_history": self.chat_history})
+            except Exception as e:
+                print(f"Exception: {e}. _cached_answer() - Answer cache skipped.")
+                return None, None
+            inputs['standalone_question'] = (inputs['question'], question)
+        
+        cached, cache_key = self.answer_cache.get(inputs['domain'], question, self.chunk_filter)
+        stats = self.answer_cache.stats()
+        print("\nAnswer cache:           {} (hit rate {:.0%} of {} lookups)".format(
+            "hit, similarity {:.3f}".format(cached['cache_similarity']) if cached else "miss", stats['hit_rate'], stats['hits'] + stats['misses']))
+        if cached is None:
+            return None, cache_key
+        return {**inputs, **cached}, cache_key
+    
+    
+    def _cache_answer(self, cache_key, answer):
+        # Only the answers that passed the final answer check are served again
+        if cache_key is not None and answer.get('answer_useful') == "useful":
+            self.answer_cache.put(cache_key, answer)
+    
+    
+    def _record_answer(self, inputs, answer):
+        print("\nGrading LLM calls saved:    {}".format(answer.get('grading_calls_saved', 0)))
         self.chat_history.extend([HumanMessage(content=inputs['question']), AIMessage(content=answer['answer']['answer'])])
         self.chat_rephrased_history.extend([HumanMessage(content=answer['question']), AIMessage(content=answer['answer']['answer'])])   
         return answer
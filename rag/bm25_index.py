@@ -0,0 +1,285 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import List, Optional, Tuple
+
+from config import Config as cfg
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+from rag.chunk_filter import ChunkFilter
+
+# The journal is folded into the index file once it has more records than the index has chunks, and at least this many
+JOURNAL_MIN_RECORDS = 1000
+# The deleted rows are compacted away once they are more than a quarter of the rows, and at least this many
+COMPACT_MIN_DELETED = 1000
+
+# Words, numbers and identifiers such as "3.14", "x-ray" or "B0-7X", also indexed by their parts
+TOKEN_PATTERN = re.compile(r'\w+(?:[.\-/]\w+)*')
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r'[.\-/]', token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted BM25 index of the ingested chunks, kept next to the vector collection and
+    updated with it, for the exact identifiers, numbers and names the dense retrieval
+    tends to miss.
+
+    The index file holds the chunks (ids, texts and metadata) with their postings and
+    lengths, so it loads without tokenizing them again. The chunks added and deleted
+    since are appended to a journal by save() and replayed when the index is loaded.
+    The index file is only rewritten, without the deleted rows, once the journal
+    outgrows it or the deleted rows make up a quarter of the index.
+    """
+
+    def __init__(self, path: str = None, reset: bool = False):
+        print("bm25_index.py - __init__()")
+        self.path = path or cfg.BM25_INDEX_PATH
+        self.journal_path = f"{os.path.splitext(self.path)[0]}.log"
+        self.lock = threading.Lock()
+
+        self.ids, self.texts, self.metadatas = [], [], []
+        self.rows = {}
+        self.deleted = set()
+        self.postings = defaultdict(dict)
+        self.doc_lengths = []
+        self.total_length = 0
+        # Journal records of the changes not saved yet
+        self.pending = []
+        self.n_journaled = 0
+
+        if not reset and os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                entry = json.load(f)
+            self.ids, self.texts, self.metadatas, self.doc_lengths = entry['ids'], entry['texts'], entry['metadatas'], entry['doc_lengths']
+            self.rows = {pk: row for row, pk in enumerate(self.ids)}
+            self.postings = defaultdict(dict, {term: dict(zip(rows, tfs)) for term, (rows, tfs) in entry['postings'].items()})
+            self.total_length = sum(self.doc_lengths)
+            self._replay_journal()
+        # A reset or new index is written whole on its first save, discarding the journal of the previous one
+        self.saved = bool(self.ids)
+
+
+    def __len__(self):
+        return len(self.ids) - len(self.deleted)
+
+
+    def add(self, chunks: List[Document], ids: List[str]):
+        with self.lock:
+            # An existing id is replaced
+            for pk in ids:
+                if pk in self.rows:
+                    self._delete(pk)
+            for pk, chunk in zip(ids, chunks):
+                term_counts = Counter(tokenize(chunk.page_content))
+                self._add(pk, chunk.page_content, chunk.metadata, term_counts)
+                self.pending.append(["add", pk, chunk.page_content, chunk.metadata, term_counts])
+
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            for pk in ids:
+                if pk in self.rows:
+                    self._delete(pk)
+
+
+    def drop(self):
+        """
+        Delete the index and its files, e.g. with the tenant of a reset session.
+        """
+        with self.lock:
+            for path in (self.path, self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.ids, self.texts, self.metadatas, self.doc_lengths = [], [], [], []
+            self.rows, self.deleted, self.postings, self.total_length = {}, set(), defaultdict(dict), 0
+            self.pending, self.n_journaled, self.saved = [], 0, False
+
+
+    def ids_where(self, chunk_filter: ChunkFilter) -> List[str]:
+        """
+        Returns:
+            list: The ids of the chunks matching the filter.
+        """
+        with self.lock:
+            return [pk for pk, row in self.rows.items() if chunk_filter.matches(self.metadatas[row])]
+
+
+    def search(self, query: str, k: int, chunk_filter: Optional[ChunkFilter] = None) -> List[Tuple[Document, float]]:
+        """
+        Returns:
+            list: The k best (Document, BM25 score) pairs matching the filter, best first.
+        """
+        with self.lock:
+            n_docs = len(self)
+            if n_docs == 0:
+                return []
+            average_length = self.total_length / n_docs
+
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for row, tf in postings.items():
+                    if chunk_filter and not chunk_filter.matches(self.metadatas[row]):
+                        continue
+                    length_norm = 1 - cfg.BM25_B + cfg.BM25_B * self.doc_lengths[row] / average_length
+                    scores[row] += idf * tf * (cfg.BM25_K1 + 1) / (tf + cfg.BM25_K1 * length_norm)
+
+            best_rows = sorted(scores, key=scores.get, reverse=True)[:k]
+            return [(Document(page_content=self.texts[row], metadata=self.metadatas[row]), scores[row]) for row in best_rows]
+
+
+    def save(self):
+        """
+        Append the changes since the last save to the journal, or rewrite the index file
+        when the journal outgrows it or too many rows are deleted.
+        """
+        with self.lock:
+            n_records = self.n_journaled + len(self.pending)
+            if (not self.saved or n_records > max(len(self), JOURNAL_MIN_RECORDS)
+                    or len(self.deleted) > max(COMPACT_MIN_DELETED, len(self.ids) // 4)):
+                self._save()
+            elif self.pending:
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    for record in self.pending:
+                        f.write(json.dumps(record) + "\n")
+                self.n_journaled = n_records
+            self.pending = []
+
+
+    def _add(self, pk: str, text: str, metadata: dict, term_counts: dict):
+        row = len(self.ids)
+        self.ids.append(pk)
+        self.texts.append(text)
+        self.metadatas.append(metadata)
+        self.rows[pk] = row
+
+        for term, tf in term_counts.items():
+            self.postings[term][row] = tf
+        doc_length = sum(term_counts.values())
+        self.doc_lengths.append(doc_length)
+        self.total_length += doc_length
+
+
+    def _delete(self, pk: str):
+        # The terms are journaled with the deletion, so replaying it does not tokenize the text again
+        terms = sorted(set(tokenize(self.texts[self.rows[pk]])))
+        self._delete_row(self.rows.pop(pk), terms)
+        self.pending.append(["delete", pk, terms])
+
+
+    def _delete_row(self, row: int, terms: List[str]):
+        self.deleted.add(row)
+        for term in terms:
+            self.postings[term].pop(row, None)
+        self.total_length -= self.doc_lengths[row]
+
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Last record cut by a crash
+                # An add already in the index file was journaled before a crash cut the rewrite short
+                if record[0] == "add" and record[1] not in self.rows:
+                    self._add(*record[1:])
+                elif record[0] == "delete" and record[1] in self.rows:
+                    self._delete_row(self.rows.pop(record[1]), record[2])
+                self.n_journaled += 1
+
+
+    def _save(self):
+        self._compact()
+        postings = {term: [list(postings), list(postings.values())] for term, postings in self.postings.items()}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'ids': self.ids, 'texts': self.texts, 'metadatas': self.metadatas, 'doc_lengths': self.doc_lengths, 'postings': postings}, f)
+        os.replace(tmp_path, self.path)
+        # The journal is now part of the index file
+        open(self.journal_path, "w").close()
+        self.n_journaled = 0
+        self.saved = True
+
+
+    def _compact(self):
+        """
+        Drop the deleted rows and renumber the others, in the postings too.
+        """
+        if not self.deleted:
+            return
+        keep = [row for row in range(len(self.ids)) if row not in self.deleted]
+        new_rows = {row: i for i, row in enumerate(keep)}
+        self.ids = [self.ids[row] for row in keep]
+        self.texts = [self.texts[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self.doc_lengths = [self.doc_lengths[row] for row in keep]
+        self.rows = {pk: row for row, pk in enumerate(self.ids)}
+        self.postings = defaultdict(dict, {term: {new_rows[row]: tf for row, tf in postings.items()} 
+                                           for term, postings in self.postings.items() if postings})
+        self.deleted = set()
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses the BM25 and the dense results with reciprocal rank fusion: each chunk scores
+    the sum of 1 / (HYBRID_RRF_K + rank) over the two rankings, so a chunk ranked well
+    by either retriever comes up without calibrating their scores against each other.
+    """
+    vector_retriever: BaseRetriever
+    bm25_index: BM25Index
+    k: int = 4
+    fetch_k: int = 10
+    rrf_k: int = 60
+    chunk_filter: Optional[ChunkFilter] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [doc for doc, _ in self.search_with_scores(query, self.k)]
+
+
+    def search_with_scores(self, query: str, k: int = None) -> List[Tuple[Document, Optional[float]]]:
+        """
+        Returns:
+            list: The k best fused (Document, cosine similarity) pairs, best first. The
+                  similarity is None for the chunks found by BM25 only.
+        """
+        k = k or self.k
+        fetch_k = max(self.fetch_k, k)
+        if hasattr(self.vector_retriever, 'search_with_scores'):
+            dense_pairs = self.vector_retriever.search_with_scores(query, fetch_k)
+        else:
+            dense_pairs = [(doc, None) for doc in self.vector_retriever.invoke(query)]
+        lexical_pairs = [(doc, None) for doc, _ in self.bm25_index.search(query, fetch_k, self.chunk_filter)]
+
+        scores, docs = defaultdict(float), {}
+        for ranking in (dense_pairs, lexical_pairs):
+            for rank, (doc, similarity) in enumerate(ranking):
+                key = (doc.metadata.get('source'), doc.page_content)
+                scores[key] += 1 / (self.rrf_k + rank + 1)
+                if key not in docs or docs[key][1] is None:
+                    docs[key] = (doc, similarity)
+
+        best_keys = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [docs[key] for key in best_keys]
@@ -0,0 +1,37 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ChunkFilter:
+    """
+    Scalar filter on the chunk metadata, to search within some sources (their 'source_id')
+    and / or a page range (first and last 'page', inclusive).
+    """
+    source_ids: Optional[Tuple[str, ...]] = None
+    pages: Optional[Tuple[int, int]] = None
+
+
+    def __bool__(self):
+        return self.source_ids is not None or self.pages is not None
+
+
+    def matches(self, metadata: dict) -> bool:
+        if self.source_ids is not None and metadata.get('source_id') not in self.source_ids:
+            return False
+        if self.pages is not None and not self.pages[0] <= metadata.get('page', 0) <= self.pages[1]:
+            return False
+        return True
+
+
+    def to_expr(self) -> str:
+        """
+        Returns:
+            str: The Milvus boolean expression of the filter, "" if it is empty.
+        """
+        conditions = []
+        if self.source_ids is not None:
+            conditions.append(f"source_id in {list(self.source_ids)}")
+        if self.pages is not None:
+            conditions.append(f"page >= {int(self.pages[0])} and page <= {int(self.pages[1])}")
+        return " and ".join(conditions)
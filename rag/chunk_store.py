@@ -0,0 +1,133 @@
+import io
+import re
+from array import array
+from collections.abc import Sequence
+
+from langchain_core.documents import Document
+from utils.text_doc_processing import source_metadata
+
+WHITESPACE = re.compile(r'\s+')
+
+
+class ChunkStore(Sequence):
+    """
+    Compact chunk representation for the ingestion path.
+
+    Each source is kept as one cleaned text buffer and each chunk as a
+    (start, end, source_id, page) record in typed arrays, so overlapping chunks
+    do not copy their text. Reading an item builds its Document on demand, which
+    happens only when the chunk is sent to the embedder or the LLM.
+    """
+
+    def __init__(self):
+        self.buffers = []
+        self.file_names = []
+        self.starts = array('q')
+        self.ends = array('q')
+        self.source_ids = array('i')
+        self.pages = array('i')
+
+
+    def add_source(self, file_name: str, documents, text_splitter):
+        """
+        Cleans the loaded documents of a source in one pass, appends them to the source
+        buffer and records the offsets of their chunks. Chunks never cross a document
+        (page) boundary, as with split_documents().
+
+        Returns:
+            int: The id of the source.
+        """
+        print("chunk_store.py - add_source()")
+        source_id = len(self.buffers)
+        is_pdf = file_name.endswith('.pdf')
+        buffer = io.StringIO()
+        offset = 0
+
+        for doc in documents:
+            text = WHITESPACE.sub(' ', doc.page_content).strip()
+            page = int(doc.metadata.get('page', 0)) if is_pdf else -1
+
+            for start, end in self._split_offsets(text, text_splitter):
+                self.starts.append(offset + start)
+                self.ends.append(offset + end)
+                self.source_ids.append(source_id)
+                self.pages.append(page)
+
+            buffer.write(text)
+            offset += len(text)
+
+        self.buffers.append(buffer.getvalue())
+        self.file_names.append(file_name)
+        return source_id
+
+
+    def _split_offsets(self, text: str, text_splitter):
+        """
+        Offsets of the chunks of a text, from the splitter when it provides them, otherwise
+        found the same way as the splitter's add_start_index.
+
+        Yields:
+            tuple: (start, end) of each chunk in the text.
+        """
+        if hasattr(text_splitter, 'split_offsets'):
+            yield from text_splitter.split_offsets(text)
+            return
+
+        index, previous_chunk_len = 0, 0
+        for piece in text_splitter.split_text(text):
+            index = text.find(piece, max(0, index + previous_chunk_len - text_splitter._chunk_overlap))
+            if index < 0:
+                index = text.find(piece)
+            previous_chunk_len = len(piece)
+            yield index, index + len(piece)
+
+
+    def subset(self, indices) -> "ChunkStore":
+        """
+        Returns:
+            ChunkStore: A store of the selected chunks, sharing the text buffers of this one.
+        """
+        chunk_store = ChunkStore()
+        chunk_store.buffers = self.buffers
+        chunk_store.file_names = self.file_names
+        for i in indices:
+            chunk_store.starts.append(self.starts[i])
+            chunk_store.ends.append(self.ends[i])
+            chunk_store.source_ids.append(self.source_ids[i])
+            chunk_store.pages.append(self.pages[i])
+        return chunk_store
+
+
+    def text(self, i: int) -> str:
+        return self.buffers[self.source_ids[i]][self.starts[i]:self.ends[i]]
+
+
+    def source(self, i: int) -> str:
+        """
+        Returns:
+            str: The normalized 'source' metadata of a chunk, with the page number for PDFs.
+        """
+        file_name, page = self.file_names[self.source_ids[i]], self.pages[i]
+        return f"{file_name} - page: {page + 1}" if page >= 0 else file_name
+
+
+    def nbytes(self) -> int:
+        """
+        Returns:
+            int: Approximate memory held by the buffers and the records.
+        """
+        arrays = (self.starts, self.ends, self.source_ids, self.pages)
+        return sum(len(buffer) for buffer in self.buffers) + sum(a.itemsize * len(a) for a in arrays)
+
+
+    def __len__(self):
+        return len(self.starts)
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        page = self.pages[i]
+        return Document(page_content=self.text(i), metadata=source_metadata(self.file_names[self.source_ids[i]], page + 1 if page >= 0 else 0))
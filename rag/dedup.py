@@ -0,0 +1,103 @@
+import os
+import re
+import threading
+import zlib
+from collections import defaultdict
+from typing import List
+
+import numpy as np
+from config import Config as cfg
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+SHINGLE_SIZE = 5
+
+
+class MinHashIndex:
+    """
+    MinHash LSH index of the ingested chunks, used to skip near-duplicate chunks
+    (navigation text, disclaimers, boilerplate paragraphs) before they are embedded.
+
+    Each chunk is reduced to a signature of DEDUP_NUM_PERM min-hashes of its word
+    shingles. The signatures are split in DEDUP_BANDS bands to find candidates, which
+    are kept as duplicates when their estimated Jaccard similarity reaches
+    DEDUP_THRESHOLD. The signatures are saved next to the collection, so later uploads
+    are checked against the previously ingested chunks too.
+    """
+
+    def __init__(self, path: str = None, reset: bool = False):
+        print("dedup.py - __init__()")
+        self.path = path or cfg.DEDUP_INDEX_PATH
+        self.num_perm = cfg.DEDUP_NUM_PERM
+        self.bands = cfg.DEDUP_BANDS
+        self.rows = self.num_perm // self.bands
+        self.threshold = cfg.DEDUP_THRESHOLD
+        self.lock = threading.Lock()
+
+        generator = np.random.RandomState(1)
+        self.perm_a = generator.randint(1, 1 << 32, size=self.num_perm, dtype=np.uint64)
+        self.perm_b = generator.randint(0, 1 << 32, size=self.num_perm, dtype=np.uint64)
+
+        self.signatures = []
+        self.buckets = defaultdict(list)
+
+        if not reset and os.path.exists(self.path):
+            for signature in np.load(self.path):
+                self._insert(signature)
+
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The MinHash signature of the word shingles of a text.
+        """
+        words = re.findall(r"\w+", text.lower())
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+        hashes = np.array([zlib.crc32(shingle.encode()) for shingle in shingles], dtype=np.uint64)
+
+        permuted = (np.outer(hashes, self.perm_a) + self.perm_b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+    def filter_duplicates(self, texts: List[str]) -> List[bool]:
+        """
+        Checks the texts against the index and against each other, and adds the new ones.
+
+        Returns:
+            list: True for each text to keep, False for the near-duplicates.
+        """
+        print("dedup.py - filter_duplicates()")
+        keep = []
+        with self.lock:
+            for text in texts:
+                signature = self.signature(text)
+                is_duplicate = self._is_duplicate(signature)
+                if not is_duplicate:
+                    self._insert(signature)
+                keep.append(not is_duplicate)
+        return keep
+
+
+    def save(self):
+        with self.lock:
+            signatures = np.array(self.signatures, dtype=np.uint32).reshape(-1, self.num_perm)
+            with open(f"{self.path}.tmp", "wb") as f:
+                np.save(f, signatures)
+            os.replace(f"{self.path}.tmp", self.path)
+
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+
+    def _is_duplicate(self, signature: np.ndarray) -> bool:
+        candidates = {i for key in self._band_keys(signature) for i in self.buckets.get(key, ())}
+        return any(np.mean(self.signatures[i] == signature) >= self.threshold for i in candidates)
+
+
+    def _insert(self, signature: np.ndarray):
+        index = len(self.signatures)
+        self.signatures.append(signature)
+        for key in self._band_keys(signature):
+            self.buckets[key].append(index)
@@ -0,0 +1,118 @@
+import re
+import zlib
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+
+HASH_DIMENSIONS = 512
+MAX_CLUSTERING_CHUNKS = 2000
+KMEANS_ITERATIONS = 10
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count of a text (about 4 characters per token for English).
+
+    Returns:
+        int: Estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+
+def hashed_term_vectors(chunks: List[Document]) -> np.ndarray:
+    """
+    Builds L2 normalized hashed term-frequency vectors for the chunks.
+
+    They are cheap to compute compared to the embedding model, so a rejected
+    upload does not pay for embedding the whole document.
+
+    Returns:
+        np.ndarray: Matrix of shape (len(chunks), HASH_DIMENSIONS).
+    """
+    vectors = np.zeros((len(chunks), HASH_DIMENSIONS), dtype=np.float32)
+    for i, chunk in enumerate(chunks):
+        for token in re.findall(r"\w+", chunk.page_content.lower()):
+            vectors[i, zlib.crc32(token.encode()) % HASH_DIMENSIONS] += 1.0
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def select_representative_chunks(chunks: List[Document], n_samples: int, vectors: np.ndarray = None) -> List[Document]:
+    """
+    Picks n_samples chunks that represent the document, by clustering the chunk
+    vectors with k-means and taking the chunk closest to each centroid.
+
+    Documents longer than MAX_CLUSTERING_CHUNKS chunks are first subsampled at a
+    regular stride, so the cost does not grow with the document length.
+
+    Returns:
+        list: The selected chunks, in document order.
+    """
+    print("domain_sampling.py - select_representative_chunks()")
+    if len(chunks) <= n_samples:
+        return list(chunks)
+
+    candidates = np.linspace(0, len(chunks) - 1, min(len(chunks), MAX_CLUSTERING_CHUNKS)).astype(int)
+    candidates = np.unique(candidates)
+    if vectors is None:
+        vectors = hashed_term_vectors([chunks[i] for i in candidates])
+    else:
+        vectors = np.asarray(vectors, dtype=np.float32)[candidates]
+
+    # k-means with a deterministic spread-out initialization
+    centroids = vectors[np.linspace(0, len(vectors) - 1, n_samples).astype(int)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        for k in range(n_samples):
+            members = vectors[labels == k]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[k] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+    # The closest distinct chunk to each centroid
+    similarities = vectors @ centroids.T
+    selected = set()
+    for k in range(n_samples):
+        for i in np.argsort(-similarities[:, k]):
+            if i not in selected:
+                selected.add(int(i))
+                break
+
+    return [chunks[candidates[i]] for i in sorted(selected)]
+
+
+def pack_under_budget(chunks: List[Document], token_budget: int, group_tokens: int) -> List[List[Document]]:
+    """
+    Packs the chunks into groups of at most group_tokens tokens, stopping once
+    token_budget tokens have been used overall. Chunks bigger than the space
+    left are truncated.
+
+    Returns:
+        list: Groups of chunks, one LLM call each in the map step.
+    """
+    print("domain_sampling.py - pack_under_budget()")
+    groups, group, group_size, used = [], [], 0, 0
+
+    for chunk in chunks:
+        room = min(group_tokens - group_size, token_budget - used)
+        if room <= 0 and group:
+            groups.append(group)
+            group, group_size = [], 0
+            room = min(group_tokens, token_budget - used)
+        if room <= 0:
+            break
+
+        tokens = estimate_tokens(chunk.page_content)
+        if tokens > room:
+            chunk = Document(page_content=chunk.page_content[:(room - 1) * 4], metadata=chunk.metadata)
+            tokens = room
+
+        group.append(chunk)
+        group_size += tokens
+        used += tokens
+
+    if group:
+        groups.append(group)
+    return groups
@@ -0,0 +1,42 @@
+from config import Config as cfg
+from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+
+EMBEDDING_BACKENDS = ("torch", "int8", "onnx")
+
+
+def load_embedding_model(model_name: str = None, backend: str = None) -> HuggingFaceBgeEmbeddings:
+    """
+    Loads the embedding model on CPU with one of the EMBEDDING_BACKENDS:
+
+    - "torch": the PyTorch fp32 model.
+    - "int8": the PyTorch model with its Linear layers dynamically quantized to int8.
+    - "onnx": the model exported to ONNX and run with ONNX Runtime (sentence-transformers ONNX backend).
+
+    All of them keep the SentenceTransformer interface, so the embedding engine and
+    the embedding cache work the same on top of any backend.
+
+    Returns:
+        HuggingFaceBgeEmbeddings: The embedding model, with normalized embeddings.
+    """
+    model_name = model_name or cfg.EMBEDDING_MODEL
+    backend = backend or cfg.EMBEDDING_BACKEND
+    print(f"embedding_backends.py - load_embedding_model({model_name}, {backend})")
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+
+    model_kwargs = {'device': 'cpu'}
+    if backend == "onnx":
+        model_kwargs['backend'] = "onnx"
+
+    hf = HuggingFaceBgeEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={'normalize_embeddings': True}
+    )
+
+    if backend == "int8":
+        import torch
+        torch.quantization.quantize_dynamic(hf.client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    return hf
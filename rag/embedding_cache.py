@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.embeddings import Embeddings
+
+# The journal is folded into the index file once it has more records than the index has entries, and at least this many
+JOURNAL_MIN_RECORDS = 1000
+
+
+class EmbeddingCache(Embeddings):
+    """
+    Persistent cache of the embeddings of the chunks and queries, in front of the
+    embedding model.
+
+    An entry is keyed by the model name, the normalization flag and the hash of the
+    text (queries and documents apart, they get different instructions). The vectors
+    are rows of a memory-mapped float32 matrix of EMBEDDING_CACHE_MAX_ENTRIES rows and
+    the index file maps the keys to their rows in least recently used order; when the
+    matrix is full, the row of the least recently used entry is reused.
+
+    The new entries and the hits are appended to a journal replayed over the index when
+    the cache is opened, so a call only writes its own keys; the index file is rewritten
+    once the journal outgrows it.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, normalize: bool, cache_dir: str = None, max_entries: int = None):
+        print("embedding_cache.py - __init__()")
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.normalize = normalize
+        self.max_entries = max_entries or cfg.EMBEDDING_CACHE_MAX_ENTRIES
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+        cache_dir = cache_dir or cfg.EMBEDDING_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        # One matrix per model, since the embedding size depends on it
+        prefix = hashlib.sha256(f"{model_name}|{normalize}".encode()).hexdigest()[:16]
+        self.matrix_path = os.path.join(cache_dir, f"{prefix}.f32")
+        self.index_path = os.path.join(cache_dir, f"{prefix}.json")
+        self.journal_path = os.path.join(cache_dir, f"{prefix}.log")
+
+        self.dim = None
+        self.matrix = None
+        self.index = OrderedDict()
+        self.n_journaled = 0
+        if os.path.exists(self.index_path) and os.path.exists(self.matrix_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry['max_entries'] == self.max_entries:
+                self._open_matrix(entry['dim'], "r+")
+                self.index = OrderedDict(entry['rows'])
+                self._replay_journal()
+        # The journal of a discarded index is discarded with it, the new index is saved on the first write
+        self.saved = self.matrix is not None
+        self.journal = open(self.journal_path, "a" if self.matrix is not None else "w", encoding="utf-8")
+
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        print("embedding_cache.py - embed_documents()")
+        return self._embed(texts, "document", self.embeddings.embed_documents)
+
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query", lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Number of cache 'hits' and 'misses', the 'hit_rate' and the number of 'entries'.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0, 'entries': len(self.index)}
+
+
+    def _key(self, text: str, kind: str) -> str:
+        digest = hashlib.sha256(f"{kind}\n{text}".encode()).hexdigest()
+        return f"{self.model_name}|{self.normalize}|{digest}"
+
+
+    def _embed(self, texts: List[str], kind: str, embed_function) -> List[List[float]]:
+        keys = [self._key(text, kind) for text in texts]
+        embeddings = [None] * len(texts)
+
+        with self.lock:
+            hit_keys = []
+            for i, key in enumerate(keys):
+                row = self.index.get(key)
+                if row is not None:
+                    self.index.move_to_end(key)
+                    embeddings[i] = self.matrix[row].tolist()
+                    hit_keys.append(key)
+            # The least recently used order changes with the hits too
+            if hit_keys:
+                self._journal([["hit", key] for key in dict.fromkeys(hit_keys)])
+
+        # Identical texts of one call are embedded once
+        missing = {}
+        for i, key in enumerate(keys):
+            if embeddings[i] is None:
+                missing.setdefault(key, []).append(i)
+
+        with self.lock:
+            self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+            self.misses += sum(len(positions) for positions in missing.values())
+        if not missing:
+            return embeddings
+
+        new_embeddings = embed_function([texts[positions[0]] for positions in missing.values()])
+        for positions, embedding in zip(missing.values(), new_embeddings):
+            for i in positions:
+                embeddings[i] = embedding
+
+        with self.lock:
+            records = [["put", key, self._put(key, embedding)] for key, embedding in zip(missing, new_embeddings)]
+            self.matrix.flush()
+            self._journal(records)
+        return embeddings
+
+
+    def _put(self, key: str, embedding: List[float]):
+        if self.matrix is None:
+            self._open_matrix(len(embedding), "w+")
+        if key in self.index:
+            row = self.index[key]
+            self.index.move_to_end(key)
+        elif len(self.index) < self.max_entries:
+            row = len(self.index)
+        else:
+            _, row = self.index.popitem(last=False)
+        self.matrix[row] = embedding
+        self.index[key] = row
+        return row
+
+
+    def _open_matrix(self, dim: int, mode: str):
+        self.dim = dim
+        self.matrix = np.memmap(self.matrix_path, dtype=np.float32, mode=mode, shape=(self.max_entries, dim))
+
+
+    def _journal(self, records: list):
+        for record in records:
+            self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+        self.n_journaled += len(records)
+        if self.n_journaled > max(len(self.index), JOURNAL_MIN_RECORDS) or not self.saved:
+            self._save()
+
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        keys = {row: key for key, row in self.index.items()}
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Last record cut by a crash
+                key = record[1]
+                if record[0] == "put":
+                    row = record[2]
+                    # A reused row evicted its previous key
+                    if keys.get(row, key) != key:
+                        self.index.pop(keys[row], None)
+                    self.index[key] = row
+                    keys[row] = key
+                if key in self.index:
+                    self.index.move_to_end(key)
+                self.n_journaled += 1
+
+
+    def _save(self):
+        self.matrix.flush()
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'dim': self.dim, 'max_entries': self.max_entries, 'rows': list(self.index.items())}, f)
+        os.replace(tmp_path, self.index_path)
+        # The journal is now part of the index
+        self.journal.truncate(0)
+        self.journal.seek(0)
+        self.n_journaled = 0
+        self.saved = True
@@ -0,0 +1,97 @@
+import threading
+import time
+from typing import List
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingEngine(Embeddings):
+    """
+    Batched embedding engine in front of the HuggingFaceBgeEmbeddings model, used by
+    the vector store for the ingested chunks and for the queries.
+
+    The texts of a call are sorted by token length and embedded in batches of
+    EMBEDDING_BATCH_SIZE, so each batch holds texts of similar length and little
+    padding is computed. The torch CPU threads are set to EMBEDDING_THREADS, and the
+    engine keeps the chunks/s and tokens/s of the embeddings computed so far.
+    """
+
+    def __init__(self, hf, batch_size: int = None, num_threads: int = None):
+        print("embedding_engine.py - __init__()")
+        self.hf = hf
+        self.client = hf.client
+        self.batch_size = batch_size or cfg.EMBEDDING_BATCH_SIZE
+        self.lock = threading.Lock()
+        self.n_chunks, self.n_tokens, self.n_padded_tokens, self.seconds = 0, 0, 0, 0.0
+
+        num_threads = num_threads or cfg.EMBEDDING_THREADS
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        print("embedding_engine.py - embed_documents()")
+        if not texts:
+            return []
+
+        start_time = time.perf_counter()
+        # Same preprocessing as HuggingFaceBgeEmbeddings.embed_documents()
+        texts = [self.hf.embed_instruction + text.replace("\n", " ") for text in texts]
+        lengths = self._token_lengths(texts)
+
+        embeddings = [None] * len(texts)
+        order = np.argsort(lengths, kind="stable")[::-1]
+        n_padded_tokens = 0
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            batch_embeddings = self.client.encode([texts[i] for i in batch], batch_size=len(batch), **self.hf.encode_kwargs)
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding.tolist()
+            n_padded_tokens += len(batch) * max(lengths[i] for i in batch)
+
+        self._record(len(texts), sum(lengths), n_padded_tokens, time.perf_counter() - start_time)
+        return embeddings
+
+
+    def embed_query(self, text: str) -> List[float]:
+        start_time = time.perf_counter()
+        text = self.hf.query_instruction + text.replace("\n", " ")
+        embedding = self.client.encode(text, **self.hf.encode_kwargs)
+
+        n_tokens = self._token_lengths([text])[0]
+        self._record(1, n_tokens, n_tokens, time.perf_counter() - start_time)
+        return embedding.tolist()
+
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Number of embedded 'chunks' and 'tokens', 'chunks_per_second', 'tokens_per_second'
+                  and the 'padding' share of the computed tokens.
+        """
+        with self.lock:
+            return {
+                'chunks': self.n_chunks,
+                'tokens': self.n_tokens,
+                'chunks_per_second': self.n_chunks / self.seconds if self.seconds > 0 else 0.0,
+                'tokens_per_second': self.n_tokens / self.seconds if self.seconds > 0 else 0.0,
+                'padding': 1 - self.n_tokens / self.n_padded_tokens if self.n_padded_tokens else 0.0,
+            }
+
+
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        input_ids = self.client.tokenizer(texts, truncation=True, max_length=self.client.max_seq_length)['input_ids']
+        return [len(ids) for ids in input_ids]
+
+
+    def _record(self, n_chunks: int, n_tokens: int, n_padded_tokens: int, seconds: float):
+        with self.lock:
+            self.n_chunks += n_chunks
+            self.n_tokens += n_tokens
+            self.n_padded_tokens += n_padded_tokens
+            self.seconds += seconds
+        seconds = max(seconds, 1e-9)
+        print(f"\nEmbedded {n_chunks} chunks: {n_chunks / seconds:.1f} chunks/s, {n_tokens / seconds:.1f} tokens/s")
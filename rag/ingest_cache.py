@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.documents import Document
+
+
+class IngestCache:
+    """
+    On-disk, content-addressed cache of processed uploads.
+
+    An entry is keyed by the file hash, the splitter config and the embedding model
+    name, and stores the chunks with their domain detection result (<key>.json) and
+    their embeddings (<key>.npy). Entries are evicted least recently used first when
+    the cache grows over INGEST_CACHE_MAX_BYTES; the file modification time tracks the
+    last use, so the order survives restarts.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        print("ingest_cache.py - __init__()")
+        self.cache_dir = cache_dir or cfg.INGEST_CACHE_DIR
+        self.max_bytes = max_bytes or cfg.INGEST_CACHE_MAX_BYTES
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    def make_key(self, file_path: str, model_name: str) -> str:
+        """
+        Builds the cache key of a file.
+
+        Returns:
+            str: Hex digest of the file content, splitter config and embedding model name.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        splitter_config = (cfg.SPLITTER_MODE, cfg.SPLITTER_CHUNK_SIZE, cfg.SPLITTER_CHUNK_OVERLAP, cfg.SPLITTER_TOKEN_CHUNK_SIZE, cfg.SPLITTER_TOKEN_CHUNK_OVERLAP)
+        digest.update(f"|{splitter_config}|{model_name}".encode())
+        return digest.hexdigest()
+
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Looks up an entry and marks it as recently used.
+
+        Returns:
+            dict: 'chunks', 'embeddings' (read-only memory map, None if never embedded) and 'detection',
+                  or None on a miss.
+        """
+        print("ingest_cache.py - get()")
+        json_path, npy_path = self._paths(key)
+
+        with self.lock:
+            if not os.path.exists(json_path):
+                return None
+            with open(json_path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # Mapped, not read: the inserts read it one batch at a time
+            embeddings = np.load(npy_path, mmap_mode='r') if os.path.exists(npy_path) else None
+            for path in (json_path, npy_path):
+                if os.path.exists(path):
+                    os.utime(path)
+
+        chunks = [Document(page_content=chunk['page_content'], metadata=chunk['metadata']) for chunk in entry['chunks']]
+        return {'chunks': chunks, 'embeddings': embeddings, 'detection': entry['detection']}
+
+
+    def put(self, key: str, chunks: List[Document], embeddings: Optional[List[List[float]]], detection: dict):
+        """
+        Stores an entry, then evicts the least recently used entries over the size cap.
+        """
+        print("ingest_cache.py - put()")
+        with self.writer(key, len(chunks), detection) as writer:
+            writer.write(chunks, embeddings)
+
+
+    def writer(self, key: str, n_chunks: Optional[int], detection: dict) -> "IngestCacheWriter":
+        """
+        Stores an entry batch by batch, so the chunks of a large upload are never all
+        serialized at once. The entry only replaces the previous one when the writer is
+        closed without error, then the least recently used entries over the size cap are evicted.
+        The number of chunks is None when it is not known up front (streamed upload).
+
+        Returns:
+            IngestCacheWriter: Context manager taking the n_chunks chunks (and embeddings) in order.
+        """
+        print("ingest_cache.py - writer()")
+        return IngestCacheWriter(self, key, n_chunks, detection)
+
+
+    def _commit(self, key: str, json_tmp_path: str, npy_tmp_path: Optional[str]):
+        json_path, npy_path = self._paths(key)
+        with self.lock:
+            os.replace(json_tmp_path, json_path)
+            if npy_tmp_path is not None:
+                os.replace(npy_tmp_path, npy_path)
+            elif os.path.exists(npy_path):
+                os.remove(npy_path)
+            self._evict()
+
+
+    def _paths(self, key: str):
+        return os.path.join(self.cache_dir, f"{key}.json"), os.path.join(self.cache_dir, f"{key}.npy")
+
+
+    def _evict(self):
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            key, extension = os.path.splitext(name)
+            if extension not in (".json", ".npy"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            size, last_used = entries.get(key, (0, 0.0))
+            entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime))
+
+        total_bytes = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total_bytes <= self.max_bytes:
+                break
+            print(f"ingest_cache.py - evict {key}")
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total_bytes -= size
+
+
+
+class IngestCacheWriter:
+    """
+    Writes an ingestion cache entry in batches: the chunks are appended to the JSON entry and
+    the embeddings to a memory-mapped .npy file sized for all the chunks, both under temporary
+    names until the writer is closed. When the number of chunks is not known, the embeddings
+    are appended to a raw float32 file, mapped into the .npy file once the writer is closed.
+    """
+
+    def __init__(self, cache: IngestCache, key: str, n_chunks: Optional[int], detection: dict):
+        self.cache = cache
+        self.key = key
+        self.n_chunks = n_chunks
+        self.n_written, self.n_embedded, self.dim = 0, 0, None
+        json_path, npy_path = cache._paths(key)
+        self.json_tmp_path, self.npy_tmp_path, self.raw_tmp_path = f"{json_path}.tmp", f"{npy_path}.tmp", f"{npy_path}.raw.tmp"
+        self.matrix, self.raw = None, None
+        self.file = open(self.json_tmp_path, "w", encoding="utf-8")
+        self.file.write(f'{{"detection": {json.dumps(detection)}, "chunks": [')
+
+
+    def write(self, chunks: List[Document], embeddings: Optional[List[List[float]]] = None):
+        for chunk in chunks:
+            self.file.write(", " if self.n_written else "")
+            json.dump({'page_content': chunk.page_content, 'metadata': chunk.metadata}, self.file)
+            self.n_written += 1
+        
+        if embeddings is not None and len(embeddings):
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            self.dim = embeddings.shape[1]
+            if self.n_chunks is None:
+                self.raw = self.raw or open(self.raw_tmp_path, "wb")
+                self.raw.write(embeddings.tobytes())
+            else:
+                if self.matrix is None:
+                    self.matrix = np.lib.format.open_memmap(self.npy_tmp_path, mode="w+", dtype=np.float32, shape=(self.n_chunks, self.dim))
+                self.matrix[self.n_written - len(embeddings):self.n_written] = embeddings
+            self.n_embedded += len(embeddings)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.write("]}")
+        self.file.close()
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        if self.raw is not None:
+            self.raw.close()
+            self.raw = None
+            if exc_type is None and self.n_embedded == self.n_written:
+                matrix = np.lib.format.open_memmap(self.npy_tmp_path, mode="w+", dtype=np.float32, shape=(self.n_written, self.dim))
+                matrix[:] = np.memmap(self.raw_tmp_path, dtype=np.float32, mode="r", shape=(self.n_written, self.dim))
+                matrix.flush()
+                del matrix
+            os.remove(self.raw_tmp_path)
+        
+        if exc_type is None and self.n_chunks in (None, self.n_written):
+            # The embeddings are only kept when every chunk has one
+            has_embeddings = os.path.exists(self.npy_tmp_path) and self.n_embedded == self.n_written
+            self.cache._commit(self.key, self.json_tmp_path, self.npy_tmp_path if has_embeddings else None)
+            if not has_embeddings and os.path.exists(self.npy_tmp_path):
+                os.remove(self.npy_tmp_path)
+            return False
+        
+        # A failed or incomplete ingestion leaves the previous entry, if any
+        for path in (self.json_tmp_path, self.npy_tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return False
@@ -0,0 +1,246 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+
+import chardet
+import fitz
+from config import Config as cfg
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import (Docx2txtLoader,
+                                                  PyMuPDFLoader, TextLoader,
+                                                  WebBaseLoader)
+from langchain_core.documents import Document
+from rag.chunk_store import ChunkStore
+from rag.splitter import SentenceTokenSplitter
+from utils import (clean_text, iter_clean_text, iter_normalize_documents,
+                   normalize_documents)
+
+LOADERS_TYPES = {
+    ".pdf": PyMuPDFLoader,
+    ".txt": TextLoader,
+    ".docx": Docx2txtLoader,
+    "url": WebBaseLoader,
+}
+
+
+def detect_encoding(file_path):
+    """
+    Detects the encoding of a text file.
+
+    Returns:
+        str: The detected encoding.
+    """
+    print("ingestion.py - detect_encoding()")
+    with open(file_path, 'rb') as f:
+        result = chardet.detect(f.read())
+        return result['encoding']
+
+
+def build_text_splitter():
+    """
+    Returns the text splitter used for the ingestion path, built once per config
+    and reused, since the "token" splitter loads the embedding model's tokenizer.
+
+    Returns:
+        TextSplitter: Splitter configured from the Config.
+    """
+    if cfg.SPLITTER_MODE == "token":
+        return _cached_text_splitter(cfg.SPLITTER_MODE, cfg.SPLITTER_TOKEN_CHUNK_SIZE, cfg.SPLITTER_TOKEN_CHUNK_OVERLAP, cfg.EMBEDDING_MODEL)
+    return _cached_text_splitter(cfg.SPLITTER_MODE, cfg.SPLITTER_CHUNK_SIZE, cfg.SPLITTER_CHUNK_OVERLAP, None)
+
+
+@lru_cache(maxsize=4)
+def _cached_text_splitter(mode: str, chunk_size: int, chunk_overlap: int, model_name: str):
+    print(f"ingestion.py - _cached_text_splitter({mode})")
+    if mode == "token":
+        return SentenceTokenSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, model_name=model_name)
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size= chunk_size,
+        chunk_overlap= chunk_overlap,
+        length_function=len,
+    )
+
+
+def iter_pdf_pages(file_path: str, parallel: bool = True):
+    """
+    Lazily extracts the pages of a PDF file, one Document per page.
+
+    PyMuPDFLoader.lazy_load() builds the full page list before yielding, so the
+    streaming path opens the file with PyMuPDF itself. The metadata matches the
+    one set by PyMuPDFLoader. Long PDFs are extracted on a process pool when
+    PDF_EXTRACT_WORKERS > 1, see iter_pdf_pages_parallel().
+
+    Yields:
+        Document: The text of one page.
+    """
+    print("ingestion.py - iter_pdf_pages()")
+    with fitz.open(file_path) as doc:
+        total_pages = len(doc)
+        # Inside a pool worker (ChatPDF.ingest_many()) the pages are extracted serially
+        parallel = parallel and cfg.PDF_EXTRACT_WORKERS > 1 and total_pages >= cfg.PDF_PARALLEL_MIN_PAGES and multiprocessing.parent_process() is None
+        if not parallel:
+            for page in doc:
+                yield _page_document(file_path, page.number, page.get_text(), total_pages)
+            return
+
+    yield from iter_pdf_pages_parallel(file_path, total_pages)
+
+
+def iter_pdf_pages_parallel(file_path: str, total_pages: int):
+    """
+    Extracts the pages of a PDF file on a process pool, in ranges of PDF_PAGES_PER_TASK
+    pages, each worker opening the file itself. The ranges are yielded back in page
+    order as soon as they are ready, with at most two ranges per worker in flight, so
+    the rest of the pipeline starts on the first pages while the later ones are
+    still being extracted.
+
+    Yields:
+        Document: The text of one page.
+    """
+    print("ingestion.py - iter_pdf_pages_parallel()")
+    page_ranges = iter((start, min(start + cfg.PDF_PAGES_PER_TASK, total_pages)) for start in range(0, total_pages, cfg.PDF_PAGES_PER_TASK))
+    pool = ProcessPoolExecutor(max_workers=cfg.PDF_EXTRACT_WORKERS)
+    try:
+        pending = deque(pool.submit(extract_page_range, file_path, start, end) for start, end in islice(page_ranges, 2 * cfg.PDF_EXTRACT_WORKERS))
+        while pending:
+            texts, start = pending.popleft().result()
+            for page_range in islice(page_ranges, 1):
+                pending.append(pool.submit(extract_page_range, file_path, *page_range))
+            for number, text in enumerate(texts, start):
+                yield _page_document(file_path, number, text, total_pages)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_page_range(file_path: str, start: int, end: int):
+    """
+    Extracts the text of the pages [start, end) of a PDF file.
+
+    Module level so it can be submitted to a process pool by iter_pdf_pages_parallel().
+
+    Returns:
+        tuple: (list of the page texts, start).
+    """
+    with fitz.open(file_path) as doc:
+        return [doc[number].get_text() for number in range(start, end)], start
+
+
+def _page_document(file_path: str, number: int, text: str, total_pages: int) -> Document:
+    return Document(
+        page_content=text,
+        metadata={'source': file_path, 'file_path': file_path, 'page': number, 'total_pages': total_pages},
+    )
+
+
+def lazy_load_documents(sources: dict, parallel: bool = True):
+    """
+    Loads the documents of a source with the loader matching its extension, pulling
+    them from the loader one at a time. With parallel=False a PDF is always extracted
+    serially.
+
+    Returns:
+        iterator: Iterator of Document objects.
+    """
+    print("ingestion.py - lazy_load_documents()")
+    source_extension = sources['source_extension']
+
+    if source_extension not in LOADERS_TYPES:
+        raise Exception("Not valid upload source!!")
+
+    if source_extension == "url":
+        return LOADERS_TYPES[source_extension](sources["url"]).lazy_load()
+
+    if source_extension == ".txt":
+        encoding = detect_encoding(sources["file_path"])
+        print(f"\nDetected encoding: {encoding}")
+        return LOADERS_TYPES[source_extension](sources["file_path"], encoding=encoding).lazy_load()
+
+    if source_extension == ".pdf":
+        return iter_pdf_pages(sources["file_path"], parallel)
+
+    return LOADERS_TYPES[source_extension](sources["file_path"]).lazy_load()
+
+
+def iter_chunks(sources: dict, text_splitter=None):
+    """
+    Streams a source through load -> clean -> normalize -> split without
+    materializing the intermediate lists. Each loaded document is split on its
+    own, as split_documents() does for a list.
+
+    Yields:
+        Document: Chunks ready to be embedded.
+    """
+    print("ingestion.py - iter_chunks()")
+    text_splitter = text_splitter or build_text_splitter()
+
+    docs = lazy_load_documents(sources)
+    docs = iter_clean_text(docs, sources['file_name'])
+    for doc in iter_normalize_documents(docs):
+        yield from text_splitter.split_documents([doc])
+
+
+def iter_batches(iterable, batch_size: int):
+    """
+    Groups the items of an iterable into lists of at most batch_size items.
+
+    Yields:
+        list: The next batch.
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def probe_chunks(sources: dict):
+    """
+    Loads only the first PROBE_PAGES documents and at most PROBE_CHARS characters of a
+    source through the lazy loader, for the domain check before the full parse.
+
+    Returns:
+        list: List of Document chunks of the beginning of the source.
+    """
+    print("ingestion.py - probe_chunks()")
+    docs = islice(lazy_load_documents(sources, parallel=False), cfg.PROBE_PAGES)
+    docs = iter_normalize_documents(iter_clean_text(docs, sources['file_name']))
+
+    probe, n_chars = [], 0
+    for doc in docs:
+        doc.page_content = doc.page_content[:cfg.PROBE_CHARS - n_chars]
+        probe.append(doc)
+        n_chars += len(doc.page_content)
+        if n_chars >= cfg.PROBE_CHARS:
+            break
+
+    return build_text_splitter().split_documents(probe)
+
+
+def prepare_chunks(sources: dict):
+    """
+    Loads, cleans and splits a source into a compact ChunkStore. The documents are
+    pulled lazily from the loader and only the offsets of the chunks are kept.
+
+    Module level so it can be submitted to a process pool by ChatPDF.ingest_many().
+
+    Returns:
+        ChunkStore: Sequence of the Document chunks ready to be embedded.
+    """
+    print("ingestion.py - prepare_chunks()")
+    chunk_store = ChunkStore()
+    chunk_store.add_source(sources['file_name'], lazy_load_documents(sources), build_text_splitter())
+    return chunk_store
+
+
+def process_documents(docs, file_name: str):
+    """
+    Cleans, normalizes and splits loaded documents into chunks.
+
+    Returns:
+        list: List of Document chunks ready to be embedded.
+    """
+    print("ingestion.py - process_documents()")
+    chunks = clean_text(docs, file_name)
+    chunks = normalize_documents(chunks)
+    return build_text_splitter().split_documents(chunks)
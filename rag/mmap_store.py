@@ -0,0 +1,398 @@
+import json
+import os
+import threading
+from array import array
+from typing import Any, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from rag.chunk_filter import ChunkFilter
+
+# The deleted rows are compacted away once there are more than this many, and more than a quarter of the rows
+COMPACT_MIN_DELETED = 1000
+
+
+class MmapVectorStore(VectorStore):
+    """
+    In-process vector store for single-node deployments, used instead of Milvus when
+    VECTOR_STORE_BACKEND is "mmap".
+
+    The normalized embeddings are rows of a memory-mapped float32 matrix
+    (<collection>.vectors) that doubles its capacity when full. The texts and metadata
+    are JSON lines of an append-only sidecar (<collection>.docs), of which only the
+    line offsets (<collection>.offsets) are kept in memory, and <collection>.json holds
+    the row count and the deleted rows. Up to MMAP_EXACT_MAX_CHUNKS chunks, queries
+    are answered by an exact vectorized top-k; above, by an HNSW graph
+    (<collection>.hnsw, hnswlib) built from the matrix and kept up to date.
+
+    Adding an existing id replaces its row. Searches take a ChunkFilter on the
+    'source_id' and 'page' metadata, read once from the sidecar on the first filtered
+    search. Deleted (and replaced) rows are only masked, until enough of them pile up
+    and the collection is compacted.
+    """
+
+    def __init__(self, embedding_function: Embeddings, collection_name: str, directory: str = None, drop_old: bool = False):
+        print("mmap_store.py - __init__()")
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        self.lock = threading.Lock()
+
+        directory = directory or cfg.MMAP_STORE_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.prefix = os.path.join(directory, collection_name)
+        if drop_old:
+            self._remove_files()
+
+        self._reset()
+        self.hnsw_available = True
+
+        if os.path.exists(self.prefix + ".json"):
+            with open(self.prefix + ".json", encoding="utf-8") as f:
+                header = json.load(f)
+            self.dim, self.count, self.deleted = header['dim'], header['count'], set(header['deleted'])
+            self.capacity = os.path.getsize(self.prefix + ".vectors") // (4 * self.dim)
+            self.vectors = np.memmap(self.prefix + ".vectors", dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+            # Rows written after the last header update (interrupted insert) are dropped
+            with open(self.prefix + ".offsets", "r+b") as f:
+                f.truncate(self.count * 8)
+            self.offsets = np.fromfile(self.prefix + ".offsets", dtype=np.int64)
+            if self.count > cfg.MMAP_EXACT_MAX_CHUNKS:
+                self._load_hnsw()
+
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+
+    def __len__(self):
+        return self.count - len(self.deleted)
+
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(texts, embeddings, metadatas, ids)
+
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None) -> List[str]:
+        """
+        Append already embedded texts to the store.
+
+        Returns:
+            list: The ids of the added texts.
+        """
+        print("mmap_store.py - add_embeddings()")
+        if not texts:
+            return []
+        ids = ids or [str(uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+
+        with self.lock:
+            self._delete_ids(ids)
+            start = self.count
+            self._reserve(start + len(texts), vectors.shape[1])
+            self.vectors[start:start + len(texts)] = vectors
+            self.vectors.flush()
+
+            with open(self.prefix + ".docs", "ab") as f:
+                offset = f.tell()
+                lines = [json.dumps({'id': pk, 'text': text, 'metadata': metadata}).encode() + b"\n" for pk, text, metadata in zip(ids, texts, metadatas)]
+                f.writelines(lines)
+            new_offsets = offset + np.cumsum([0] + [len(line) for line in lines[:-1]], dtype=np.int64)
+            with open(self.prefix + ".offsets", "ab") as f:
+                new_offsets.tofile(f)
+
+            self.offsets = np.concatenate([self.offsets, new_offsets])
+            self.count += len(texts)
+            self.ids.update((pk, start + i) for i, pk in enumerate(ids))
+            if self.row_sources is not None:
+                self._add_scalars(metadatas)
+            self._save_header()
+
+            if self.count > cfg.MMAP_EXACT_MAX_CHUNKS:
+                self._update_hnsw()
+        return ids
+
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        print("mmap_store.py - delete()")
+        with self.lock:
+            self._delete_ids(ids or [])
+            self._save_header()
+        return True
+
+
+    def ids_where(self, chunk_filter: ChunkFilter) -> List[str]:
+        """
+        Returns:
+            list: The ids of the chunks matching the filter.
+        """
+        with self.lock:
+            self._load_ids()
+            mask = self._filter_mask(chunk_filter)
+            return [pk for pk, row in self.ids.items() if mask[row]]
+
+
+    def drop(self):
+        """
+        Remove the collection and its files, e.g. when the session owning it ends.
+        """
+        print("mmap_store.py - drop()")
+        with self.lock:
+            self._reset()
+            self._remove_files()
+
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        """
+        Returns:
+            list: The k most similar (Document, cosine similarity) pairs, best first.
+        """
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k, **kwargs)
+
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, chunk_filter: Optional[ChunkFilter] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        query = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            mask = self._filter_mask(chunk_filter) if chunk_filter else None
+            n_candidates = len(self) if mask is None else int(mask.sum())
+            if n_candidates == 0:
+                return []
+            k = min(k, n_candidates)
+            if self.hnsw is not None:
+                self.hnsw.set_ef(max(cfg.MMAP_HNSW_EF, k))
+                labels, distances = self.hnsw.knn_query(query, k=k, filter=None if mask is None else lambda row: bool(mask[row]))
+                rows, scores = labels[0], 1 - distances[0]
+            else:
+                rows, scores = self._exact_top_k(query, k, mask)
+            documents = [Document(page_content=entry['text'], metadata=entry['metadata'], id=entry['id']) for entry in self._read_rows(rows)]
+            return list(zip(documents, (float(score) for score in scores)))
+
+
+    def _select_relevance_score_fn(self):
+        # The embeddings are normalized, the cosine similarity is the relevance
+        return lambda score: score
+
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, collection_name: str = "LangChainCollection", **kwargs: Any) -> "MmapVectorStore":
+        store = cls(embedding, collection_name, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
+
+
+    def _exact_top_k(self, query: np.ndarray, k: int, mask: Optional[np.ndarray] = None):
+        if mask is not None:
+            # Only the matching rows are read and scored
+            candidates = np.flatnonzero(mask)
+            scores = self.vectors[candidates] @ query
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return candidates[top], scores[top]
+
+        scores = self.vectors[:self.count] @ query
+        if self.deleted:
+            scores[list(self.deleted)] = -np.inf
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return rows, scores[rows]
+
+
+    def _read_rows(self, rows: Iterable[int]):
+        """
+        Yields:
+            dict: The sidecar entry of each row, all read through one file handle.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        with open(self.prefix + ".docs", "rb") as f:
+            for row in rows:
+                f.seek(self.offsets[row])
+                yield json.loads(f.readline())
+
+
+    def _reserve(self, n_rows: int, dim: int):
+        if self.dim is None:
+            self.dim = dim
+        if n_rows <= self.capacity:
+            return
+        self.capacity = max(n_rows, 2 * self.capacity, 1024)
+        with open(self.prefix + ".vectors", "ab") as f:
+            f.truncate(self.capacity * self.dim * 4)
+        self.vectors = np.memmap(self.prefix + ".vectors", dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        if self.hnsw is not None:
+            self.hnsw.resize_index(self.capacity)
+
+
+    def _load_ids(self):
+        if self.ids is None:
+            rows = [row for row in range(self.count) if row not in self.deleted]
+            self.ids = {entry['id']: row for row, entry in zip(rows, self._read_rows(rows))}
+
+
+    def _delete_ids(self, ids: List[str]):
+        self._load_ids()
+        rows = [self.ids.pop(pk) for pk in ids if pk in self.ids]
+        self.deleted.update(rows)
+        if self.hnsw is not None:
+            for row in rows:
+                self.hnsw.mark_deleted(row)
+        if len(self.deleted) > max(COMPACT_MIN_DELETED, self.count // 4):
+            self._compact()
+
+
+    def _compact(self):
+        """
+        Rewrites the matrix, the sidecar and the offsets without the deleted rows, under temporary
+        names that then replace the files, and renumbers the rows. The HNSW graph is rebuilt.
+        """
+        print(f"mmap_store.py - _compact() {len(self.deleted)}/{self.count} deleted rows")
+        keep = np.setdiff1d(np.arange(self.count), np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)))
+        capacity = max(len(keep), 1024)
+        
+        vectors = np.memmap(self.prefix + ".vectors.tmp", dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+        for start in range(0, len(keep), 4096):
+            rows = keep[start:start + 4096]
+            vectors[start:start + len(rows)] = self.vectors[rows]
+        vectors.flush()
+        del vectors
+        
+        offsets = np.zeros(len(keep), dtype=np.int64)
+        with open(self.prefix + ".docs", "rb") as src, open(self.prefix + ".docs.tmp", "wb") as dst:
+            for new_row, row in enumerate(keep):
+                src.seek(self.offsets[row])
+                offsets[new_row] = dst.tell()
+                dst.write(src.readline())
+        offsets.tofile(self.prefix + ".offsets.tmp")
+        
+        self.vectors = None
+        for extension in (".vectors", ".docs", ".offsets"):
+            os.replace(self.prefix + extension + ".tmp", self.prefix + extension)
+        if os.path.exists(self.prefix + ".hnsw"):
+            os.remove(self.prefix + ".hnsw")
+        
+        new_rows = np.full(self.count, -1, dtype=np.int64)
+        new_rows[keep] = np.arange(len(keep))
+        self.ids = {pk: int(new_rows[row]) for pk, row in self.ids.items()}
+        if self.row_sources is not None:
+            self.row_sources = array('i', np.frombuffer(self.row_sources, dtype=np.int32, count=self.count)[keep].tobytes())
+            self.row_pages = array('i', np.frombuffer(self.row_pages, dtype=np.int32, count=self.count)[keep].tobytes())
+        self.count, self.capacity, self.offsets, self.deleted = len(keep), capacity, offsets, set()
+        self.vectors = np.memmap(self.prefix + ".vectors", dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self._save_header()
+        
+        self.hnsw, self.hnsw_saved_count = None, 0
+        if self.count > cfg.MMAP_EXACT_MAX_CHUNKS and self.hnsw_available:
+            self._load_hnsw()
+
+
+    def _filter_mask(self, chunk_filter: ChunkFilter) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: For each row, whether its chunk matches the filter (deleted rows do not).
+        """
+        if self.row_sources is None:
+            self.source_codes, self.row_sources, self.row_pages = {}, array('i'), array('i')
+            self._add_scalars(entry['metadata'] for entry in self._read_rows(range(self.count)))
+        
+        mask = np.ones(self.count, dtype=bool)
+        if chunk_filter.source_ids is not None:
+            codes = [self.source_codes[source_id] for source_id in chunk_filter.source_ids if source_id in self.source_codes]
+            mask &= np.isin(np.frombuffer(self.row_sources, dtype=np.int32, count=self.count), codes)
+        if chunk_filter.pages is not None:
+            pages = np.frombuffer(self.row_pages, dtype=np.int32, count=self.count)
+            mask &= (pages >= chunk_filter.pages[0]) & (pages <= chunk_filter.pages[1])
+        if self.deleted:
+            mask[list(self.deleted)] = False
+        return mask
+
+
+    def _add_scalars(self, metadatas: Iterable[dict]):
+        # The source ids are coded as integers, so a filter is a vectorized comparison
+        for metadata in metadatas:
+            self.row_sources.append(self.source_codes.setdefault(metadata.get('source_id'), len(self.source_codes)))
+            self.row_pages.append(metadata.get('page', 0))
+
+
+    def _reset(self):
+        self.dim, self.count, self.capacity = None, 0, 0
+        self.deleted = set()
+        self.vectors = None
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.ids = None
+        self.source_codes, self.row_sources, self.row_pages = None, None, None
+        self.hnsw = None
+        self.hnsw_saved_count = 0
+
+
+    def _remove_files(self):
+        for extension in (".vectors", ".docs", ".offsets", ".json", ".hnsw"):
+            if os.path.exists(self.prefix + extension):
+                os.remove(self.prefix + extension)
+
+
+    def _save_header(self):
+        tmp_path = f"{self.prefix}.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'dim': self.dim, 'count': self.count, 'deleted': sorted(self.deleted)}, f)
+        os.replace(tmp_path, self.prefix + ".json")
+
+
+    def _load_hnsw(self):
+        try:
+            import hnswlib
+        except ImportError:
+            print("mmap_store.py - hnswlib is not installed, using the exact search")
+            self.hnsw_available = False
+            return
+
+        self.hnsw = hnswlib.Index(space="ip", dim=self.dim)
+        if os.path.exists(self.prefix + ".hnsw"):
+            self.hnsw.load_index(self.prefix + ".hnsw", max_elements=self.capacity)
+            # Rows deleted after the last save
+            for row in self.deleted:
+                if row < self.hnsw.get_current_count():
+                    try:
+                        self.hnsw.mark_deleted(row)
+                    except RuntimeError:
+                        pass
+        else:
+            self.hnsw.init_index(max_elements=self.capacity, ef_construction=cfg.MMAP_HNSW_EF_CONSTRUCTION, M=cfg.MMAP_HNSW_M)
+        self.hnsw_saved_count = self.hnsw.get_current_count()
+        self._update_hnsw()
+
+
+    def _update_hnsw(self):
+        """
+        Adds the rows missing from the HNSW graph, and saves it once it is 10% behind the matrix.
+        """
+        if self.hnsw is None:
+            if self.hnsw_available:
+                self._load_hnsw()
+            return
+
+        n_indexed = self.hnsw.get_current_count()
+        if n_indexed < self.count:
+            self.hnsw.add_items(np.asarray(self.vectors[n_indexed:self.count]), np.arange(n_indexed, self.count))
+            for row in self.deleted:
+                if row >= n_indexed:
+                    self.hnsw.mark_deleted(row)
+
+        if self.count - self.hnsw_saved_count >= max(1000, self.count // 10):
+            self.hnsw.save_index(self.prefix + ".hnsw")
+            self.hnsw_saved_count = self.count
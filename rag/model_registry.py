@@ -0,0 +1,97 @@
+import threading
+import time
+
+from config import Config as cfg
+from langchain_community.chat_models import ChatOllama
+from langchain_experimental.llms.ollama_functions import OllamaFunctions
+from rag.embedding_backends import load_embedding_model
+from rag.embedding_cache import EmbeddingCache
+from rag.embedding_engine import EmbeddingEngine
+
+LLM_TYPES = {
+    "json": ChatOllama,
+    "functions": OllamaFunctions,
+}
+
+_models = {}
+# One lock per key, created under the short global lock, so a slow model load only blocks the sessions waiting for that model
+_key_locks = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(key: tuple, create):
+    """
+    Returns the model registered under the key, creating it on first use. A model is
+    only created once per process, also when several sessions ask for it at the same time.
+    """
+    if key in _models:
+        return _models[key]
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        if key not in _models:
+            print(f"model_registry.py - load {key}")
+            _models[key] = create()
+        return _models[key]
+
+
+def get_shared(key: tuple, create):
+    """
+    Process-wide object other than a model, e.g. the vector store of a collection shared by
+    the sessions, so they use one client and one copy of its indexes.
+    """
+    return _get_or_create(key, create)
+
+
+def get_embeddings(model_name: str = None, backend: str = None):
+    """
+    Process-wide embedding model, with the embedding engine and cache on top of it.
+
+    Returns:
+        tuple: (HuggingFaceBgeEmbeddings, Embeddings used by the vector store, embedding id).
+    """
+    model_name = model_name or cfg.EMBEDDING_MODEL
+    backend = backend or cfg.EMBEDDING_BACKEND
+    # The quantized and ONNX backends give slightly different vectors, the caches keep them apart
+    embedding_id = f"{model_name}/{backend}"
+
+    def create():
+        hf = load_embedding_model(model_name, backend)
+        embeddings = EmbeddingEngine(hf)
+        if cfg.EMBEDDING_CACHE:
+            embeddings = EmbeddingCache(embeddings, embedding_id, hf.encode_kwargs['normalize_embeddings'])
+        return hf, embeddings, embedding_id
+
+    return _get_or_create(("embeddings", model_name, backend, cfg.EMBEDDING_CACHE), create)
+
+
+def get_llm(kind: str = "json"):
+    """
+    Process-wide Ollama client of MODEL in JSON mode, as a chat model ("json") or with
+    function calling for the structured outputs ("functions").
+
+    Returns:
+        BaseChatModel: The shared client.
+    """
+    key = ("llm", kind, cfg.MODEL, cfg.MODEL_TEMPERATURE, cfg.KEEP_IN_MEMORY)
+    return _get_or_create(key, lambda: LLM_TYPES[kind](model=cfg.MODEL, keep_alive=cfg.KEEP_IN_MEMORY, format="json", temperature=cfg.MODEL_TEMPERATURE))
+
+
+def warm_up():
+    """
+    Loads the embedding model and the LLM clients before the first session, and runs one
+    embedding so the model weights are paged in.
+
+    Returns:
+        float: The warm up time in seconds.
+    """
+    print("model_registry.py - warm_up()")
+    start_time = time.time()
+    hf, _, _ = get_embeddings()
+    hf.embed_query("warm up")
+    for kind in LLM_TYPES:
+        get_llm(kind)
+
+    execution_time = time.time() - start_time
+    print(f"\nModels warmed up in {execution_time:.2f} seconds")
+    return execution_time
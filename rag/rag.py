@@ -1,106 +1,556 @@
+import contextlib
+import hashlib
+import itertools
+import os
+import queue
+import threading
 import time
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from typing import List, Tuple
 
-import chardet
 from config import Config as cfg
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.chat_models import ChatOllama
-from langchain_community.document_loaders import (Docx2txtLoader,
-                                                  PyMuPDFLoader, TextLoader,
-                                                  WebBaseLoader)
+from langchain_core.documents import Document
 from langchain_core.output_parsers import JsonOutputParser
+from qa_system.answer_cache import AnswerCache
 from qa_system.qa_manager import KnowledgeBaseSystem
-from rag.rag_prompts import domain_check, domain_detection
-from rag.vectordb import VectorDB
-from utils import clean_text, normalize_documents
+from rag.ingest_cache import IngestCache
+from rag.ingestion import (LOADERS_TYPES, detect_encoding, iter_batches,
+                           iter_chunks, prepare_chunks, probe_chunks,
+                           process_documents)
+from rag.chunk_filter import ChunkFilter
+from rag.chunk_store import ChunkStore
+from rag.dedup import MinHashIndex
+from rag.model_registry import get_llm, get_shared
+from rag.domain_sampling import (pack_under_budget,
+                                 select_representative_chunks)
+from rag.rag_prompts import (domain_check, domain_detection,
+                             domain_detection_reduce)
+from rag.url_sync import UrlSyncState, fetch_if_modified
+from rag.vectordb import (VectorDB, collection_name_for, collection_path,
+                          tenant_key)
+from utils.text_doc_processing import source_id_for, source_metadata
+from utils.upload_source import UploadStatus
 
-LOADERS_TYPES = {
-    ".pdf": PyMuPDFLoader,
-    ".txt": TextLoader,
-    ".docx": Docx2txtLoader,
-    "url": WebBaseLoader,
-}
 
 class ChatPDF:
     print("rag.py - ChatPDF")
     
     def __init__(self):
         print("rag.py - ChatPDF - __init__()")
+        start_time = time.time()
 
-        self.json_llm = ChatOllama(model=cfg.MODEL, format="json", temperature=cfg.MODEL_TEMPERATURE) 
+        self.json_llm = get_llm("json")
         
         self.vector_db = VectorDB()
         self.domain = None
+        self.ingest_latency = {"accepted": [], "rejected": []}
+        self.ingest_cache = IngestCache() if cfg.INGEST_CACHE else None
+        self._load_collection_state()
         self.retriever = self.vector_db.retriever
         self.knowledge_base_system = KnowledgeBaseSystem(self.retriever)
+        self._attach_answer_cache()
         
         self.domain_checking = domain_check | self.json_llm | JsonOutputParser()
         self.summary_domain_chain = domain_detection | self.json_llm | JsonOutputParser()
+        self.summary_domain_reduce_chain = domain_detection_reduce | self.json_llm | JsonOutputParser()
+        
+        self.start_latency = time.time() - start_time
+        print(f"\nChatPDF started in {self.start_latency:.2f} seconds")
 
         
     
     def detect_encoding(self,file_path):
         print("rag.py - detect_encoding()")
-        with open(file_path, 'rb') as f:
-            result = chardet.detect(f.read())
-            return result['encoding']
+        return detect_encoding(file_path)
         
 
     def ingest(self, sources: dict):
         print("rag.py - ingest()")
         print("\n--- INGEST DATA ---")
         start_time = time.time()
-        source_extension = sources['source_extension']
 
-        if source_extension not in LOADERS_TYPES:
+        if sources['source_extension'] not in LOADERS_TYPES:
             raise Exception("Not valid upload source!!")
+        self._attach_upload_domain(sources['domain'])
+        
+        # A re-upload of a cached file goes straight to the vector insert
+        cache_key, entry = self._lookup_ingest_cache(sources)
+        if entry is not None:
+            return self._ingest_cached(entry, cache_key, sources, start_time)
+        
+        # Probe the first pages, so off-domain uploads are rejected before the full parse
+        detection = None
+        if cfg.INGEST_PROBE:
+            detection = self._summarize_domain(probe_chunks(sources))
+            if not self._check_domain(detection, sources['domain']):
+                return self._record_ingest_latency("rejected", start_time)
+        
+        if cfg.INGEST_STREAMING:
+            report = self._ingest_stream(sources, detection, cache_key)
+            if report == "no":
+                return self._record_ingest_latency("rejected", start_time)
+            return self._record_ingest_latency("accepted", start_time, report)
+
+        chunks = prepare_chunks(sources)
+        
+        if detection is None:
+            detection = self._summarize_domain(chunks)
+            if not self._check_domain(detection, sources['domain']):
+                self._cache_rejected(chunks, cache_key, detection)
+                return self._record_ingest_latency("rejected", start_time)
+        
+        report = self._insert_source(chunks, cache_key=cache_key, detection=detection)
+        return self._record_ingest_latency("accepted", start_time, report)
+
+
+    def _lookup_ingest_cache(self, sources: dict):
+        """
+        Returns:
+            tuple: The ingestion cache key of the uploaded file (None without cache or file) and
+                   its cached entry (None on a miss).
+        """
+        if self.ingest_cache is None or 'file_path' not in sources:
+            return None, None
+        cache_key = self.ingest_cache.make_key(sources['file_path'], self.vector_db.embedding_id)
+        return cache_key, self.ingest_cache.get(cache_key)
+
+
+    def _ingest_cached(self, entry: dict, cache_key: str, sources: dict, start_time: float):
+        """
+        Ingest a file found in the ingestion cache, reusing its chunks, embeddings and domain detection.
+        """
+        print("rag.py - _ingest_cached()")
+        if not self._check_domain(entry['detection'], sources['domain']):
+            return self._record_ingest_latency("rejected", start_time)
+        
+        report = self._insert_source(self._cached_chunks(entry, sources), entry['embeddings'], cache_key, entry['detection'])
+        return self._record_ingest_latency("accepted", start_time, report)
+
+
+    def _cached_chunks(self, entry: dict, sources: dict):
+        # The same file may come back under another name: the metadata follows the new upload
+        return [Document(page_content=chunk.page_content, metadata=source_metadata(sources['file_name'], chunk.metadata.get('page', 0)))
+                for chunk in entry['chunks']]
 
-        if source_extension == "url":
-            docs = LOADERS_TYPES[source_extension](sources["url"]).load()
-        elif source_extension == ".txt":
-            encoding = self.detect_encoding(sources["file_path"])
-            print(f"\nDetected encoding: {encoding}")
+
+    def _insert_source(self, chunks, embeddings=None, cache_key=None, detection=None):
+        """
+        Insert the chunks of one upload, with the embeddings of its cached entry if any. Otherwise,
+        with a cache key, they are embedded batch by batch into a new ingestion cache entry.
+        
+        Returns:
+            dict: Number of inserted 'chunks' and of skipped near-'duplicates'.
+        """
+        if embeddings is not None or cache_key is None:
+            return self._insert_chunks(chunks, embeddings)
+        with self.ingest_cache.writer(cache_key, len(chunks), detection) as cache_writer:
+            return self._insert_chunks(chunks, cache_writer=cache_writer)
+
+
+    def _cache_rejected(self, chunks, cache_key, detection):
+        # A rejected upload is cached without embeddings, so uploading it again skips the parse and the detection
+        if cache_key is None or detection is None:
+            return
+        with self.ingest_cache.writer(cache_key, len(chunks), detection) as cache_writer:
+            for start in range(0, len(chunks), cfg.INGEST_BATCH_SIZE):
+                cache_writer.write(chunks[start:start + cfg.INGEST_BATCH_SIZE])
+
+
+    def _insert_chunks(self, chunks, embeddings=None, cache_writer=None):
+        """
+        Insert the chunks in batches of INGEST_BATCH_SIZE, so the Documents of a ChunkStore
+        are only built one batch at a time. Near-duplicate chunks are skipped batch by batch.
+        
+        The embeddings, if given, are the matrix of a cached entry, converted one batch at a time.
+        With an ingestion cache writer, each batch is embedded and written to the cache 
+        before its near-duplicates are dropped, so the cached entry holds all the chunks.
+        
+        Returns:
+            dict: Number of inserted 'chunks' and of skipped near-'duplicates'.
+        """
+        print("rag.py - _insert_chunks()")
+        n_chunks, n_duplicates = 0, 0
+        
+        for start in range(0, len(chunks), cfg.INGEST_BATCH_SIZE):
+            end = start + cfg.INGEST_BATCH_SIZE
+            batch = chunks[start:end]
+            batch_embeddings = embeddings[start:end].tolist() if embeddings is not None else None
+            if cache_writer is not None:
+                batch_embeddings = self.vector_db.embed_documents(batch)
+                cache_writer.write(batch, batch_embeddings)
             
-            # Load the file using the detected encoding
-            docs = LOADERS_TYPES[source_extension](sources["file_path"], encoding=encoding).load()
-        else:
-            docs = LOADERS_TYPES[source_extension](sources["file_path"]).load()
+            batch, batch_embeddings, batch_duplicates = self._drop_near_duplicates(batch, batch_embeddings)
+            n_duplicates += batch_duplicates
+            if batch:
+                self.vector_db.add_documents(batch, batch_embeddings)
+                n_chunks += len(batch)
+        
+        self.vector_db.save()
+        if self.dedup_index is not None:
+            self.dedup_index.save()
+        return {'chunks': n_chunks, 'duplicates': n_duplicates}
+
+
+    def _drop_near_duplicates(self, chunks, embeddings=None):
+        """
+        Drop the chunks that are near-duplicates of each other or of previously ingested chunks.
+        
+        Returns:
+            tuple: The kept chunks, their embeddings (None if not given) and the number of dropped chunks.
+        """
+        if self.dedup_index is None:
+            return chunks, embeddings, 0
+        
+        keep = self.dedup_index.filter_duplicates([chunk.page_content for chunk in chunks])
+        kept_indices = [i for i, kept in enumerate(keep) if kept]
+        n_duplicates = len(chunks) - len(kept_indices)
+        print(f"\nSkipped near-duplicate chunks: {n_duplicates}/{len(chunks)}")
+        
+        if n_duplicates == 0:
+            return chunks, embeddings, 0
+        
+        chunks = chunks.subset(kept_indices) if isinstance(chunks, ChunkStore) else [chunks[i] for i in kept_indices]
+        if embeddings is not None:
+            embeddings = [embeddings[i] for i in kept_indices]
+        return chunks, embeddings, n_duplicates
+
+
+    def _record_ingest_latency(self, outcome: str, start_time: float, report: dict = None):
+        """
+        Record the latency of an ingestion, keeping the rejected uploads apart from the accepted ones.
+        
+        Returns:
+            str | dict: "no" for a rejected upload, otherwise the ingest report with the 'score' "yes",
+                        as returned by ingest().
+        """
+        execution_time = time.time() - start_time
+        self.ingest_latency[outcome].append(execution_time)
+        print(f"\nExecution time ({outcome}): {execution_time:.2f} seconds")
+        
+        if outcome == "rejected":
+            return "no"
+        self._corpus_changed()
+        return {'score': "yes", **(report or {})}
+
+
+    def _ingest_stream(self, sources: dict, detection: dict = None, cache_key: str = None):
+        """
+        Memory-bounded ingestion: the source is streamed through load -> clean -> normalize
+        -> split in batches of INGEST_BATCH_SIZE chunks, each batch is embedded here and
+        inserted by a writer thread. The bounded queue between the two stages makes the
+        embedder wait when the inserts fall behind, so only a few batches are alive at once.
+        
+        Unless the domain was already checked (detection of the probe), the domain detection
+        runs on the first batch, before anything is embedded. With a cache key, each batch is
+        written to the ingestion cache as it is embedded, before its near-duplicates are dropped.
+        """
+        print("rag.py - _ingest_stream()")
+        start_time = time.time()
+        
+        batches = iter_batches(iter_chunks(sources), cfg.INGEST_BATCH_SIZE)
+        first_batch = next(batches, [])
+        if not first_batch:
+            return "no"
+        if detection is None:
+            detection = self._summarize_domain(first_batch)
+            if not self._check_domain(detection, sources['domain']):
+                return "no"
+        
+        insert_queue = queue.Queue(maxsize=cfg.INGEST_QUEUE_SIZE)
+        insert_errors = []
+        
+        def insert_worker():
+            while (item := insert_queue.get()) is not None:
+                # Keep draining after a failure so the producer never blocks on a full queue
+                if insert_errors:
+                    continue
+                try:
+                    self.vector_db.add_documents(*item)
+                except Exception as e:
+                    insert_errors.append(e)
+        
+        writer = threading.Thread(target=insert_worker, daemon=True)
+        writer.start()
+        
+        n_chunks, n_duplicates = 0, 0
+        with self.ingest_cache.writer(cache_key, None, detection) if cache_key is not None else contextlib.nullcontext() as cache_writer:
+            try:
+                for batch in itertools.chain([first_batch], batches):
+                    if insert_errors:
+                        break
+                    if cache_writer is None:
+                        batch, _, batch_duplicates = self._drop_near_duplicates(batch)
+                        embeddings = self.vector_db.embed_documents(batch) if batch else None
+                    else:
+                        embeddings = self.vector_db.embed_documents(batch)
+                        cache_writer.write(batch, embeddings)
+                        batch, embeddings, batch_duplicates = self._drop_near_duplicates(batch, embeddings)
+                    n_duplicates += batch_duplicates
+                    if not batch:
+                        continue
+                    insert_queue.put((batch, embeddings))
+                    n_chunks += len(batch)
+            finally:
+                insert_queue.put(None)
+                writer.join()
             
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size= cfg.SPLITTER_CHUNK_SIZE,
-            chunk_overlap= cfg.SPLITTER_CHUNK_OVERLAP,
-            length_function=len,
-        )
+            # A failed insert leaves no cache entry
+            if insert_errors:
+                raise insert_errors[0]
+        self.vector_db.save()
+        if self.dedup_index is not None:
+            self.dedup_index.save()
+        
+        execution_time = time.time() - start_time
+        print(f"\nStreamed {n_chunks} chunks, execution time: {execution_time:.2f} seconds")
+        return {'chunks': n_chunks, 'duplicates': n_duplicates}
+
+
+    def ingest_many(self, sources_list: List[dict], file_hashes: set = None):
+        """
+        Ingest a batch of sources at once.
         
-        chunks = clean_text(docs, sources['file_name'])
-        chunks = normalize_documents(chunks)
-        chunks = self.text_splitter.split_documents(chunks)
+        Loading, cleaning and splitting run on a process pool, domain detection runs
+        in this thread as the chunks become ready and the embedding/Milvus inserts run
+        on a writer thread, so the three stages overlap across sources. Each source goes
+        through the same ingestion cache and probe as ingest(): a cached file goes straight
+        to the writer thread and the probe rejects off-domain uploads before they are parsed.
         
+        The file_hashes are the MD5 hashes of the files the session already uploaded (e.g. 
+        st.session_state["file_hashes"]): those are reported as duplicates, and the hashes of
+        the batch are added to them. With TENANCY "domain", the sources of a batch must share
+        one domain, whose tenant they are ingested into.
+        
+        Returns:
+            dict: 'results' with one UploadStatus report per source (in input order)
+                  and the aggregate throughput numbers of the batch. 'n_chunks' counts the
+                  inserted chunks, 'n_duplicates' the near-duplicates skipped.
+        """
+        print("rag.py - ingest_many()")
+        print("\n--- INGEST BATCH ---")
+        start_time = time.time()
+        # The batch is ingested in one collection (or tenant), the one of its domain
+        if cfg.TENANCY == "domain" and len({sources['domain'] for sources in sources_list}) > 1:
+            raise Exception("A batch must have one domain with TENANCY 'domain'!!")
+        if sources_list:
+            self._attach_upload_domain(sources_list[0]['domain'])
+        
+        results = [None] * len(sources_list)
+        cache_keys, detections = [None] * len(sources_list), [None] * len(sources_list)
+        n_chunks, n_duplicates = 0, 0
+        file_hashes = set() if file_hashes is None else file_hashes
+        
+        with ProcessPoolExecutor(max_workers=cfg.INGEST_WORKERS) as pool, ThreadPoolExecutor(max_workers=1) as writer:
+            prepare_futures, insert_futures = {}, {}
+            for i, sources in enumerate(sources_list):
+                if sources['source_extension'] not in LOADERS_TYPES:
+                    results[i] = {'status': UploadStatus.ERROR, 'file_name': sources.get('file_name')}
+                    continue
+                
+                if 'file_path' in sources:
+                    with open(sources['file_path'], 'rb') as f:
+                        file_hash = hashlib.md5(f.read()).hexdigest()
+                    if file_hash in file_hashes:
+                        results[i] = {'status': UploadStatus.DUPLICATE_FILE, 'file_name': sources['file_name']}
+                        continue
+                    file_hashes.add(file_hash)
+                
+                cache_keys[i], entry = self._lookup_ingest_cache(sources)
+                if entry is not None:
+                    if self._check_domain(entry['detection'], sources['domain']):
+                        insert_futures[writer.submit(self._insert_source, self._cached_chunks(entry, sources), entry['embeddings'], cache_keys[i], entry['detection'])] = i
+                    else:
+                        results[i] = {'status': UploadStatus.INVALID_DOMAIN, 'file_name': sources['file_name']}
+                    continue
+                
+                if cfg.INGEST_PROBE:
+                    detections[i] = self._summarize_domain(probe_chunks(sources))
+                    if not self._check_domain(detections[i], sources['domain']):
+                        results[i] = {'status': UploadStatus.INVALID_DOMAIN, 'file_name': sources['file_name']}
+                        continue
+                
+                prepare_futures[pool.submit(prepare_chunks, sources)] = i
+            
+            for future in as_completed(prepare_futures):
+                i = prepare_futures[future]
+                sources = sources_list[i]
+                try:
+                    chunks = future.result()
+                except Exception as e:
+                    print(f"Error: {e}. Loading {sources['file_name']} failed.")
+                    results[i] = {'status': UploadStatus.ERROR, 'file_name': sources['file_name']}
+                    continue
+                
+                if detections[i] is None:
+                    detections[i] = self._summarize_domain(chunks)
+                    if not self._check_domain(detections[i], sources['domain']):
+                        self._cache_rejected(chunks, cache_keys[i], detections[i])
+                        results[i] = {'status': UploadStatus.INVALID_DOMAIN, 'file_name': sources['file_name']}
+                        continue
+                
+                insert_futures[writer.submit(self._insert_source, chunks, None, cache_keys[i], detections[i])] = i
+            
+            for future in as_completed(insert_futures):
+                i = insert_futures[future]
+                try:
+                    report = future.result()
+                    n_chunks += report['chunks']
+                    n_duplicates += report['duplicates']
+                    results[i] = {'status': UploadStatus.SUCCESS, 'file_name': sources_list[i]['file_name'], 'duplicates': report['duplicates']}
+                except Exception as e:
+                    print(f"Error: {e}. Inserting {sources_list[i]['file_name']} failed.")
+                    results[i] = {'status': UploadStatus.ERROR, 'file_name': sources_list[i]['file_name']}
+        
+        execution_time = time.time() - start_time
+        n_success = sum(1 for result in results if result['status'] == UploadStatus.SUCCESS)
+        print(f"\nIngested {n_success}/{len(sources_list)} sources, {n_chunks} chunks in {execution_time:.2f} seconds")
+        if n_success:
+            self._corpus_changed()
+        
+        return {
+            'results': results,
+            'n_sources': len(sources_list),
+            'n_success': n_success,
+            'n_chunks': n_chunks,
+            'n_duplicates': n_duplicates,
+            'execution_time': execution_time,
+            'sources_per_second': len(sources_list) / execution_time if execution_time > 0 else 0.0,
+            'chunks_per_second': n_chunks / execution_time if execution_time > 0 else 0.0,
+        }
+
+
+    def sync_url(self, sources: dict):
+        """
+        Incremental re-ingestion of a URL.
+        
+        The page is fetched with a conditional request (ETag / Last-Modified of the last sync),
+        so an unchanged page costs one HTTP 304 and no embedding. A changed page is split again
+        and diffed at the chunk level with content hash ids: only the new or changed chunks are
+        embedded and inserted and the stale ones are deleted from the collection. The domain
+        check only runs on the first sync of a URL.
+        
+        Returns:
+            dict: 'status' ('new', 'updated', 'unchanged' or 'no') and the number of 'added', 'removed' and 'kept' chunks.
+        """
+        print("rag.py - sync_url()")
+        start_time = time.time()
+        self._attach_upload_domain(sources['domain'])
+        url = sources['url']
+        state = self.url_sync_state.get(url)
+        
+        document, etag, last_modified = fetch_if_modified(url, state)
+        if document is None:
+            print(f"\n{url} unchanged, execution time: {time.time() - start_time:.2f} seconds")
+            return {'status': 'unchanged', 'added': 0, 'removed': 0, 'kept': len(state['chunk_ids'])}
+        
+        # Identical chunks share an id and are stored once
+        chunks = {}
+        for chunk in process_documents([document], sources['file_name']):
+            chunks.setdefault(self.vector_db.chunk_id(chunk), chunk)
+        
+        if state is None and not self._is_in_domain(list(chunks.values()), sources['domain']):
+            return {'status': 'no', 'added': 0, 'removed': 0, 'kept': 0}
+        
+        old_ids = set(state['chunk_ids']) if state else set()
+        new_ids = [chunk_id for chunk_id in chunks if chunk_id not in old_ids]
+        stale_ids = [chunk_id for chunk_id in old_ids if chunk_id not in chunks]
+        
+        if new_ids:
+            self.vector_db.add_documents([chunks[chunk_id] for chunk_id in new_ids], ids=new_ids)
+        self.vector_db.delete(stale_ids)
+        self.vector_db.save()
+        self.url_sync_state.set(url, etag, last_modified, list(chunks))
+        if new_ids or stale_ids:
+            self._corpus_changed()
+        
+        print(f"\n{url} synced: +{len(new_ids)} -{len(stale_ids)} chunks, execution time: {time.time() - start_time:.2f} seconds")
+        return {
+            'status': 'new' if state is None else 'updated',
+            'added': len(new_ids),
+            'removed': len(stale_ids),
+            'kept': len(chunks) - len(new_ids),
+        }
+
+
+    def _detect_domain(self, chunks):
+        """
+        Summarize the chunks and detect their possible domains.
+        
+        In the "sampled" DOMAIN_DETECTION_MODE only DOMAIN_DETECTION_SAMPLES representative chunks
+        are kept, packed under DOMAIN_DETECTION_TOKEN_BUDGET tokens and summarized map-reduce style,
+        so the cost depends on the budget and not on the document length.
+        
+        Returns:
+            dict: The 'summary' and 'domain' keys of the domain detection.
+        """
+        print("rag.py - _detect_domain()")
+        if cfg.DOMAIN_DETECTION_MODE != "sampled":
+            return self.summary_domain_chain.invoke({"documents": list(chunks)})
+        
+        samples = select_representative_chunks(chunks, cfg.DOMAIN_DETECTION_SAMPLES)
+        groups = pack_under_budget(samples, cfg.DOMAIN_DETECTION_TOKEN_BUDGET, cfg.DOMAIN_DETECTION_MAP_TOKENS)
+        print(f"\nDomain detection on {len(samples)}/{len(chunks)} chunks in {len(groups)} map calls")
+        
+        partial_results = self.summary_domain_chain.batch([{"documents": group} for group in groups])
+        if len(partial_results) == 1:
+            return partial_results[0]
+        
+        summaries = "\n".join(f"Summary: {result['summary']}\nDomains: {result['domain']}" for result in partial_results)
+        return self.summary_domain_reduce_chain.invoke({"summaries": summaries})
+
+
+    def _summarize_domain(self, chunks):
+        """
+        Run the domain detection on the chunks.
+        
+        Returns:
+            dict: The 'summary' and 'domain' keys of the domain detection, or None if it failed.
+        """
+        print("rag.py - _summarize_domain()")
         try:
-            result = self.summary_domain_chain.invoke({"documents": chunks})
+            result = self._detect_domain(chunks)
         
             print("\nResult data domain detection: ")
             print("\nSummary:    {}".format(result["summary"]))
             print("\nDomain:     {}".format(result["domain"]))
+            return result
         except Exception as e:
             print(f"Error: {e}. Result data domain detection failed.")
-            return "no"
+            return None
+
+
+    def _check_domain(self, detection, domain: str):
+        """
+        Check the detected domain of a document against the user domain.
+        
+        Returns:
+            bool: True if the document falls within the specified domain.
+        """
+        print("rag.py - _check_domain()")
+        if detection is None:
+            return False
         
         try:
-            result = self.domain_checking.invoke({"domain": sources['domain'], "summary": result["summary"], "doc_domain": result["domain"]})  
+            result = self.domain_checking.invoke({"domain": domain, "summary": detection["summary"], "doc_domain": detection["domain"]})  
             print("Result for summary: ", result)
             print("\nDocument in the domain:   {}".format("Yes" if result['score'] == "yes" else "No"))
             
-            if result["score"] == "no":
-                return result["score"]
+            return result["score"] != "no"
         except Exception as e:
             print(f"Error: {e}. Document in the domain failed.")
-            return "no"
-        
-        self.vector_db.add_documents(chunks)
+            return False
+
+
+    def _is_in_domain(self, chunks, domain: str):
+        """
+        Detect the domain of the chunks and check it against the user domain.
         
-        end_time = time.time()
-        execution_time = end_time - start_time
-        print(f"\nExecution time: {execution_time:.2f} seconds")
+        Returns:
+            bool: True if the document falls within the specified domain.
+        """
+        print("rag.py - _is_in_domain()")
+        return self._check_domain(self._summarize_domain(chunks), domain)
             
 
     def ask(self, query: str):
@@ -109,7 +559,61 @@ class ChatPDF:
             return "Please set the domain before asking questions."
         
         state = self.invoke({"question": query, "domain": self.domain})
+        return self._format_answer(state)
+    
     
+    async def aask(self, query: str):
+        """
+        Async version of ask(), for serving many conversations from one event loop.
+        """
+        print("rag.py - aask()")
+        if self.domain is None:
+            return "Please set the domain before asking questions."
+        
+        state = await self.ainvoke({"question": query, "domain": self.domain})
+        return self._format_answer(state)
+    
+    
+    def ask_stream(self, query: str):
+        """
+        Streaming version of ask(), yielding events as dicts:
+            {'type': "token", 'text'}: a new piece of the answer, as it is generated.
+            {'type': "generated", 'text'}: the generated answer with its metadata, not checked yet.
+            {'type': "answer", 'text', 'retracted', 'note', 'time_to_first_token'}: the final answer,
+                after the hallucination and usefulness checks. 'retracted' is True when the checks
+                replaced the generated answer, 'note' tells the result of the checks.
+        """
+        print("rag.py - ask_stream()")
+        if self.domain is None:
+            yield {'type': "answer", 'text': "Please set the domain before asking questions.", 'retracted': False, 'note': "", 'time_to_first_token': None}
+            return
+        
+        generated = None
+        for event, value in self.knowledge_base_system.stream({"question": query, "domain": self.domain}):
+            if event == "token":
+                yield {'type': "token", 'text': value}
+            elif event == "generated":
+                generated = self._format_answer(value)
+                yield {'type': "generated", 'text': generated}
+            else:
+                text = self._format_answer(value)
+                yield {'type': "answer", 'text': text, 'retracted': generated is not None and text != generated,
+                       'note': self._verification_note(value, generated, text), 'time_to_first_token': self.knowledge_base_system.time_to_first_token}
+    
+    
+    def _verification_note(self, state, generated, text):
+        if generated is None:
+            return ""
+        if state.get("hallucination") == "yes":
+            return "⚠️ Answer withdrawn: not grounded in the documents." if text != generated else "⚠️ The answer could not be checked against the documents."
+        if state.get("answer_useful") == "not useful":
+            return "⚠️ Answer withdrawn: it does not address the question."
+        if state.get("answer_useful") == "useful":
+            return "✅ Checked against the documents and the question."
+        return ""
+    
+    
+    def _format_answer(self, state):
         if state["question_type"] == "yes":
             response = state["answer"]['answer']
             metadata = state["answer"]['metadata']
@@ -126,10 +630,108 @@ class ChatPDF:
     def invoke(self, state):
         print("rag.py - invoke()")
         return self.knowledge_base_system.invoke(state)
+    
+    
+    async def ainvoke(self, state):
+        print("rag.py - ainvoke()")
+        return await self.knowledge_base_system.ainvoke(state)
 
     
     def set_domain(self, domain: str):
         print("rag.py - set_domain()")
         self.domain = domain
         
+        # Each domain keeps its own collection (or partition), attached as it is
+        if not domain.strip():
+            return
+        if cfg.TENANCY == "domain":
+            self.vector_db.attach_tenant(tenant_key(domain))
+        elif cfg.TENANCY == "none" and cfg.VECTOR_STORE_PERSIST:
+            self.vector_db.attach(collection_name_for(domain))
+        else:
+            return
+        self._load_collection_state()
+        # The retrieval scope of set_scope() applies to the collection of the new domain too
+        self.retriever = self.vector_db.as_retriever(self.knowledge_base_system.chunk_filter)
+        self.knowledge_base_system.retriever = self.retriever
+        self._attach_answer_cache()
+        
+        
+    def _attach_upload_domain(self, domain: str):
+        # With TENANCY "domain" nothing is attached before set_domain(), an upload attaches its own domain
+        if self.vector_db.vector_store is None:
+            self.set_domain(domain)
+        
+        
+    def set_scope(self, file_names: List[str] = None, pages: Tuple[int, int] = None):
+        """
+        Restrict the retrieval to some uploaded sources and / or a page range, e.g. when the
+        user scopes the questions to one upload. No file names and no pages search everything.
+        """
+        print("rag.py - set_scope()")
+        chunk_filter = ChunkFilter(
+            source_ids=tuple(source_id_for(file_name) for file_name in file_names) if file_names else None,
+            pages=pages,
+        )
+        self.retriever = self.vector_db.as_retriever(chunk_filter)
+        self.knowledge_base_system.retriever = self.retriever
+        self.knowledge_base_system.chunk_filter = chunk_filter or None
+        
+        
+    def _attach_answer_cache(self):
+        """
+        Answer cache of the attached collection (ANSWER_CACHE). The sessions sharing a collection, per
+        domain or persistent, share its cache too, so a question answered in one session is a hit in the others.
+        """
+        if not cfg.ANSWER_CACHE or self.vector_db.collection_name is None:
+            self.answer_cache = None
+        elif cfg.TENANCY == "domain" or (cfg.TENANCY == "none" and cfg.VECTOR_STORE_PERSIST):
+            self.answer_cache = get_shared(("answer_cache", self.vector_db.collection_name), lambda: AnswerCache(self.vector_db.embeddings))
+        else:
+            self.answer_cache = AnswerCache(self.vector_db.embeddings)
+        self.knowledge_base_system.answer_cache = self.answer_cache
+        
+        
+    def _corpus_changed(self):
+        # Bumps the corpus version: the cached answers may not hold any more
+        if self.answer_cache is not None:
+            self.answer_cache.bump_version()
+        
+        
+    def close(self):
+        """
+        Release the session: with TENANCY "session", its chunks and files are deleted.
+        """
+        print("rag.py - close()")
+        if cfg.TENANCY != "session":
+            return
+        self.vector_db.drop_tenant()
+        for state in (self.url_sync_state, self.dedup_index):
+            if state is not None and os.path.exists(state.path):
+                os.remove(state.path)
+        
+        
+    def _load_collection_state(self):
+        """
+        Load the URL sync state and the dedup index kept next to the attached collection (or tenant).
+        Without VECTOR_STORE_PERSIST the collection is dropped when the VectorDB starts, and so are they,
+        as are those of a session tenant, which starts empty. With TENANCY "domain", there are none until
+        the domain is set. Those of a domain tenant or a persistent collection are created once per process
+        and shared by its sessions, like its store and BM25 index, so no session overwrites the others' state.
+        """
+        collection_name = self.vector_db.collection_name
+        if collection_name is None:
+            self.url_sync_state, self.dedup_index = None, None
+        elif cfg.TENANCY == "session":
+            self.url_sync_state = UrlSyncState(collection_path(cfg.URL_SYNC_STATE_PATH, collection_name), reset=True)
+            self.dedup_index = MinHashIndex(collection_path(cfg.DEDUP_INDEX_PATH, collection_name), reset=True) if cfg.DEDUP else None
+        elif cfg.VECTOR_STORE_PERSIST or cfg.TENANCY == "domain":
+            url_sync_path = collection_path(cfg.URL_SYNC_STATE_PATH, collection_name)
+            dedup_path = collection_path(cfg.DEDUP_INDEX_PATH, collection_name)
+            self.url_sync_state = get_shared(("url_sync", collection_name), lambda: UrlSyncState(url_sync_path))
+            self.dedup_index = get_shared(("dedup", collection_name), lambda: MinHashIndex(dedup_path)) if cfg.DEDUP else None
+        else:
+            self.url_sync_state = UrlSyncState(reset=True)
+            self.dedup_index = MinHashIndex(reset=True) if cfg.DEDUP else None
+        
         
\ No newline at end of file
@@ -47,4 +47,20 @@ domain_detection = PromptTemplate(
     """,
     input_variables=["documents"],
     partial_variables={"format_instructions": format_domain_detection},
-)
\ No newline at end of file
+)
+
+domain_detection_reduce = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are a grader assessing the summarization and domain of a document.
+    Here are the summaries and the possible domains of representative parts of the document:
+    \n ------- \n
+    {summaries}
+    \n ------- \n
+    First, combine them into one summary of the document. 
+    Then, indicate three possible domains the document could belong(e.g., sports, movies, technology).
+    {format_instructions}
+    <|eot_id|><|start_header_id|>assistant<|end_header_id|>
+    """,
+    input_variables=["summaries"],
+    partial_variables={"format_instructions": format_domain_detection},
+)
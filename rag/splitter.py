@@ -0,0 +1,94 @@
+import re
+from bisect import bisect_left
+from typing import Callable, List, Optional, Tuple
+
+from langchain_text_splitters import TextSplitter
+
+SENTENCE_END = re.compile(r'[.!?]["\')\]]*(?=\s|$)')
+
+
+def hf_token_offsets(model_name: str) -> Callable[[str], List[Tuple[int, int]]]:
+    """
+    Builds a function returning the character offsets of the tokens of a text,
+    with the (fast) tokenizer of the embedding model.
+
+    Returns:
+        callable: text -> list of (start, end) character offsets, one per token.
+    """
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # Pages are tokenized whole and cut afterwards, the model length limit does not apply here
+    tokenizer.model_max_length = int(1e12)
+
+    def token_offsets(text: str):
+        return tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+
+    return token_offsets
+
+
+class SentenceTokenSplitter(TextSplitter):
+    """
+    Single-pass, sentence-boundary aware splitter that sizes the chunks in tokens of
+    the embedding model.
+
+    A text is tokenized once; a chunk then grows up to chunk_size tokens and is cut at
+    the last sentence end that fits, or at a token boundary when no sentence ends in
+    its second half, and the next chunk starts at the first sentence inside the last
+    chunk_overlap tokens. Both pointers only move forward, so the split is linear in
+    the text length.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, token_offsets: Optional[Callable] = None, model_name: str = None):
+        print("splitter.py - __init__()")
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=self._count_tokens)
+        self.token_offsets = token_offsets or hf_token_offsets(model_name)
+
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self.token_offsets(text))
+
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+
+    def split_offsets(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Splits a text into chunks without copying it.
+
+        Returns:
+            list: (start, end) character offsets of the chunks.
+        """
+        offsets = self.token_offsets(text)
+        n_tokens = len(offsets)
+        if n_tokens == 0:
+            return []
+
+        # Token index right after each sentence end
+        token_starts = [start for start, _ in offsets]
+        boundaries = sorted({bisect_left(token_starts, match.end()) for match in SENTENCE_END.finditer(text)})
+        boundaries = [b for b in boundaries if 0 < b < n_tokens] + [n_tokens]
+
+        chunks = []
+        start, b = 0, 0
+        while start < n_tokens:
+            limit = start + self._chunk_size
+            # Last sentence boundary that fits in the chunk and keeps it at least half full
+            while b < len(boundaries) and boundaries[b] < start + self._chunk_size // 2:
+                b += 1
+            cut = b
+            while cut + 1 < len(boundaries) and boundaries[cut + 1] <= limit:
+                cut += 1
+            end = boundaries[cut] if cut < len(boundaries) and boundaries[cut] <= limit else min(limit, n_tokens)
+
+            chunks.append((offsets[start][0], offsets[end - 1][1]))
+            if end >= n_tokens:
+                break
+
+            # Overlap from the first sentence start in the last chunk_overlap tokens
+            next_start = max(end - self._chunk_overlap, start + 1)
+            i = bisect_left(boundaries, next_start)
+            start = boundaries[i] if i < len(boundaries) and boundaries[i] < end else next_start
+
+        return chunks
@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+
+import requests
+from bs4 import BeautifulSoup
+from config import Config as cfg
+from langchain_core.documents import Document
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+
+class UrlSyncState:
+    """
+    Persistent per URL state of the incremental re-ingestion: the ETag and
+    Last-Modified validators of the last fetch and the ids of the chunks stored
+    in the vector collection for that URL.
+    """
+
+    def __init__(self, path: str = None, reset: bool = False):
+        print("url_sync.py - __init__()")
+        self.path = path or cfg.URL_SYNC_STATE_PATH
+        self.lock = threading.Lock()
+        self.urls = {}
+
+        if reset:
+            self.save()
+        elif os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.urls = json.load(f)
+
+
+    def get(self, url: str) -> dict:
+        """
+        Returns:
+            dict: 'etag', 'last_modified' and 'chunk_ids' of the URL, or None if it was never synced.
+        """
+        return self.urls.get(url)
+
+
+    def set(self, url: str, etag: str, last_modified: str, chunk_ids: list):
+        with self.lock:
+            self.urls[url] = {'etag': etag, 'last_modified': last_modified, 'chunk_ids': chunk_ids}
+            self._write()
+
+
+    def save(self):
+        # The state of a shared collection is shared by its sessions, which save it from their threads
+        with self.lock:
+            self._write()
+
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.urls, f)
+        os.replace(tmp_path, self.path)
+
+
+def fetch_if_modified(url: str, state: dict = None):
+    """
+    Fetches a URL with a conditional request, using the validators of the last sync.
+
+    Returns:
+        tuple: (Document or None if the page is unchanged (HTTP 304), ETag, Last-Modified).
+    """
+    print("url_sync.py - fetch_if_modified()")
+    headers = dict(HEADERS)
+    if state and state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state and state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+
+    response = requests.get(url, headers=headers, timeout=cfg.URL_SYNC_TIMEOUT)
+    if response.status_code == 304:
+        return None, state['etag'], state['last_modified']
+    response.raise_for_status()
+
+    # Same parsing as WebBaseLoader
+    response.encoding = response.apparent_encoding
+    text = BeautifulSoup(response.text, "html.parser").get_text()
+    document = Document(page_content=text, metadata={'source': url})
+
+    return document, response.headers.get('ETag'), response.headers.get('Last-Modified')
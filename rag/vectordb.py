@@ -1,42 +1,361 @@
-from typing import List
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
 from uuid import uuid4
 
 from config import Config as cfg
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_milvus import Milvus
+from rag.bm25_index import BM25Index, HybridRetriever
+from rag.chunk_filter import ChunkFilter
+from rag.mmap_store import MmapVectorStore
+from rag.model_registry import get_embeddings, get_shared
+from utils.text_doc_processing import source_metadata
 
+_init_lock = threading.Lock()
+
+
+def tenant_key(domain: str) -> str:
+    """
+    Key of a domain in collection, partition and file names. Milvus names only allow
+    letters, digits and underscores, so the domain is slugged and suffixed with its hash
+    to keep e.g. "C" and "C++" apart.
+
+    Returns:
+        str: The key.
+    """
+    slug = re.sub(r'[^a-z0-9]+', '_', domain.strip().lower()).strip('_')[:64]
+    digest = hashlib.sha256(domain.strip().lower().encode()).hexdigest()[:8]
+    return f"{slug}_{digest}" if slug else digest
+
+
+def collection_name_for(domain: str) -> str:
+    """
+    Returns:
+        str: The name of the persistent collection of a domain.
+    """
+    return f"{cfg.COLLECTION_NAME}_{tenant_key(domain)}"
+
+
+def collection_path(path: str, collection_name: str) -> str:
+    """
+    Returns:
+        str: The path of a file kept next to a collection, e.g. "./dedup_index.<collection>.npy".
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.{collection_name}{extension}"
+
+
+def content_hash_id(chunk: Document, tenant: str = None) -> str:
+    """
+    Deterministic id of a chunk, from its source and text (and its tenant, as the
+    tenants may share a collection).
+
+    Returns:
+        str: Hex digest identifying the chunk.
+    """
+    key = f"{chunk.metadata.get('source', '')}\n{chunk.page_content}"
+    return hashlib.sha256(f"{tenant}\n{key}".encode() if tenant else key.encode()).hexdigest()
+
+
+class ScoredRetriever(VectorStoreRetriever):
+    """
+    Dense retriever that can also return the cosine similarity of each chunk to the query.
+    """
+
+    def search_with_scores(self, query: str, k: int = None) -> List[Tuple[Document, float]]:
+        """
+        Returns:
+            list: The k nearest (Document, cosine similarity) pairs, best first.
+        """
+        # The other search kwargs (e.g. the tenant filter) apply as well
+        search_kwargs = {**self.search_kwargs, "k": k or self.search_kwargs.get("k", 4)}
+        pairs = self.vectorstore.similarity_search_with_score(query, **search_kwargs)
+        if isinstance(self.vectorstore, MmapVectorStore):
+            return pairs
+        # Milvus returns the squared L2 distance, which is 2 - 2 * cosine for normalized embeddings
+        return [(doc, 1 - distance / 2) for doc, distance in pairs]
 
 
 class VectorDB:
-    def __init__(self):
+    def __init__(self, tenant: str = None):
         print("vectordb.py - __init__()")
 
-        model_name = "BAAI/bge-large-en"
-        model_kwargs = {'device': 'cpu'}
-        encode_kwargs = {'normalize_embeddings': True}
-        self.hf = HuggingFaceBgeEmbeddings(
-            model_name=model_name,
-            model_kwargs=model_kwargs,
-            encode_kwargs=encode_kwargs
-        )
+        self.model_name = cfg.EMBEDDING_MODEL
+        # Loaded once per process and shared by the sessions
+        self.hf, self.embeddings, self.embedding_id = get_embeddings(self.model_name, cfg.EMBEDDING_BACKEND)
+        
+        self.vector_store = None
+        self.retriever = None
+        self.tenant = None
+        self.collection_name = None
+        self.bm25_index = None
+        if cfg.TENANCY == "none":
+            self.attach(cfg.COLLECTION_NAME, drop_old=not cfg.VECTOR_STORE_PERSIST)
+        elif cfg.TENANCY == "session":
+            self.attach_tenant(tenant or uuid4().hex)
+        elif tenant is not None:
+            # A domain tenant is shared by its sessions, so nothing is attached before the domain is known
+            self.attach_tenant(tenant)
+        
+        
+    def attach(self, collection_name: str, drop_old: bool = False):
+        """
+        Attach to a collection, creating it on the first insert. An existing collection is
+        loaded as it is (its index is kept), so nothing is re-embedded at startup.
+        """
+        print(f"vectordb.py - attach({collection_name})")
+        start_time = time.time()
+        
+        self.collection_name = collection_name
+        if cfg.VECTOR_STORE_BACKEND == "mmap":
+            self.vector_store = MmapVectorStore(self.embeddings, collection_name, drop_old=drop_old)
+        else:
+            self.vector_store =  Milvus(
+                collection_name = collection_name,
+                embedding_function= self.embeddings,
+                connection_args={"uri": cfg.URI},
+                drop_old = drop_old
+            )
+        
+        self.bm25_index = None
+        if cfg.HYBRID_RETRIEVAL:
+            bm25_path = collection_path(cfg.BM25_INDEX_PATH, collection_name)
+            # The index of a persistent collection is shared by its sessions, one writer per journal
+            self.bm25_index = BM25Index(bm25_path, reset=True) if drop_old else get_shared(("bm25", bm25_path), lambda: BM25Index(bm25_path))
+        self.retriever = self.as_retriever()
+        
+        print(f"\nAttached collection {collection_name} ({self.count()} chunks) in {time.time() - start_time:.2f} seconds")
+        
+        
+    def attach_tenant(self, tenant: str):
+        """
+        Attach to the partition of a tenant (a session, or a domain shared by its sessions).
+        
+        With Milvus, all the tenants live in one collection partitioned by its "tenant"
+        field, and the retrieval is filtered on it. The mmap store has no filtering, so
+        each tenant gets its own collection. The stores and indexes of the domains are
+        created once per process and shared by their sessions, those of a session are
+        its own and dropped with it by drop_tenant().
+        """
+        print(f"vectordb.py - attach_tenant({tenant})")
+        start_time = time.time()
+        
+        self.tenant = tenant
+        # Names the files of the tenant (BM25 index, URL sync state, dedup index)
+        self.collection_name = f"{cfg.COLLECTION_NAME}_tenants_{tenant}"
+        shared = cfg.TENANCY == "domain"
+        
+        def create_store():
+            if cfg.VECTOR_STORE_BACKEND == "mmap":
+                return MmapVectorStore(self.embeddings, self.collection_name)
+            return Milvus(
+                collection_name = f"{cfg.COLLECTION_NAME}_tenants",
+                embedding_function= self.embeddings,
+                connection_args={"uri": cfg.URI},
+                partition_key_field = "tenant",
+            )
+        
+        if cfg.VECTOR_STORE_BACKEND == "mmap":
+            self.vector_store = get_shared(("mmap", cfg.MMAP_STORE_DIR, self.collection_name), create_store) if shared else create_store()
+        else:
+            self.vector_store = get_shared(("milvus", cfg.URI, f"{cfg.COLLECTION_NAME}_tenants"), create_store)
+        
+        self.bm25_index = None
+        if cfg.HYBRID_RETRIEVAL:
+            bm25_path = collection_path(cfg.BM25_INDEX_PATH, self.collection_name)
+            self.bm25_index = get_shared(("bm25", bm25_path), lambda: BM25Index(bm25_path)) if shared else BM25Index(bm25_path, reset=True)
+        self.retriever = self.as_retriever()
+        
+        print(f"\nAttached tenant {tenant} in {time.time() - start_time:.2f} seconds")
+        
+        
+    def drop_tenant(self):
+        """
+        Delete the chunks of a session tenant, when the session is reset. Domain tenants are kept.
+        """
+        if self.tenant is None or cfg.TENANCY != "session":
+            return
+        print(f"vectordb.py - drop_tenant({self.tenant})")
+        
+        if isinstance(self.vector_store, MmapVectorStore):
+            self.vector_store.drop()
+        elif self.vector_store.col is not None:
+            self.vector_store.delete(expr=f'tenant == "{self.tenant}"')
+        if self.bm25_index is not None:
+            self.bm25_index.drop()
+        
         
-        self.vector_store =  Milvus(
-            collection_name = cfg.COLLECTION_NAME,
-            embedding_function= self.hf,
-            connection_args={"uri": cfg.URI},
-            drop_old = True
-        )
+    def as_retriever(self, chunk_filter: Optional[ChunkFilter] = None):
+        """
+        Retriever of the attached collection (and tenant), restricted to the chunks matching
+        the filter, e.g. to search within one upload or a page range.
         
-        self.retriever = self.vector_store.as_retriever()
+        Returns:
+            BaseRetriever: A HybridRetriever with HYBRID_RETRIEVAL, otherwise a ScoredRetriever.
+        """
+        search_kwargs = self._search_kwargs(chunk_filter)
+        if self.bm25_index is not None:
+            return HybridRetriever(
+                vector_retriever=ScoredRetriever(vectorstore=self.vector_store, search_kwargs={**search_kwargs, "k": cfg.HYBRID_FETCH_K}),
+                bm25_index=self.bm25_index,
+                k=cfg.HYBRID_TOP_K,
+                fetch_k=cfg.HYBRID_FETCH_K,
+                rrf_k=cfg.HYBRID_RRF_K,
+                chunk_filter=chunk_filter or None,
+            )
+        return ScoredRetriever(vectorstore=self.vector_store, search_kwargs=search_kwargs)
         
         
-    def add_documents(self, chunks: List[Document]):
+    def _search_kwargs(self, chunk_filter: Optional[ChunkFilter] = None) -> dict:
+        # The mmap store filters the rows itself, Milvus takes a boolean expression on its scalar fields
+        if isinstance(self.vector_store, MmapVectorStore):
+            return {"chunk_filter": chunk_filter} if chunk_filter else {}
+        conditions = [f'tenant == "{self.tenant}"'] if self.tenant is not None else []
+        if chunk_filter:
+            conditions.append(chunk_filter.to_expr())
+        return {"expr": " and ".join(conditions)} if conditions else {}
+        
+        
+    def count(self) -> int:
+        """
+        Returns:
+            int: Number of chunks of the attached collection, or of the tenant in the shared Milvus collection.
+        """
+        if isinstance(self.vector_store, MmapVectorStore):
+            return len(self.vector_store)
+        if self.vector_store is None or self.vector_store.col is None:
+            return 0
+        if self.tenant is None:
+            return self.vector_store.col.num_entities
+        rows = self.vector_store.col.query(expr=f'tenant == "{self.tenant}"', output_fields=["count(*)"])
+        return rows[0]["count(*)"] if rows else 0
+        
+        
+    def chunk_id(self, chunk: Document) -> str:
+        return content_hash_id(chunk, self.tenant)
+        
+        
+    def add_documents(self, chunks: List[Document], embeddings: Optional[List[List[float]]] = None, ids: Optional[List[str]] = None):
+        """
+        Insert the chunks with their scalar metadata ('source_id', 'file_name', 'page', 'ingest_time'
+        and the 'tenant'). The ids default to the content hash of the chunks, so inserting a chunk 
+        again replaces it instead of storing it twice.
+        """
         print("vectordb.py - add_documents()")
         
-        uuids = [str(uuid4()) for _ in range(len(chunks))]
-        self.vector_store.add_documents(documents=chunks, ids=uuids)
+        ingest_time = int(time.time())
+        chunks = [Document(page_content=chunk.page_content, metadata=self._scalar_metadata(chunk.metadata, ingest_time)) for chunk in chunks]
+        ids = ids or [self.chunk_id(chunk) for chunk in chunks]
+        
+        # Identical chunks share an id, only the first one is kept
+        first = {}
+        for i, pk in enumerate(ids):
+            first.setdefault(pk, i)
+        if len(first) < len(ids):
+            chunks, ids = [chunks[i] for i in first.values()], list(first)
+            embeddings = [embeddings[i] for i in first.values()] if embeddings is not None else None
+        
+        if embeddings is None:
+            embeddings = self.embeddings.embed_documents([chunk.page_content for chunk in chunks])
+        self._insert_embeddings(chunks, embeddings, ids)
+        if self.bm25_index is not None:
+            self.bm25_index.add(chunks, ids)
+        
+        
+    def upsert_source(self, source_id: str, chunks: List[Document], embeddings: Optional[List[List[float]]] = None):
+        """
+        Replace the chunks of a source (e.g. a new version of an uploaded file) with the given ones.
+        """
+        print("vectordb.py - upsert_source()")
+        self.delete_source(source_id)
+        self.add_documents(chunks, embeddings)
+        
+        
+    def delete_source(self, source_id: str):
+        """
+        Delete all the chunks of a source, see utils.source_id_for().
+        """
+        print("vectordb.py - delete_source()")
+        chunk_filter = ChunkFilter(source_ids=(source_id,))
+        
+        if isinstance(self.vector_store, MmapVectorStore):
+            self.vector_store.delete(self.vector_store.ids_where(chunk_filter))
+        elif self.vector_store.col is not None:
+            self.vector_store.delete(expr=self._search_kwargs(chunk_filter)["expr"])
+        if self.bm25_index is not None:
+            self.bm25_index.delete(self.bm25_index.ids_where(chunk_filter))
+        
+        
+    def delete(self, ids: List[str]):
+        print("vectordb.py - delete()")
+        
+        if ids and (isinstance(self.vector_store, MmapVectorStore) or self.vector_store.col is not None):
+            self.vector_store.delete(ids=ids)
+        if ids and self.bm25_index is not None:
+            self.bm25_index.delete(ids)
+        
+        
+    def save(self):
+        """
+        Save the indexes kept next to the collection, once an ingestion is done.
+        """
+        if self.bm25_index is not None:
+            self.bm25_index.save()
+        
+        
+    def embed_documents(self, chunks: List[Document]) -> List[List[float]]:
+        """
+        Embed the chunks without inserting them, so embedding and insertion can run as separate stages.
+        
+        Returns:
+            list: One embedding per chunk.
+        """
+        print("vectordb.py - embed_documents()")
+        return self.embeddings.embed_documents([chunk.page_content for chunk in chunks])
     
-
+    
+    def _scalar_metadata(self, metadata: dict, ingest_time: int) -> dict:
+        """
+        Returns:
+            dict: The metadata with all the scalar fields, the first insert fixes the Milvus schema.
+        """
+        # Chunks normalized before the scalar fields existed (e.g. from the ingest cache)
+        if 'source_id' not in metadata:
+            metadata = {**source_metadata(metadata.get('source', '')), **metadata}
+        metadata = {**metadata, 'ingest_time': ingest_time}
+        if self.tenant is not None:
+            metadata['tenant'] = self.tenant
+        return metadata
         
-
+        
+    def _insert_embeddings(self, chunks: List[Document], embeddings: List[List[float]], ids: List[str]):
+        """
+        Insert already embedded chunks into the collection, replacing the chunks with the same ids.
+        
+        langchain_milvus 0.1.5 has no add_embeddings(), so this mirrors Milvus.add_texts() without the embedding call.
+        """
+        store = self.vector_store
+        metadatas = [chunk.metadata for chunk in chunks]
+        
+        if isinstance(store, MmapVectorStore):
+            store.add_embeddings([chunk.page_content for chunk in chunks], embeddings, metadatas, ids)
+            return
+        
+        with _init_lock:
+            # The tenants' collection is shared, only its first insert creates it
+            if store.col is None:
+                store._init(embeddings=embeddings, metadatas=metadatas)
+        
+        rows = []
+        for pk, chunk, embedding in zip(ids, chunks, embeddings):
+            row = {store._primary_field: pk, store._text_field: chunk.page_content, store._vector_field: embedding}
+            row.update({key: value for key, value in chunk.metadata.items() if key in store.fields})
+            rows.append(row)
+        
+        # Upsert, as the content hash ids may already be stored
+        store.col.upsert(rows, timeout=store.timeout)
@@ -0,0 +1,82 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import glob
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from rag.embedding_backends import EMBEDDING_BACKENDS, load_embedding_model
+from rag.embedding_engine import EmbeddingEngine
+from rag.ingestion import prepare_chunks
+
+MODELS = ["BAAI/bge-small-en", "BAAI/bge-base-en", "BAAI/bge-large-en"]
+QUERY_STRIDE = 5
+TOP_K = 5
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def load_chunks():
+    test_dir = os.path.dirname(__file__)
+    chunks = []
+    for file_path in sorted(glob.glob(os.path.join(test_dir, '..', 'data', '*.pdf'))):
+        sources = {'file_path': file_path, 'source_extension': ".pdf", 'file_name': os.path.basename(file_path)}
+        chunks.extend(chunk.page_content for chunk in prepare_chunks(sources))
+    return chunks
+
+
+def make_queries(chunks):
+    """
+    Uses the first sentence of every QUERY_STRIDE-th chunk as a question whose answer is that chunk.
+    """
+    queries = []
+    for i in range(0, len(chunks), QUERY_STRIDE):
+        sentence = re.split(r'(?<=[.!?])\s', chunks[i])[0]
+        if len(sentence.split()) >= 6:
+            queries.append((sentence, i))
+    return queries
+
+
+def bench(model_name, backend, chunks, queries):
+    """
+    Runs in its own process, so the memory of one model does not count for the next one.
+    """
+    rss_before = rss_mb()
+    engine = EmbeddingEngine(load_embedding_model(model_name, backend))
+    memory = rss_mb() - rss_before
+
+    start_time = time.perf_counter()
+    chunk_vectors = np.array(engine.embed_documents(chunks))
+    encode_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    query_vectors = np.array([engine.embed_query(query) for query, _ in queries])
+    query_time = (time.perf_counter() - start_time) / len(queries)
+
+    top_k = np.argsort(-query_vectors @ chunk_vectors.T, axis=1)[:, :TOP_K]
+    recall = np.mean([target in row for (_, target), row in zip(queries, top_k)])
+    return len(chunks) / encode_time, query_time * 1000, memory, recall
+
+
+if __name__ == '__main__':
+    models = sys.argv[1:] or MODELS
+    chunks = load_chunks()
+    queries = make_queries(chunks)
+
+    print(f"\n{len(chunks)} chunks and {len(queries)} queries from tests/data\n")
+    print(f"{'model':<20} {'backend':<8} {'chunks/s':>10} {'query ms':>10} {'memory MB':>10} {'recall@' + str(TOP_K):>10}")
+    context = multiprocessing.get_context("spawn")
+    for model_name in models:
+        for backend in EMBEDDING_BACKENDS:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                chunks_per_second, query_ms, memory, recall = pool.submit(bench, model_name, backend, chunks, queries).result()
+            print(f"{model_name:<20} {backend:<8} {chunks_per_second:>10.1f} {query_ms:>10.1f} {memory:>10.0f} {recall:>10.3f}")
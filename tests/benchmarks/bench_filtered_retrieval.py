@@ -0,0 +1,57 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import tempfile
+import time
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from rag.chunk_filter import ChunkFilter
+from rag.mmap_store import MmapVectorStore
+from utils.text_doc_processing import source_id_for, source_metadata
+
+N_SOURCES = 100
+N_PAGES = 50
+CHUNKS_PER_PAGE = 10
+DIM = 1024
+N_QUERIES = 200
+TOP_K = 4
+
+
+def fill(store_dir):
+    store = MmapVectorStore(DeterministicFakeEmbedding(size=DIM), "bench", store_dir, drop_old=True)
+    generator = np.random.default_rng(0)
+    for source in range(N_SOURCES):
+        metadatas = [source_metadata(f"file_{source}.pdf", page) for page in range(1, N_PAGES + 1) for _ in range(CHUNKS_PER_PAGE)]
+        vectors = generator.standard_normal((len(metadatas), DIM)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        store.add_embeddings([f"{source}-{i}" for i in range(len(metadatas))], vectors, metadatas, [f"{source}-{i}" for i in range(len(metadatas))])
+    return store
+
+
+def bench(name, store, queries, chunk_filter):
+    latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        store.similarity_search_by_vector_with_score(query.tolist(), k=TOP_K, chunk_filter=chunk_filter)
+        latencies.append(time.perf_counter() - start_time)
+    print(f"{name:<22} {np.median(latencies) * 1000:>9.2f} ms {np.percentile(latencies, 95) * 1000:>9.2f} ms")
+
+
+if __name__ == '__main__':
+    cfg.MMAP_EXACT_MAX_CHUNKS = N_SOURCES * N_PAGES * CHUNKS_PER_PAGE
+    generator = np.random.default_rng(1)
+    queries = generator.standard_normal((N_QUERIES, DIM)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = fill(tmp_dir)
+        print(f"\n{len(store)} chunks of {DIM} dims in {N_SOURCES} sources, {N_QUERIES} queries (exact search)\n")
+        print(f"{'scope':<22} {'p50':>12} {'p95':>12}")
+        bench("all sources", store, queries, None)
+        bench("one source", store, queries, ChunkFilter(source_ids=(source_id_for("file_7.pdf"),)))
+        bench("one source, 5 pages", store, queries, ChunkFilter(source_ids=(source_id_for("file_7.pdf"),), pages=(10, 14)))
@@ -0,0 +1,54 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import time
+
+from config import Config as cfg
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from qa_system.qa_manager import KnowledgeBaseSystem
+
+N_DOCUMENTS = 4
+N_RUNS = 3
+# Simulated LLM round trip: fixed latency plus the time per graded document
+CALL_LATENCY = 0.4
+DOCUMENT_LATENCY = 0.05
+MODES = (("sequential", 0), ("concurrent", 0), ("single_prompt", 0), ("sequential", 2), ("concurrent", 2))
+
+
+def simulated_grader(inputs):
+    time.sleep(CALL_LATENCY + DOCUMENT_LATENCY)
+    return {'score': "yes"}
+
+
+def simulated_documents_grader(inputs):
+    time.sleep(CALL_LATENCY + DOCUMENT_LATENCY * N_DOCUMENTS)
+    return {'relevant': list(range(1, N_DOCUMENTS + 1))}
+
+
+if __name__ == '__main__':
+    # With --ollama the grading calls go to the Ollama server, otherwise they are simulated
+    knowledge_base_system = KnowledgeBaseSystem(None)
+    if "--ollama" not in sys.argv:
+        knowledge_base_system.retrieval_grader_document_chain = RunnableLambda(simulated_grader)
+        knowledge_base_system.retrieval_grader_documents_chain = RunnableLambda(simulated_documents_grader)
+    cfg.RETRIEVAL_SCORE_GATING = False
+
+    documents = [Document(page_content=f"Basketball is played by two teams of five players, rule {i}.", metadata={'source': "rules.pdf"}) for i in range(N_DOCUMENTS)]
+    rows = []
+    for mode, early_stop in MODES:
+        cfg.GRADING_MODE, cfg.GRADING_EARLY_STOP = mode, early_stop
+        wall_time, calls_saved = 0.0, 0
+        for _ in range(N_RUNS):
+            start_time = time.perf_counter()
+            state = knowledge_base_system._grade_documents({"question": "How many players are in a basketball team?", "documents": documents, "execution_path": []})
+            wall_time += time.perf_counter() - start_time
+            calls_saved += state['grading_calls_saved']
+        rows.append(f"{mode:<16} {early_stop or '-':>10} {wall_time / N_RUNS:>10.2f} s {calls_saved / N_RUNS:>12.1f}")
+
+    print(f"\n{N_DOCUMENTS} documents, {N_RUNS} runs\n")
+    print(f"{'mode':<16} {'early stop':>10} {'wall time':>12} {'calls saved':>12}")
+    print("\n".join(rows))
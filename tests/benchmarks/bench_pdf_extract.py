@@ -0,0 +1,55 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import glob
+import tempfile
+import time
+
+import fitz
+from config import Config as cfg
+from rag.ingestion import iter_pdf_pages
+
+MIN_PAGES = 300
+
+
+def build_pdf(file_path):
+    """
+    Concatenates the PDFs of tests/data until the document has MIN_PAGES pages.
+    """
+    test_dir = os.path.dirname(__file__)
+    with fitz.open() as doc:
+        while len(doc) < MIN_PAGES:
+            for source_path in sorted(glob.glob(os.path.join(test_dir, '..', 'data', '*.pdf'))):
+                with fitz.open(source_path) as source:
+                    doc.insert_pdf(source)
+        doc.save(file_path)
+        return len(doc)
+
+
+def bench(name, file_path, parallel, serial_time=None):
+    start_time = time.perf_counter()
+    first_page_time = None
+    for page in iter_pdf_pages(file_path, parallel):
+        if first_page_time is None:
+            first_page_time = time.perf_counter() - start_time
+    elapsed = time.perf_counter() - start_time
+    speedup = f"{serial_time / elapsed:>7.2f}x" if serial_time else ""
+    print(f"{name:<12} {elapsed:>10.2f} s {first_page_time * 1000:>14.1f} ms {speedup}")
+    return elapsed
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "bench.pdf")
+        n_pages = build_pdf(file_path)
+
+        print(f"\n{n_pages} pages, {os.cpu_count()} CPUs, {cfg.PDF_PAGES_PER_TASK} pages per task\n")
+        print(f"{'workers':<12} {'total':>12} {'first page':>17} {'speedup':>8}")
+        serial_time = bench("serial", file_path, parallel=False)
+        cfg.PDF_PARALLEL_MIN_PAGES = 1
+        for workers in sorted({2, 4, max(2, os.cpu_count())}):
+            cfg.PDF_EXTRACT_WORKERS = workers
+            bench(str(workers), file_path, parallel=True, serial_time=serial_time)
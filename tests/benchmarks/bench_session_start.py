@@ -0,0 +1,38 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import time
+
+from rag.model_registry import warm_up
+from rag.rag import ChatPDF
+
+N_SESSIONS = 3
+
+
+def start_session():
+    """
+    What a new Streamlit session does in clear_session_state(), followed by its first embedding.
+    """
+    start_time = time.perf_counter()
+    assistant = ChatPDF()
+    start = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    assistant.vector_db.hf.embed_query("first question of the session")
+    return start, time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    warm = "--warm" in sys.argv
+    warm_up_time = warm_up() if warm else 0.0
+
+    print(f"\n{'session':<10} {'start':>10} {'first query':>14}")
+    for session in range(N_SESSIONS):
+        start, query = start_session()
+        label = "warm" if warm or session else "cold"
+        print(f"{label + ' ' + str(session + 1):<10} {start:>8.2f} s {query * 1000:>11.1f} ms")
+    if warm:
+        print(f"\nServer warm up: {warm_up_time:.2f} s, before the first session")
@@ -0,0 +1,49 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import glob
+import time
+
+from config import Config as cfg
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from rag.ingestion import iter_pdf_pages
+from rag.splitter import SentenceTokenSplitter, hf_token_offsets
+from rag.chunk_store import WHITESPACE
+
+REPEATS = 5
+
+
+def load_pages():
+    test_dir = os.path.dirname(__file__)
+    pages = []
+    for file_path in sorted(glob.glob(os.path.join(test_dir, '..', 'data', '*.pdf'))):
+        pages.extend(WHITESPACE.sub(' ', page.page_content).strip() for page in iter_pdf_pages(file_path))
+    return pages
+
+
+def bench(name, split, pages, count_tokens):
+    n_bytes = sum(len(page.encode()) for page in pages)
+    start_time = time.perf_counter()
+    for _ in range(REPEATS):
+        chunks = [chunk for page in pages for chunk in split(page)]
+    elapsed = (time.perf_counter() - start_time) / REPEATS
+
+    tokens = [count_tokens(chunk) for chunk in chunks]
+    print(f"{name:<12} {n_bytes / elapsed / 1e6:>8.2f} MB/s {len(chunks):>8} chunks {sum(tokens) / len(tokens):>10.1f} {max(tokens):>10}")
+
+
+if __name__ == '__main__':
+    pages = load_pages()
+    token_offsets = hf_token_offsets(cfg.EMBEDDING_MODEL)
+    count_tokens = lambda text: len(token_offsets(text))
+
+    recursive_splitter = RecursiveCharacterTextSplitter(chunk_size=cfg.SPLITTER_CHUNK_SIZE, chunk_overlap=cfg.SPLITTER_CHUNK_OVERLAP, length_function=len)
+    token_splitter = SentenceTokenSplitter(chunk_size=cfg.SPLITTER_TOKEN_CHUNK_SIZE, chunk_overlap=cfg.SPLITTER_TOKEN_CHUNK_OVERLAP, token_offsets=token_offsets)
+
+    print(f"\n{len(pages)} pages from tests/data, tokenizer {cfg.EMBEDDING_MODEL}\n")
+    print(f"{'splitter':<12} {'throughput':>13} {'count':>15} {'avg tokens':>10} {'max tokens':>10}")
+    bench("recursive", recursive_splitter.split_text, pages, count_tokens)
+    bench("token", token_splitter.split_text, pages, count_tokens)
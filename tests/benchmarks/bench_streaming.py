@@ -0,0 +1,83 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import time
+
+from config import Config as cfg
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+from qa_system.qa_manager import KnowledgeBaseSystem
+from qa_system.structure_answer import AnswerHallucination, AnswerWithSources
+
+N_RUNS = 3
+# Simulated LLM: fixed latency per call, then the answer tokens at a fixed rate
+CALL_LATENCY = 0.4
+TOKEN_LATENCY = 0.03
+ANSWER = ("A basketball team has five players on the court: a point guard, a shooting guard, "
+          "a small forward, a power forward and a center, plus up to seven substitutes on the bench.").split(" ")
+
+
+class ListRetriever:
+    def search_with_scores(self, query, k):
+        return [(Document(page_content=f"Basketball is played by two teams of five players, rule {i}.", metadata={'source': "rules.pdf"}), None) for i in range(k)]
+
+
+def simulated_llm(output):
+    def call(inputs):
+        time.sleep(CALL_LATENCY)
+        return output
+    return RunnableLambda(call)
+
+
+def simulated_generation(inputs):
+    for _ in inputs:
+        pass
+    time.sleep(CALL_LATENCY)
+    answer = ""
+    for word in ANSWER:
+        time.sleep(TOKEN_LATENCY)
+        answer = f"{answer} {word}".strip()
+        yield {'answer': answer}
+    yield {'answer': answer, 'sources': ["rules.pdf"]}
+
+
+def simulated_system():
+    knowledge_base_system = KnowledgeBaseSystem(ListRetriever())
+    knowledge_base_system.query_domain_check = simulated_llm({'score': "yes"})
+    knowledge_base_system.retrieval_grader_document_chain = simulated_llm({'score': "yes"})
+    knowledge_base_system.question_classifier = simulated_llm({'score': "no"})
+    knowledge_base_system.generate_answer = simulated_llm(AnswerWithSources(answer=" ".join(ANSWER), sources={"rules.pdf"})) | RunnableLambda(lambda answer: time.sleep(TOKEN_LATENCY * len(ANSWER)) or answer)
+    knowledge_base_system.generate_answer_stream = RunnableGenerator(simulated_generation)
+    knowledge_base_system.hallucination_grader_chain = simulated_llm(AnswerHallucination(score="yes"))
+    knowledge_base_system.answer_grader_chain = simulated_llm({'score': "yes"})
+    return knowledge_base_system
+
+
+if __name__ == '__main__':
+    cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = "concurrent", False, (2,)
+    inputs = {"question": "How many players are in a basketball team?", "domain": "Sport"}
+    times = {"invoke": [], "first token": [], "generated": [], "checked": []}
+
+    for _ in range(N_RUNS):
+        # A fresh system per question, without chat history to rephrase
+        knowledge_base_system = simulated_system()
+        start_time = time.perf_counter()
+        knowledge_base_system.invoke(dict(inputs))
+        times["invoke"].append(time.perf_counter() - start_time)
+
+        knowledge_base_system = simulated_system()
+        start_time = time.perf_counter()
+        for event, _ in knowledge_base_system.stream(dict(inputs)):
+            if event == "generated":
+                times["generated"].append(time.perf_counter() - start_time)
+        times["checked"].append(time.perf_counter() - start_time)
+        times["first token"].append(knowledge_base_system.time_to_first_token)
+
+    mean = {name: sum(values) / N_RUNS for name, values in times.items()}
+    print(f"\n{N_RUNS} runs, {CALL_LATENCY} s per LLM call, {len(ANSWER)} answer tokens at {TOKEN_LATENCY} s\n")
+    print(f"{'':<10} {'first text':>12} {'generated':>12} {'checked':>12}")
+    print(f"{'invoke()':<10} {mean['invoke']:>10.2f} s {'-':>12} {mean['invoke']:>10.2f} s")
+    print(f"{'stream()':<10} {mean['first token']:>10.2f} s {mean['generated']:>10.2f} s {mean['checked']:>10.2f} s")
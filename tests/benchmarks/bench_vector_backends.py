@@ -0,0 +1,78 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import tempfile
+import time
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_milvus import Milvus
+from rag.mmap_store import MmapVectorStore
+
+N_CHUNKS = 100000
+DIM = 1024
+N_QUERIES = 200
+TOP_K = 10
+INSERT_BATCH = 5000
+
+
+def make_data():
+    generator = np.random.default_rng(0)
+    vectors = generator.standard_normal((N_CHUNKS, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Questions close to stored chunks, as real questions are close to their answer
+    queries = vectors[generator.choice(N_CHUNKS, N_QUERIES, replace=False)] + 0.05 * generator.standard_normal((N_QUERIES, DIM)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = np.argsort(-queries @ vectors.T, axis=1)[:, :TOP_K]
+    return vectors, queries, truth
+
+
+def fill_mmap(store_dir, vectors):
+    store = MmapVectorStore(DeterministicFakeEmbedding(size=DIM), "bench", store_dir, drop_old=True)
+    for start in range(0, N_CHUNKS, INSERT_BATCH):
+        batch = vectors[start:start + INSERT_BATCH]
+        store.add_embeddings([str(start + i) for i in range(len(batch))], batch, [{'source': "bench.pdf"}] * len(batch), [str(start + i) for i in range(len(batch))])
+    return store
+
+
+def fill_milvus(uri, vectors):
+    store = Milvus(collection_name="bench", embedding_function=DeterministicFakeEmbedding(size=DIM), connection_args={"uri": uri}, drop_old=True)
+    for start in range(0, N_CHUNKS, INSERT_BATCH):
+        batch = vectors[start:start + INSERT_BATCH].tolist()
+        if store.col is None:
+            store._init(embeddings=batch[:1], metadatas=[{'source': "bench.pdf"}])
+        store.col.insert([{store._primary_field: str(start + i), store._text_field: str(start + i), store._vector_field: vector, 'source': "bench.pdf"}
+                          for i, vector in enumerate(batch)])
+    store.col.flush()
+    return store
+
+
+def bench(name, store, queries, truth, fill_time):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start_time = time.perf_counter()
+        docs = store.similarity_search_by_vector(query.tolist(), k=TOP_K)
+        latencies.append(time.perf_counter() - start_time)
+        hits += len({int(doc.page_content) for doc in docs} & set(expected.tolist()))
+    print(f"{name:<14} {fill_time:>8.1f} s {np.median(latencies) * 1000:>9.2f} ms {np.percentile(latencies, 95) * 1000:>9.2f} ms {hits / truth.size:>10.3f}")
+
+
+if __name__ == '__main__':
+    vectors, queries, truth = make_data()
+    print(f"\n{N_CHUNKS} chunks of {DIM} dims, {N_QUERIES} queries\n")
+    print(f"{'backend':<14} {'insert':>10} {'p50':>12} {'p95':>12} {'recall@' + str(TOP_K):>10}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, exact_max in (("mmap exact", N_CHUNKS), ("mmap hnsw", 0)):
+            cfg.MMAP_EXACT_MAX_CHUNKS = exact_max
+            start_time = time.perf_counter()
+            store = fill_mmap(tmp_dir, vectors)
+            bench(name, store, queries, truth, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        store = fill_milvus(os.path.join(tmp_dir, "vector.db"), vectors)
+        bench("milvus", store, queries, truth, time.perf_counter() - start_time)
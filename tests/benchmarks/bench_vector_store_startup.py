@@ -0,0 +1,69 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import tempfile
+import time
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_milvus import Milvus
+from rag.model_registry import get_shared
+from rag.vectordb import VectorDB, collection_name_for
+
+N_CHUNKS = 100000
+DIM = 1024
+INSERT_BATCH = 5000
+
+
+def populate(uri, collection_name):
+    """
+    Fills a collection with N_CHUNKS random normalized vectors, as VectorDB would store them.
+    """
+    store = Milvus(collection_name=collection_name, embedding_function=DeterministicFakeEmbedding(size=DIM), connection_args={"uri": uri}, drop_old=True)
+    generator = np.random.default_rng(0)
+    for start in range(0, N_CHUNKS, INSERT_BATCH):
+        vectors = generator.standard_normal((INSERT_BATCH, DIM)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        texts = [f"Chunk {start + i} of the benchmark corpus." for i in range(INSERT_BATCH)]
+        if store.col is None:
+            store._init(embeddings=vectors[:1].tolist(), metadatas=[{'source': "bench.pdf"}])
+        store.col.insert([{store._primary_field: str(start + i), store._text_field: text, store._vector_field: vector, 'source': "bench.pdf"}
+                          for i, (text, vector) in enumerate(zip(texts, vectors.tolist()))])
+    store.col.flush()
+
+
+def attach(collection_name):
+    """
+    VectorDB.attach() of a domain session, with a stand-in registered for the embedding model.
+    """
+    vector_db = VectorDB()
+    start_time = time.perf_counter()
+    vector_db.attach(collection_name)
+    attach_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    vector_db.retriever.invoke("benchmark question")
+    return attach_time, time.perf_counter() - start_time, vector_db.count()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        uri = os.path.join(tmp_dir, "vector.db")
+        collection_name = collection_name_for("Sport")
+        cfg.URI, cfg.VECTOR_STORE_BACKEND, cfg.TENANCY, cfg.HYBRID_RETRIEVAL = uri, "milvus", "domain", False
+        # The embedding model load is measured by bench_session_start.py, not here
+        get_shared(("embeddings", cfg.EMBEDDING_MODEL, cfg.EMBEDDING_BACKEND, cfg.EMBEDDING_CACHE),
+                   lambda: (None, DeterministicFakeEmbedding(size=DIM), "fake-embeddings"))
+
+        start_time = time.perf_counter()
+        populate(uri, collection_name)
+        print(f"\nPopulated {collection_name} with {N_CHUNKS} chunks in {time.perf_counter() - start_time:.1f} s (done once, before the first start)\n")
+
+        print(f"{'start':<8} {'attach':>10} {'first query':>14} {'chunks':>10}")
+        for run in ("cold", "warm"):
+            attach_time, query_time, n_chunks = attach(collection_name)
+            print(f"{run:<8} {attach_time:>8.2f} s {query_time * 1000:>11.1f} ms {n_chunks:>10}")
@@ -0,0 +1,118 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import asyncio
+import contextlib
+import io
+import time
+import unittest
+
+from config import Config as cfg
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from qa_system.qa_manager import KnowledgeBaseSystem
+from qa_system.structure_answer import AnswerHallucination, AnswerWithSources
+
+LLM_LATENCY = 0.1
+
+
+class ListRetriever:
+    """
+    Stands in for the vector store retriever.
+    """
+    def search_with_scores(self, query, k):
+        return [(Document(page_content=f"Chunk {i}", metadata={'source': f"file.pdf - page: {i + 1}"}), None) for i in range(k)]
+
+
+def fake_llm(output):
+    """
+    Stands in for an LLM chain answering after LLM_LATENCY, also when awaited.
+    """
+    def call(inputs):
+        time.sleep(LLM_LATENCY)
+        return output
+
+    async def acall(inputs):
+        await asyncio.sleep(LLM_LATENCY)
+        return output
+
+    return RunnableLambda(call, afunc=acall)
+
+
+def fake_knowledge_base_system():
+    knowledge_base_system = KnowledgeBaseSystem(ListRetriever())
+    knowledge_base_system.query_domain_check = fake_llm({'score': "yes"})
+    knowledge_base_system.retrieval_grader_document_chain = fake_llm({'score': "yes"})
+    knowledge_base_system.question_classifier = fake_llm({'score': "no"})
+    knowledge_base_system.generate_answer = fake_llm(AnswerWithSources(answer="Five players.", sources={"file.pdf - page: 1"}))
+    knowledge_base_system.hallucination_grader_chain = fake_llm(AnswerHallucination(score="yes"))
+    knowledge_base_system.answer_grader_chain = fake_llm({'score': "yes"})
+    return knowledge_base_system
+
+
+class TestAsyncGraph(unittest.TestCase):
+    def setUp(self):
+        self.config = (cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS)
+        cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = "concurrent", False, (2,)
+        self.inputs = {"question": "How many players are in a basketball team?", "domain": "Sport"}
+        
+        
+    def test_same_path_as_sync(self):
+        sync_log, async_log = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(sync_log):
+            sync_state = fake_knowledge_base_system().invoke(dict(self.inputs))
+        with contextlib.redirect_stdout(async_log):
+            async_state = asyncio.run(fake_knowledge_base_system().ainvoke(dict(self.inputs)))
+        
+        # Check the async graph takes the same path to the same answer
+        self.assertEqual(async_state['execution_path'], sync_state['execution_path'])
+        self.assertEqual(async_state['execution_path'], ['check_query_domain', 'retrieve', 'grade_docs', 'question_classification', 'generate', 'hallucination_check', 'answer_check'])
+        self.assertEqual(async_state['answer'], {'answer': "Five players.", 'metadata': "file.pdf - page: 1"})
+        
+        # Check the async nodes log the same decisions
+        decisions = [[line for line in log.getvalue().splitlines() if line.startswith("DECISION")] for log in (sync_log, async_log)]
+        self.assertEqual(len(decisions[0]), 2)
+        self.assertEqual(decisions[1], decisions[0])
+        
+        
+    def test_concurrent_conversations(self):
+        n_conversations = 8
+        systems = [fake_knowledge_base_system() for _ in range(n_conversations)]
+        
+        async def serve():
+            return await asyncio.gather(*(system.ainvoke(dict(self.inputs)) for system in systems))
+        
+        start_time = time.perf_counter()
+        states = asyncio.run(serve())
+        wall_time = time.perf_counter() - start_time
+        
+        # Check the conversations overlap: 6 LLM round trips each, far less than 8 x 6 in a row
+        self.assertTrue(all(state['answer_useful'] == "useful" for state in states))
+        self.assertLess(wall_time, n_conversations * 6 * LLM_LATENCY / 2)
+        
+        
+    def test_shared_graph(self):
+        systems = [fake_knowledge_base_system() for _ in range(3)]
+        for system in systems[1:]:
+            system.generate_answer = fake_llm(AnswerWithSources(answer="Eleven players.", sources={"file.pdf - page: 2"}))
+        
+        async def serve():
+            return await asyncio.gather(*(system.ainvoke(dict(self.inputs)) for system in systems[:2]))
+        
+        # Check the sessions share the compiled graphs, each run answering with the chains of its own session
+        self.assertIs(systems[0].app.nodes, systems[1].app.nodes)
+        self.assertIs(systems[0].async_app.nodes, systems[1].async_app.nodes)
+        answers = [state['answer']['answer'] for state in asyncio.run(serve())]
+        self.assertEqual(answers, ["Five players.", "Eleven players."])
+        self.assertEqual(systems[2].invoke(dict(self.inputs))['answer']['answer'], "Eleven players.")
+        
+        
+    def tearDown(self):
+        cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = self.config
+
+
+if __name__ == '__main__':
+    unittest.main()
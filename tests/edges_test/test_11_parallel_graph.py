@@ -0,0 +1,111 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import asyncio
+import threading
+import unittest
+
+from config import Config as cfg
+from langchain_core.runnables import RunnableLambda
+from qa_system.structure_answer import AnswerHallucination, AnswerWithSources
+from test_10_async_graph import fake_knowledge_base_system, fake_llm
+
+SERIAL_PATH = ['check_query_domain', 'retrieve', 'grade_docs', 'question_classification', 'generate', 'hallucination_check', 'answer_check']
+
+
+# Longest wait of a fake LLM call for the others expected in flight with it
+OVERLAP_TIMEOUT = 5
+
+
+def knowledge_base_system(fan_out):
+    cfg.GRAPH_FAN_OUT = fan_out
+    return fake_knowledge_base_system()
+
+
+class InFlightLLM:
+    """
+    Stand-in LLM chains counting their calls in flight. Until `expected` calls were in flight
+    together, a call waits for the others (at most OVERLAP_TIMEOUT), so the overlap does not
+    depend on the scheduler timing.
+    """
+    def __init__(self, expected=None):
+        self.expected = expected
+        self.in_flight, self.peak = 0, 0
+        self.condition = threading.Condition()
+
+    def __call__(self, output):
+        def call(inputs):
+            with self.condition:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                self.condition.notify_all()
+                if self.expected is not None:
+                    self.condition.wait_for(lambda: self.peak >= self.expected, timeout=OVERLAP_TIMEOUT)
+                self.in_flight -= 1
+            return output
+
+        return RunnableLambda(call)
+
+    def attach(self, knowledge_base_system):
+        knowledge_base_system.query_domain_check = self({'score': "yes"})
+        knowledge_base_system.retrieval_grader_document_chain = self({'score': "yes"})
+        knowledge_base_system.question_classifier = self({'score': "no"})
+        knowledge_base_system.generate_answer = self(AnswerWithSources(answer="Five players.", sources={"file.pdf - page: 1"}))
+        knowledge_base_system.hallucination_grader_chain = self(AnswerHallucination(score="yes"))
+        knowledge_base_system.answer_grader_chain = self({'score': "yes"})
+        return knowledge_base_system
+
+
+class TestParallelGraph(unittest.TestCase):
+    def setUp(self):
+        self.config = (cfg.GRAPH_FAN_OUT, cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS)
+        cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = "concurrent", False, (2,)
+        self.inputs = {"question": "How many players are in a basketball team?", "domain": "Sport"}
+
+
+    def test_same_path_as_serial(self):
+        state = knowledge_base_system(True).invoke(dict(self.inputs))
+        async_state = asyncio.run(knowledge_base_system(True).ainvoke(dict(self.inputs)))
+
+        # Check the parallel branches are recorded as the serial graph would run them
+        self.assertEqual(state['execution_path'], SERIAL_PATH)
+        self.assertEqual(async_state['execution_path'], SERIAL_PATH)
+        self.assertEqual(state['answer'], {'answer': "Five players.", 'metadata': "file.pdf - page: 1"})
+        self.assertEqual(len(state['grade_documents']), 2)
+
+
+    def test_speculation_discarded_out_of_domain(self):
+        fan_out_system = knowledge_base_system(True)
+        fan_out_system.query_domain_check = fake_llm({'score': "no"})
+        fan_out_system.rephrase_query_chain = fake_llm({'question': "How many players are in a basketball team?"})
+        state = fan_out_system.invoke(dict(self.inputs))
+
+        # Check the speculative documents and question type are not used
+        self.assertEqual(state['execution_path'], ['check_query_domain', 'rephrase_based_history', 'check_query_domain'])
+        self.assertEqual(state['answer'], {'answer': "I don't know the answer to that question.", 'metadata': "No metadata"})
+        self.assertNotIn('grade_documents', state)
+        self.assertEqual(state['question_type'], 'error')
+
+
+    def test_shorter_critical_path(self):
+        # The domain check, the classification and the grading of the 2 documents
+        fan_out_llm = InFlightLLM(expected=4)
+        fan_out_llm.attach(knowledge_base_system(True)).invoke(dict(self.inputs))
+        serial_llm = InFlightLLM()
+        serial_llm.attach(knowledge_base_system(False)).invoke(dict(self.inputs))
+        
+        # Check the domain check and the classification overlap the retrieval and grading: 2 LLM round trips less
+        self.assertEqual(fan_out_llm.peak, 4)
+        self.assertLessEqual(serial_llm.peak, 2)
+        
+        
+    def tearDown(self):
+        cfg.GRAPH_FAN_OUT, cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = self.config
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import asyncio
+import time
+import unittest
+
+from config import Config as cfg
+from langchain_core.runnables import RunnableGenerator
+from qa_system.structure_answer import AnswerHallucination
+from rag.rag import ChatPDF
+from test_10_async_graph import fake_knowledge_base_system, fake_llm
+
+TOKEN_LATENCY = 0.05
+ANSWER_TOKENS = ["A basketball", " team has", " five players", " on the court."]
+
+
+def fake_stream(tokens, sources):
+    """
+    Stands in for the JSON mode LLM chain: the partial answers grow by one token every TOKEN_LATENCY.
+    """
+    def transform(inputs):
+        for _ in inputs:
+            pass
+        answer = ""
+        for token in tokens:
+            time.sleep(TOKEN_LATENCY)
+            answer += token
+            yield {'answer': answer}
+        yield {'answer': answer, 'sources': sources}
+
+    async def atransform(inputs):
+        async for _ in inputs:
+            pass
+        answer = ""
+        for token in tokens:
+            await asyncio.sleep(TOKEN_LATENCY)
+            answer += token
+            yield {'answer': answer}
+        yield {'answer': answer, 'sources': sources}
+
+    return RunnableGenerator(transform, atransform)
+
+
+def streaming_chat_pdf():
+    """
+    ChatPDF answering with the stand-in chains, without a vector store.
+    """
+    chat_pdf = ChatPDF.__new__(ChatPDF)
+    chat_pdf.domain = "Sport"
+    chat_pdf.knowledge_base_system = fake_knowledge_base_system()
+    chat_pdf.knowledge_base_system.generate_answer_stream = fake_stream(ANSWER_TOKENS, ["file.pdf - page: 1"])
+    return chat_pdf
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.config = (cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS)
+        cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = "concurrent", False, (2,)
+        self.question = "How many players are in a basketball team?"
+
+
+    def test_tokens_before_checks(self):
+        chat_pdf = streaming_chat_pdf()
+        start_time = time.perf_counter()
+        events = [(event, time.perf_counter() - start_time) for event in chat_pdf.ask_stream(self.question)]
+
+        # Check the tokens come first and add up to the answer, then the generated and the checked answer
+        types = [event['type'] for event, _ in events]
+        self.assertEqual(types, ["token"] * len(ANSWER_TOKENS) + ["generated", "answer"])
+        self.assertEqual("".join(event['text'] for event, _ in events[:len(ANSWER_TOKENS)]), "".join(ANSWER_TOKENS))
+        answer = events[-1][0]
+        self.assertEqual(answer['text'], "A basketball team has five players on the court.\n\nMetadata: file.pdf - page: 1")
+        self.assertFalse(answer['retracted'])
+        self.assertTrue(answer['note'].startswith("✅"))
+
+        # Check the first token arrives before the generation ends, and long before the checks
+        first_token_time, generated_time, answer_time = events[0][1], events[-2][1], events[-1][1]
+        self.assertLess(first_token_time, generated_time - (len(ANSWER_TOKENS) - 2) * TOKEN_LATENCY)
+        self.assertLess(answer['time_to_first_token'], answer_time)
+
+
+    def test_answer_withdrawn(self):
+        chat_pdf = streaming_chat_pdf()
+        chat_pdf.knowledge_base_system.hallucination_grader_chain = fake_llm(AnswerHallucination(score="no"))
+        events = list(chat_pdf.ask_stream(self.question))
+
+        # Check the streamed answer is withdrawn by the hallucination check
+        answer = events[-1]
+        self.assertEqual(answer['type'], "answer")
+        self.assertTrue(answer['retracted'])
+        self.assertTrue(answer['text'].startswith("I don't know the answer to that question."))
+        self.assertTrue(answer['note'].startswith("⚠️"))
+
+
+    def test_async_tokens(self):
+        knowledge_base_system = streaming_chat_pdf().knowledge_base_system
+        inputs = {"question": self.question, "domain": "Sport"}
+        knowledge_base_system._prepare_inputs(inputs)
+        inputs['stream_tokens'] = True
+        
+        async def stream():
+            return [chunk async for chunk in knowledge_base_system.async_app.astream(inputs, stream_mode="custom")]
+        
+        # Check the async graph streams the same answer tokens
+        self.assertEqual([chunk['token'] for chunk in asyncio.run(stream())], ANSWER_TOKENS)
+        
+        
+    def tearDown(self):
+        cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = self.config
+
+
+if __name__ == '__main__':
+    unittest.main()
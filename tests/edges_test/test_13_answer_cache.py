@@ -0,0 +1,150 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import re
+import unittest
+import zlib
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.runnables import RunnableLambda
+from qa_system.answer_cache import AnswerCache
+from rag.chunk_filter import ChunkFilter
+from test_10_async_graph import fake_knowledge_base_system
+
+SERIAL_PATH = ['check_query_domain', 'retrieve', 'grade_docs', 'question_classification', 'generate', 'hallucination_check', 'answer_check']
+
+
+class BagOfWordsEmbeddings:
+    """
+    Stands in for the embedding model: questions sharing most of their words are close.
+    """
+    def embed_query(self, text):
+        vector = np.zeros(256)
+        for word in re.findall(r'\w+', text.lower()):
+            vector[zlib.crc32(word.encode()) % 256] += 1
+        return vector.tolist()
+
+
+class TestAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.config = (cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS)
+        cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = "concurrent", False, (2,)
+        self.answer_cache = AnswerCache(BagOfWordsEmbeddings(), max_entries=2, threshold=0.8)
+        self.llm_calls = 0
+
+
+    def session(self):
+        """
+        A new conversation sharing the answer cache, counting its domain check calls.
+        """
+        def domain_check(inputs):
+            self.llm_calls += 1
+            return {'score': "yes"}
+
+        knowledge_base_system = fake_knowledge_base_system()
+        knowledge_base_system.query_domain_check = RunnableLambda(domain_check)
+        knowledge_base_system.answer_cache = self.answer_cache
+        return knowledge_base_system
+
+
+    def ask(self, question, domain="Sport"):
+        return self.session().invoke({"question": question, "domain": domain})
+
+
+    def test_paraphrase_hit(self):
+        first = self.ask("How many players are in a basketball team?")
+        second = self.ask("How many players are in a team of basketball?")
+
+        # Check the paraphrase is answered from the cache, without running the graph
+        self.assertEqual(self.llm_calls, 1)
+        self.assertEqual(second['answer'], first['answer'])
+        self.assertEqual(second['execution_path'], SERIAL_PATH)
+        self.assertGreaterEqual(second['cache_similarity'], 0.8)
+        self.assertEqual(self.answer_cache.stats()['hit_rate'], 0.5)
+
+        # Check another question or another domain runs the graph
+        self.ask("Who invented basketball?")
+        self.ask("How many players are in a basketball team?", domain="Medicine")
+        self.assertEqual(self.llm_calls, 3)
+
+
+    def test_invalidated_by_ingest(self):
+        self.ask("How many players are in a basketball team?")
+        self.answer_cache.bump_version()
+        self.ask("How many players are in a basketball team?")
+        self.assertEqual(self.llm_calls, 2)
+
+        # Check an answer computed while the corpus changed is not stored
+        _, key = self.answer_cache.get("Sport", "Who invented basketball?")
+        self.answer_cache.bump_version()
+        self.answer_cache.put(key, {'answer': {}, 'question_type': "no", 'execution_path': [], 'answer_useful': "useful"})
+        self.assertEqual(self.answer_cache.stats()['entries'], 0)
+
+
+    def test_lru_eviction(self):
+        for question in ("How many players are in a basketball team?", "Who invented basketball?"):
+            self.ask(question)
+        self.ask("How many players are in a team of basketball?")
+        self.ask("When was the first Olympic Games?")
+
+        # Check the least recently used question is evicted, the recently hit one is kept
+        self.assertEqual(self.answer_cache.stats()['evictions'], 1)
+        self.ask("How many players are in a basketball team?")
+        self.ask("Who invented basketball?")
+        self.assertEqual(self.llm_calls, 4)
+
+
+    def test_not_cached(self):
+        # Check the rejected answers are not cached
+        rejected = self.session()
+        rejected.answer_grader_chain = RunnableLambda(lambda inputs: {'score': "no"})
+        rejected.answer_cache = self.answer_cache
+        rejected.invoke({"question": "How many players are in a basketball team?", "domain": "Sport"})
+        self.assertEqual(self.answer_cache.stats()['entries'], 0)
+
+
+    def test_scope(self):
+        question = "How many players are in a basketball team?"
+        self.ask(question)
+        scoped = self.session()
+        scoped.chunk_filter = ChunkFilter(source_ids=("a1",))
+        scoped.invoke({"question": question, "domain": "Sport"})
+        
+        # Check an answer is only served within the retrieval scope it was built in
+        self.assertEqual(self.llm_calls, 2)
+        scoped = self.session()
+        scoped.chunk_filter = ChunkFilter(source_ids=("a1",))
+        self.assertIn('cache_similarity', scoped.invoke({"question": question, "domain": "Sport"}))
+        self.assertIn('cache_similarity', self.ask(question))
+        self.assertEqual(self.llm_calls, 2)
+
+
+    def test_follow_up(self):
+        self.ask("How many players are in a basketball team?")
+        
+        # Check a follow-up question is looked up as its standalone question, rephrased once for the cache and the retrieval
+        rephrased = []
+        def rephrase(inputs):
+            rephrased.append(inputs['input'])
+            return "How many players are in a basketball team?" if inputs['input'] == "And how many players?" else inputs['input']
+        
+        for question in ("And how many players?", "Who coaches it?"):
+            follow_up = self.session()
+            follow_up.rephrase_retrieval_query_chain = RunnableLambda(rephrase)
+            follow_up.chat_history = ["Which team sport uses a hoop?", "Basketball."]
+            follow_up.invoke({"question": question, "domain": "Sport"})
+        self.assertEqual(self.llm_calls, 2)
+        self.assertEqual(rephrased, ["And how many players?", "Who coaches it?"])
+
+
+    def tearDown(self):
+        cfg.GRADING_MODE, cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_K_STEPS = self.config
+
+
+if __name__ == '__main__':
+    unittest.main()
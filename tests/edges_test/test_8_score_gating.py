@@ -0,0 +1,74 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import unittest
+
+from config import Config as cfg
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from qa_system.qa_manager import KnowledgeBaseSystem
+
+
+class ScoredListRetriever:
+    """
+    Stands in for the vector store retriever, with fixed similarities in decreasing order.
+    """
+    def __init__(self, scores):
+        self.docs = [(Document(page_content=f"Chunk {i}", metadata={'source': f"file.pdf - page: {i + 1}"}), score) for i, score in enumerate(scores)]
+        self.calls = []
+
+    def search_with_scores(self, query, k):
+        self.calls.append(k)
+        return self.docs[:k]
+
+
+class TestScoreGating(unittest.TestCase):
+    def setUp(self):
+        self.config = (cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_SCORE_HIGH, cfg.RETRIEVAL_SCORE_FLOOR, cfg.RETRIEVAL_K_STEPS, cfg.RETRIEVAL_MIN_CANDIDATES)
+        cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_SCORE_HIGH, cfg.RETRIEVAL_SCORE_FLOOR = True, 0.9, 0.6
+        cfg.RETRIEVAL_K_STEPS, cfg.RETRIEVAL_MIN_CANDIDATES = (2, 4, 8), 3
+        
+        self.knowledge_base_system = KnowledgeBaseSystem(None)
+        self.graded = []
+        # The grader LLM call only marks as relevant the chunks with an even number
+        self.knowledge_base_system.retrieval_grader_document_chain = RunnableLambda(
+            lambda inputs: self.graded.append(inputs['document']) or {'score': "yes" if int(inputs['document'].split()[-1]) % 2 == 0 else "no"}
+        )
+    
+    
+    def test_gating_and_adaptive_k(self):
+        retriever = ScoredListRetriever([0.95, 0.92, 0.8, 0.7, 0.5, 0.4, 0.3, 0.2])
+        self.knowledge_base_system.retriever = retriever
+        
+        state = self.knowledge_base_system._retrieve({"question": "How is AI used in basketball?", "execution_path": []})
+        
+        # Check k grows from 2 to 4, once 3 chunks pass the floor
+        self.assertEqual(retriever.calls, [2, 4])
+        self.assertEqual(state['document_scores'], [0.95, 0.92, 0.8, 0.7])
+        
+        state = self.knowledge_base_system._grade_documents(state)
+        
+        # Check only the chunks between the floor and the high score are graded by the LLM
+        self.assertEqual(self.graded, ["Chunk 2", "Chunk 3"])
+        self.assertEqual([doc.page_content for doc in state['grade_documents']], ["Chunk 0", "Chunk 1", "Chunk 2"])
+        self.assertEqual(state['grading_calls_saved'], 2)
+        
+        
+    def test_unscored_documents_are_graded(self):
+        documents = [Document(page_content=f"Chunk {i}") for i in range(3)]
+        state = self.knowledge_base_system._grade_documents({"question": "q", "documents": documents, "document_scores": [None] * 3, "execution_path": []})
+        
+        # Check the web results (no score) are all graded
+        self.assertEqual(len(self.graded), 3)
+        self.assertEqual(state['grading_calls_saved'], 0)
+        
+        
+    def tearDown(self):
+        cfg.RETRIEVAL_SCORE_GATING, cfg.RETRIEVAL_SCORE_HIGH, cfg.RETRIEVAL_SCORE_FLOOR, cfg.RETRIEVAL_K_STEPS, cfg.RETRIEVAL_MIN_CANDIDATES = self.config
+
+
+if __name__ == '__main__':
+    unittest.main()
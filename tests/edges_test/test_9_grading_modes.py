@@ -0,0 +1,86 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import threading
+import time
+import unittest
+
+from config import Config as cfg
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from qa_system.qa_manager import KnowledgeBaseSystem
+
+
+class TestGradingModes(unittest.TestCase):
+    def setUp(self):
+        self.config = (cfg.GRADING_MODE, cfg.GRADING_MAX_CONCURRENCY, cfg.GRADING_EARLY_STOP, cfg.RETRIEVAL_SCORE_GATING)
+        cfg.RETRIEVAL_SCORE_GATING = False
+        
+        self.knowledge_base_system = KnowledgeBaseSystem(None)
+        self.documents = [Document(page_content=f"Chunk {i}") for i in range(8)]
+        self.graded, self.active, self.max_active = [], 0, 0
+        self.lock = threading.Lock()
+        # The grader LLM call takes 50 ms and only marks as relevant the chunks with an even number
+        self.knowledge_base_system.retrieval_grader_document_chain = RunnableLambda(self.grade)
+        self.knowledge_base_system.retrieval_grader_documents_chain = RunnableLambda(
+            lambda inputs: self.graded.append(inputs['documents']) or {'relevant': [1, "3", 8, 42]}
+        )
+        
+        
+    def grade(self, inputs):
+        with self.lock:
+            self.graded.append(inputs['document'])
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        return {'score': "yes" if int(inputs['document'].split()[-1]) % 2 == 0 else "no"}
+    
+    
+    def grade_documents(self):
+        state = self.knowledge_base_system._grade_documents({"question": "q", "documents": self.documents, "execution_path": []})
+        return [doc.page_content for doc in state['grade_documents']], state['grading_calls_saved']
+        
+        
+    def test_concurrent(self):
+        cfg.GRADING_MODE, cfg.GRADING_MAX_CONCURRENCY, cfg.GRADING_EARLY_STOP = "concurrent", 4, 0
+        relevant, calls_saved = self.grade_documents()
+        
+        # Check all the documents are graded, at most 4 at a time, with the relevant ones in rank order
+        self.assertEqual(len(self.graded), 8)
+        self.assertEqual(self.max_active, 4)
+        self.assertEqual(relevant, ["Chunk 0", "Chunk 2", "Chunk 4", "Chunk 6"])
+        self.assertEqual(calls_saved, 0)
+        
+        
+    def test_early_stop(self):
+        cfg.GRADING_MODE, cfg.GRADING_EARLY_STOP = "sequential", 2
+        relevant, calls_saved = self.grade_documents()
+        
+        # Check the grading stops once 2 relevant documents are found
+        self.assertEqual(self.graded, ["Chunk 0", "Chunk 1", "Chunk 2"])
+        self.assertEqual(relevant, ["Chunk 0", "Chunk 2"])
+        self.assertEqual(calls_saved, 5)
+        
+        
+    def test_single_prompt(self):
+        cfg.GRADING_MODE, cfg.GRADING_EARLY_STOP = "single_prompt", 0
+        relevant, calls_saved = self.grade_documents()
+        
+        # Check one call grades the numbered documents, and out of range numbers are ignored
+        self.assertEqual(len(self.graded), 1)
+        self.assertIn("Document 8: Chunk 7", self.graded[0])
+        self.assertEqual(relevant, ["Chunk 0", "Chunk 2", "Chunk 7"])
+        self.assertEqual(calls_saved, 7)
+        
+        
+    def tearDown(self):
+        cfg.GRADING_MODE, cfg.GRADING_MAX_CONCURRENCY, cfg.GRADING_EARLY_STOP, cfg.RETRIEVAL_SCORE_GATING = self.config
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import zlib
+
+import numpy as np
+from config import Config as cfg
+from rag import model_registry
+
+
+class HashEmbeddings:
+    """
+    Stands in for the embedding model: a normalized random vector seeded by the text.
+    """
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode())).standard_normal(32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+def register_hash_embeddings() -> set:
+    """
+    Makes the hash stand-in the process-wide embedding model of cfg.EMBEDDING_MODEL.
+
+    Returns:
+        set: The keys registered before, to give to unregister() in tearDown.
+    """
+    registered = set(model_registry._models)
+    model_registry._models[("embeddings", cfg.EMBEDDING_MODEL, cfg.EMBEDDING_BACKEND, cfg.EMBEDDING_CACHE)] = (None, HashEmbeddings(), "hash-embeddings")
+    return registered
+
+
+def unregister(registered: set):
+    """
+    Removes what was registered since, the stand-in and the shared stores, indexes and caches.
+    """
+    for key in set(model_registry._models) - registered:
+        del model_registry._models[key]
@@ -0,0 +1,45 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import unittest
+from itertools import islice
+
+from config import Config as cfg
+from rag.ingestion import iter_pdf_pages
+
+
+class TestPdfParallel(unittest.TestCase):
+    def setUp(self):
+        self.config = (cfg.PDF_EXTRACT_WORKERS, cfg.PDF_PAGES_PER_TASK, cfg.PDF_PARALLEL_MIN_PAGES)
+        cfg.PDF_EXTRACT_WORKERS, cfg.PDF_PAGES_PER_TASK, cfg.PDF_PARALLEL_MIN_PAGES = 2, 3, 1
+        test_dir = os.path.dirname(__file__)
+        self.file_path = os.path.join(test_dir, '..', 'data', "Assignment1.pdf")
+    
+    
+    def test_same_pages_as_serial(self):
+        serial_pages = list(iter_pdf_pages(self.file_path, parallel=False))
+        parallel_pages = list(iter_pdf_pages(self.file_path))
+        
+        # Check the pages come back complete and in page order, with the same metadata
+        self.assertEqual([page.page_content for page in parallel_pages], [page.page_content for page in serial_pages])
+        self.assertEqual([page.metadata for page in parallel_pages], [page.metadata for page in serial_pages])
+        
+        
+    def test_stop_early(self):
+        pages = iter_pdf_pages(self.file_path)
+        first_pages = list(islice(pages, 2))
+        pages.close()
+        
+        # Check the first pages can be consumed before the extraction is over
+        self.assertEqual([page.metadata['page'] for page in first_pages], [0, 1])
+        
+        
+    def tearDown(self):
+        cfg.PDF_EXTRACT_WORKERS, cfg.PDF_PAGES_PER_TASK, cfg.PDF_PARALLEL_MIN_PAGES = self.config
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+from rag.embedding_engine import EmbeddingEngine
+
+
+class WordClient:
+    """
+    Stands in for the SentenceTransformer model: a word tokenizer and an embedding
+    holding the number of words of the text, recording the batches it is called with.
+    """
+    max_seq_length = 512
+
+    def __init__(self):
+        self.batches = []
+
+    def tokenizer(self, texts, truncation=True, max_length=None):
+        return {'input_ids': [text.split()[:max_length] for text in texts]}
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        if isinstance(texts, str):
+            return np.array([len(texts.split())], dtype=np.float32)
+        self.batches.append([len(text.split()) for text in texts])
+        return np.array([[len(text.split())] for text in texts], dtype=np.float32)
+
+
+class TestEmbeddingEngine(unittest.TestCase):
+    def setUp(self):
+        self.client = WordClient()
+        hf = SimpleNamespace(client=self.client, encode_kwargs={'normalize_embeddings': True}, embed_instruction="", query_instruction="Query: ")
+        self.engine = EmbeddingEngine(hf, batch_size=2)
+        self.texts = ["word " * n for n in (3, 40, 5, 38, 4, 41)]
+    
+    
+    def test_length_buckets(self):
+        embeddings = self.engine.embed_documents(self.texts)
+        
+        # Check the embeddings come back in input order and the batches hold texts of similar length
+        self.assertEqual([embedding[0] for embedding in embeddings], [3, 40, 5, 38, 4, 41])
+        self.assertEqual(self.client.batches, [[41, 40], [38, 5], [4, 3]])
+        
+        
+    def test_stats(self):
+        self.engine.embed_documents(self.texts)
+        self.assertEqual(self.engine.embed_query("how many words"), [4])
+        stats = self.engine.stats()
+        
+        # Check the chunks, tokens and padding are counted for documents and queries
+        self.assertEqual(stats['chunks'], 7)
+        self.assertEqual(stats['tokens'], sum((3, 40, 5, 38, 4, 41)) + 4)
+        self.assertTrue(stats['chunks_per_second'] > 0 and stats['tokens_per_second'] > 0)
+        self.assertTrue(0 < stats['padding'] < 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
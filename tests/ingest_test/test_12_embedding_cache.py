@@ -0,0 +1,101 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import shutil
+import tempfile
+import unittest
+
+from rag.embedding_cache import EmbeddingCache
+
+
+class CountingEmbeddings:
+    """
+    Stands in for the embedding model, counting the texts it embeds.
+    """
+    def __init__(self):
+        self.n_embedded = 0
+
+    def embed_documents(self, texts):
+        self.n_embedded += len(texts)
+        return [[float(len(text)), 1.0, 0.0] for text in texts]
+
+    def embed_query(self, text):
+        self.n_embedded += 1
+        return [float(len(text)), 0.0, 1.0]
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.model = CountingEmbeddings()
+    
+    
+    def test_hits_across_instances(self):
+        cache = EmbeddingCache(self.model, "BAAI/bge-large-en", True, self.cache_dir, 10)
+        first = cache.embed_documents(["basketball", "tennis", "basketball"])
+        self.assertEqual(self.model.n_embedded, 2)
+        
+        # Check a new instance reads the vectors back from disk and keeps queries apart from documents
+        cache = EmbeddingCache(self.model, "BAAI/bge-large-en", True, self.cache_dir, 10)
+        self.assertEqual(cache.embed_documents(["tennis", "basketball"]), [first[1], first[0]])
+        self.assertEqual(cache.embed_query("tennis"), [6.0, 0.0, 1.0])
+        self.assertEqual(self.model.n_embedded, 3)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+        
+        # Check the key depends on the model and the normalization
+        EmbeddingCache(self.model, "BAAI/bge-small-en", True, self.cache_dir, 10).embed_documents(["tennis"])
+        EmbeddingCache(self.model, "BAAI/bge-large-en", False, self.cache_dir, 10).embed_documents(["tennis"])
+        self.assertEqual(self.model.n_embedded, 5)
+        
+        
+    def test_lru_eviction(self):
+        cache = EmbeddingCache(self.model, "BAAI/bge-large-en", True, self.cache_dir, 2)
+        cache.embed_documents(["a", "bb"])
+        cache.embed_documents(["a"])
+        cache.embed_documents(["ccc"])
+        
+        # Check the least recently used entry ("bb") was evicted and its row reused
+        self.model.n_embedded = 0
+        self.assertEqual(cache.embed_documents(["a", "ccc"]), [[1.0, 1.0, 0.0], [3.0, 1.0, 0.0]])
+        self.assertEqual(self.model.n_embedded, 0)
+        cache.embed_documents(["bb"])
+        self.assertEqual(self.model.n_embedded, 1)
+        self.assertEqual(cache.stats()['entries'], 2)
+        
+        
+    def test_journal(self):
+        cache = EmbeddingCache(self.model, "BAAI/bge-large-en", True, self.cache_dir, 2)
+        cache.embed_documents(["a", "bb"])
+        index_path = cache.index_path
+        with open(index_path, encoding="utf-8") as f:
+            index = f.read()
+        
+        # Check a miss and a hit are appended to the journal, without rewriting the index
+        cache.embed_documents(["a"])
+        cache.embed_query("tennis")
+        with open(index_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), index)
+        
+        # Check a new instance replays the journal: the new entry, which evicted "bb", and the hit on "a"
+        cache = EmbeddingCache(self.model, "BAAI/bge-large-en", True, self.cache_dir, 2)
+        self.assertEqual(list(cache.index), [cache._key("a", "document"), cache._key("tennis", "query")])
+        
+        # Check the hits of an instance without misses are kept in the LRU order too
+        cache.embed_documents(["a"])
+        cache = EmbeddingCache(self.model, "BAAI/bge-large-en", True, self.cache_dir, 2)
+        cache.embed_documents(["ccc"])
+        self.model.n_embedded = 0
+        cache.embed_documents(["a"])
+        self.assertEqual(self.model.n_embedded, 0)
+        
+        
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
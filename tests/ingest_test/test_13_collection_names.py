@@ -0,0 +1,28 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import re
+import unittest
+
+from rag.vectordb import collection_name_for, collection_path
+
+
+class TestCollectionNames(unittest.TestCase):
+    def test_collection_name_for(self):
+        names = [collection_name_for(domain) for domain in ("Sport", " sport ", "C", "C++", "Μαθηματικά")]
+        
+        # Check the names are valid Milvus names, stable for the same domain and distinct otherwise
+        self.assertTrue(all(re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]{0,254}', name) for name in names))
+        self.assertEqual(names[0], names[1])
+        self.assertNotEqual(names[2], names[3])
+        
+        
+    def test_collection_path(self):
+        self.assertEqual(collection_path("./dedup_index.npy", "rag_chroma_sport"), "./dedup_index.rag_chroma_sport.npy")
+
+
+if __name__ == '__main__':
+    unittest.main()
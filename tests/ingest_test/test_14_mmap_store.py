@@ -0,0 +1,99 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import importlib.util
+import shutil
+import tempfile
+import unittest
+
+from config import Config as cfg
+from hash_embeddings import HashEmbeddings
+from rag import mmap_store
+from rag.chunk_filter import ChunkFilter
+from rag.mmap_store import MmapVectorStore
+
+
+class TestMmapStore(unittest.TestCase):
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.texts = [f"Chunk {i} about basketball." for i in range(50)]
+        self.metadatas = [{'source': f"file.pdf - page: {i}"} for i in range(50)]
+    
+    
+    def test_search_and_persistence(self):
+        store = MmapVectorStore(HashEmbeddings(), "sport", self.store_dir)
+        ids = store.add_texts(self.texts[:30], self.metadatas[:30])
+        store.add_texts(self.texts[30:], self.metadatas[30:])
+        
+        # Check the chunk whose own text is the query comes first, with its metadata
+        docs = store.as_retriever().invoke(self.texts[42])
+        self.assertEqual(docs[0].page_content, self.texts[42])
+        self.assertEqual(docs[0].metadata, self.metadatas[42])
+        self.assertEqual(len(docs), 4)
+        
+        # Check a new instance attaches to the stored chunks, and deleted chunks are not found again
+        store.delete(ids[:2])
+        store = MmapVectorStore(HashEmbeddings(), "sport", self.store_dir)
+        self.assertEqual(len(store), 48)
+        self.assertNotEqual(store.similarity_search(self.texts[0], k=1)[0].page_content, self.texts[0])
+        self.assertEqual(store.similarity_search(self.texts[7], k=1)[0].page_content, self.texts[7])
+        
+        # Check drop_old starts an empty collection
+        self.assertEqual(len(MmapVectorStore(HashEmbeddings(), "sport", self.store_dir, drop_old=True)), 0)
+        
+        
+    def test_compaction(self):
+        min_deleted, mmap_store.COMPACT_MIN_DELETED = mmap_store.COMPACT_MIN_DELETED, 10
+        try:
+            store = MmapVectorStore(HashEmbeddings(), "sport", self.store_dir)
+            metadatas = [{'source_id': "a" if i % 2 else "b", 'page': i} for i in range(50)]
+            ids = store.add_texts(self.texts, metadatas)
+            store.similarity_search(self.texts[0], k=1, chunk_filter=ChunkFilter(source_ids=("a",)))
+            docs_size = os.path.getsize(os.path.join(self.store_dir, "sport.docs"))
+            
+            # Check the deleted rows are compacted away once more than a quarter of the rows are deleted
+            store.delete(ids[:12])
+            self.assertEqual((store.count, len(store.deleted)), (50, 12))
+            store.delete(ids[12:20])
+            self.assertEqual((store.count, len(store.deleted)), (30, 0))
+            self.assertLess(os.path.getsize(os.path.join(self.store_dir, "sport.docs")), docs_size)
+            
+            # Check the renumbered rows keep their chunks, ids and metadata filters, also in a new instance
+            for store in (store, MmapVectorStore(HashEmbeddings(), "sport", self.store_dir)):
+                self.assertEqual(store.similarity_search(self.texts[42], k=1)[0].page_content, self.texts[42])
+                self.assertEqual(store.similarity_search(self.texts[42], k=1)[0].id, ids[42])
+                docs = store.similarity_search(self.texts[41], k=30, chunk_filter=ChunkFilter(source_ids=("a",), pages=(30, 49)))
+                self.assertEqual(sorted(doc.metadata['page'] for doc in docs), list(range(31, 50, 2)))
+            
+            # Check an id is still replaced after the compaction
+            store.add_texts(["Chunk 42 replaced."], [metadatas[42]], ids=[ids[42]])
+            self.assertEqual(len(store), 30)
+            self.assertEqual(store.similarity_search("Chunk 42 replaced.", k=1)[0].id, ids[42])
+        finally:
+            mmap_store.COMPACT_MIN_DELETED = min_deleted
+        
+        
+    @unittest.skipUnless(importlib.util.find_spec("hnswlib"), "hnswlib is not installed")
+    def test_hnsw(self):
+        max_chunks, cfg.MMAP_EXACT_MAX_CHUNKS = cfg.MMAP_EXACT_MAX_CHUNKS, 10
+        try:
+            store = MmapVectorStore(HashEmbeddings(), "sport", self.store_dir)
+            store.add_texts(self.texts, self.metadatas)
+            
+            # Check the HNSW graph is used above MMAP_EXACT_MAX_CHUNKS and finds the chunks
+            self.assertIsNotNone(store.hnsw)
+            self.assertEqual(store.similarity_search(self.texts[42], k=1)[0].page_content, self.texts[42])
+        finally:
+            cfg.MMAP_EXACT_MAX_CHUNKS = max_chunks
+        
+        
+    def tearDown(self):
+        shutil.rmtree(self.store_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
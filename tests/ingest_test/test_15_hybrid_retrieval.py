@@ -0,0 +1,124 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import shutil
+import tempfile
+import unittest
+from typing import List
+from unittest import mock
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from rag import bm25_index
+from rag.bm25_index import BM25Index, HybridRetriever, tokenize
+
+
+class FixedRetriever(BaseRetriever):
+    """
+    Stands in for the dense retriever, always returning the same ranking.
+    """
+    docs: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.docs
+
+
+class TestHybridRetrieval(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.index_dir, "bm25_index.json")
+        texts = [
+            "The basketball court is 28 meters long and 15 meters wide.",
+            "Players dribble the ball while moving on the court.",
+            "The model XR-2000 sensor tracks the shooting angle of the players.",
+            "A game has four quarters of ten minutes each.",
+        ]
+        self.chunks = [Document(page_content=text, metadata={'source': f"file.pdf - page: {i + 1}"}) for i, text in enumerate(texts)]
+        self.ids = [f"id-{i}" for i in range(len(texts))]
+    
+    
+    def test_bm25_identifiers(self):
+        index = BM25Index(self.index_path)
+        index.add(self.chunks, self.ids)
+        
+        # Check identifiers and numbers are found, also by their parts
+        self.assertIn("xr-2000", tokenize("Model XR-2000"))
+        self.assertEqual(index.search("Which sensor is the XR-2000?", 1)[0][0].page_content, self.chunks[2].page_content)
+        self.assertEqual(index.search("2000", 1)[0][0].page_content, self.chunks[2].page_content)
+        
+        # Check the index is saved and deleted chunks are not found again
+        index.delete(["id-2"])
+        index.save()
+        index = BM25Index(self.index_path)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.search("XR-2000", 4), [])
+        
+        
+    def test_journal(self):
+        index = BM25Index(self.index_path)
+        index.add(self.chunks[:2], self.ids[:2])
+        index.save()
+        index_size = os.path.getsize(self.index_path)
+        
+        # Check the later changes are appended to the journal, without rewriting the index file
+        index.add(self.chunks[2:], self.ids[2:])
+        index.delete(["id-0"])
+        index.save()
+        self.assertEqual(os.path.getsize(self.index_path), index_size)
+        self.assertEqual(index.n_journaled, 3)
+        
+        # Check the index and its journal load without tokenizing the chunks again
+        with mock.patch.object(bm25_index, "tokenize", side_effect=AssertionError("tokenized at load")):
+            loaded = BM25Index(self.index_path)
+        self.assertEqual(len(loaded), 3)
+        self.assertEqual(loaded.postings, index.postings)
+        self.assertEqual(loaded.search("XR-2000", 1)[0][0].page_content, self.chunks[2].page_content)
+        self.assertEqual(loaded.search("28 meters", 4), [])
+        
+        
+    def test_compaction(self):
+        index = BM25Index(self.index_path)
+        index.add(self.chunks, self.ids)
+        index.save()
+        
+        # Check the deleted rows are compacted away once they pass the threshold, with the journal folded in
+        with mock.patch.object(bm25_index, "COMPACT_MIN_DELETED", 1):
+            index.delete(["id-0"])
+            index.save()
+            self.assertEqual(len(index.ids), 4)
+            index.delete(["id-1"])
+            index.save()
+        self.assertEqual((index.ids, index.deleted, index.n_journaled), (["id-2", "id-3"], set(), 0))
+        self.assertEqual(os.path.getsize(index.journal_path), 0)
+        
+        # Check the renumbered rows are still found, and an id is replaced after the compaction
+        self.assertEqual(index.search("four quarters", 1)[0][0].page_content, self.chunks[3].page_content)
+        index.add([Document(page_content="The XR-3000 replaced the older sensor.", metadata={})], ["id-2"])
+        index.save()
+        loaded = BM25Index(self.index_path)
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(loaded.search("XR-2000", 4)[0][0].page_content, "The XR-3000 replaced the older sensor.")
+        
+        
+    def test_rrf_fusion(self):
+        index = BM25Index(self.index_path)
+        index.add(self.chunks, self.ids)
+        dense = FixedRetriever(docs=[self.chunks[1], self.chunks[0], self.chunks[3]])
+        retriever = HybridRetriever(vector_retriever=dense, bm25_index=index, k=2, fetch_k=4, rrf_k=60)
+        
+        # Check a chunk missed by the dense retriever comes up through BM25, with the best dense one
+        docs = retriever.invoke("XR-2000 sensor")
+        self.assertEqual(len(docs), 2)
+        self.assertIn(self.chunks[2].page_content, [doc.page_content for doc in docs])
+        self.assertIn(self.chunks[1].page_content, [doc.page_content for doc in docs])
+        
+        
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
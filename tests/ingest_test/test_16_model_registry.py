@@ -0,0 +1,73 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import threading
+import time
+import unittest
+
+from config import Config as cfg
+from rag import model_registry
+from rag.model_registry import get_llm, get_shared
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.temperature = cfg.MODEL_TEMPERATURE
+        self.registered = set(model_registry._models)
+        
+        
+    def tearDown(self):
+        cfg.MODEL_TEMPERATURE = self.temperature
+        for key in set(model_registry._models) - self.registered:
+            del model_registry._models[key]
+        
+        
+    def test_shared_llm(self):
+        json_llm = get_llm("json")
+        
+        # Check the sessions share one client per kind
+        self.assertIs(get_llm("json"), json_llm)
+        self.assertIsNot(get_llm("functions"), json_llm)
+        self.assertIs(get_llm("functions"), get_llm("functions"))
+        
+        
+    def test_config_change(self):
+        json_llm = get_llm("json")
+        cfg.MODEL_TEMPERATURE = self.temperature + 0.5
+        
+        # Check a new client is created for the new settings
+        new_llm = get_llm("json")
+        self.assertIsNot(new_llm, json_llm)
+        self.assertEqual(new_llm.temperature, cfg.MODEL_TEMPERATURE)
+
+        
+        
+    def test_slow_load(self):
+        loading, created = threading.Event(), []
+        def slow_create():
+            loading.set()
+            time.sleep(1)
+            created.append("slow")
+            return "slow model"
+        
+        loader = threading.Thread(target=get_shared, args=(("test", "slow"), slow_create))
+        loader.start()
+        loading.wait()
+        
+        # Check another key, also one created by a factory using the registry, does not wait for the slow load
+        start_time = time.perf_counter()
+        nested = get_shared(("test", "outer"), lambda: get_shared(("test", "inner"), lambda: "inner") + " store")
+        self.assertEqual(nested, "inner store")
+        self.assertLess(time.perf_counter() - start_time, 0.5)
+        
+        # Check the slow model is created once, the concurrent caller waits for it
+        self.assertEqual(get_shared(("test", "slow"), slow_create), "slow model")
+        loader.join()
+        self.assertEqual(created, ["slow"])
+
+
+if __name__ == '__main__':
+    unittest.main()
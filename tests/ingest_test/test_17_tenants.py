@@ -0,0 +1,126 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import importlib.util
+import shutil
+import tempfile
+import unittest
+
+from config import Config as cfg
+from hash_embeddings import register_hash_embeddings, unregister
+from langchain_core.documents import Document
+from rag import model_registry
+from rag.rag import ChatPDF
+from rag.vectordb import VectorDB
+
+
+class TestTenants(unittest.TestCase):
+    def setUp(self):
+        self.settings = (cfg.TENANCY, cfg.VECTOR_STORE_BACKEND, cfg.MMAP_STORE_DIR, cfg.EMBEDDING_MODEL, cfg.URI, 
+                         cfg.ANSWER_CACHE, cfg.HYBRID_RETRIEVAL, cfg.INGEST_CACHE, cfg.URL_SYNC_STATE_PATH, cfg.BM25_INDEX_PATH, cfg.DEDUP, cfg.DEDUP_INDEX_PATH)
+        self.store_dir = tempfile.mkdtemp()
+        cfg.VECTOR_STORE_BACKEND, cfg.MMAP_STORE_DIR, cfg.EMBEDDING_MODEL = "mmap", self.store_dir, "hash-embeddings"
+        # The process-wide embedding model is the hash stand-in
+        self.registered = register_hash_embeddings()
+        self.chunks = {tenant: [Document(page_content=f"Chunk {i} of {tenant}.", metadata={'source': f"{tenant}.pdf"}) for i in range(10)] 
+                       for tenant in ("alice", "bob")}
+        
+        
+    def tearDown(self):
+        (cfg.TENANCY, cfg.VECTOR_STORE_BACKEND, cfg.MMAP_STORE_DIR, cfg.EMBEDDING_MODEL, cfg.URI, 
+         cfg.ANSWER_CACHE, cfg.HYBRID_RETRIEVAL, cfg.INGEST_CACHE, cfg.URL_SYNC_STATE_PATH, cfg.BM25_INDEX_PATH, cfg.DEDUP, cfg.DEDUP_INDEX_PATH) = self.settings
+        unregister(self.registered)
+        shutil.rmtree(self.store_dir)
+        
+        
+    def test_session_isolation(self):
+        cfg.TENANCY = "session"
+        vector_dbs = {tenant: VectorDB(tenant) for tenant in self.chunks}
+        for tenant, chunks in self.chunks.items():
+            vector_dbs[tenant].add_documents(chunks)
+        
+        # Check each session only retrieves its own chunks, tagged with its tenant
+        docs = vector_dbs["alice"].retriever.invoke("Chunk 3 of bob.")
+        self.assertTrue(docs)
+        self.assertTrue(all(doc.metadata['source'] == "alice.pdf" and doc.metadata['tenant'] == "alice" for doc in docs))
+        
+        # Check resetting a session deletes its chunks only
+        vector_dbs["alice"].drop_tenant()
+        self.assertEqual(vector_dbs["alice"].count(), 0)
+        self.assertEqual(VectorDB("alice").count(), 0)
+        self.assertEqual(vector_dbs["bob"].count(), 10)
+        
+        
+    def test_shared_domain(self):
+        cfg.TENANCY = "domain"
+        first, second = VectorDB("sport"), VectorDB("sport")
+        first.add_documents(self.chunks["alice"])
+        
+        # Check the sessions of a domain share its store, and a domain tenant is not dropped
+        self.assertIs(first.vector_store, second.vector_store)
+        self.assertEqual(second.retriever.invoke("Chunk 3 of alice.")[0].page_content, "Chunk 3 of alice.")
+        second.drop_tenant()
+        self.assertEqual(first.count(), 10)
+        self.assertEqual(VectorDB("music").count(), 0)
+
+
+        
+        
+    def test_domain_attached_by_set_domain(self):
+        cfg.TENANCY, cfg.ANSWER_CACHE, cfg.HYBRID_RETRIEVAL, cfg.INGEST_CACHE, cfg.DEDUP = "domain", True, True, False, True
+        cfg.URL_SYNC_STATE_PATH, cfg.BM25_INDEX_PATH, cfg.DEDUP_INDEX_PATH = (os.path.join(self.store_dir, name) for name in ("url_sync_state.json", "bm25_index.json", "dedup_index.npy"))
+        registered = set(model_registry._models)
+        # The LLM clients and the compiled graphs are shared by all the sessions, whatever their domain
+        shared = lambda: {key[0] for key in model_registry._models if key not in registered} - {"llm", "graph", "async_graph", "stream_graph"}
+        first = ChatPDF()
+        
+        # Check a session attaches and registers nothing before its domain is set
+        self.assertIsNone(first.vector_db.tenant)
+        self.assertIsNone(first.answer_cache)
+        self.assertEqual(shared(), set())
+        self.assertEqual(os.listdir(self.store_dir), [])
+        
+        # Check the sessions of a domain then share its store, indexes, URL sync state and answer cache
+        first.set_domain("sport")
+        second = ChatPDF()
+        second.set_domain("sport")
+        self.assertEqual(shared(), {"mmap", "bm25", "dedup", "url_sync", "answer_cache"})
+        self.assertIs(first.vector_db.vector_store, second.vector_db.vector_store)
+        self.assertIs(first.answer_cache, second.answer_cache)
+        self.assertIs(first.dedup_index, second.dedup_index)
+        self.assertIs(first.url_sync_state, second.url_sync_state)
+        
+        # Check a chunk stored by one session is a near-duplicate for the other, and the synced URLs are seen by both
+        chunks = [Document(page_content="The three point line is 6.75 meters from the basket.", metadata={'source': "rules.pdf"})]
+        self.assertEqual(first._drop_near_duplicates(chunks)[2], 0)
+        self.assertEqual(second._drop_near_duplicates(chunks)[2], 1)
+        first.url_sync_state.set("https://example.com/rules", '"v1"', None, ["a1"])
+        self.assertEqual(second.url_sync_state.get("https://example.com/rules")['etag'], '"v1"')
+        
+        
+    @unittest.skipUnless(importlib.util.find_spec("milvus_lite"), "milvus_lite is not installed")
+    def test_milvus_partition_key(self):
+        cfg.TENANCY, cfg.VECTOR_STORE_BACKEND, cfg.URI = "session", "milvus", os.path.join(self.store_dir, "vector.db")
+        vector_dbs = {tenant: VectorDB(tenant) for tenant in self.chunks}
+        for tenant, chunks in self.chunks.items():
+            vector_dbs[tenant].add_documents(chunks)
+        
+        # Check the tenants share one collection, and are retrieved and counted apart by their tenant field
+        self.assertIs(vector_dbs["alice"].vector_store, vector_dbs["bob"].vector_store)
+        docs = vector_dbs["alice"].retriever.invoke("Chunk 3 of bob.")
+        self.assertTrue(docs)
+        self.assertTrue(all(doc.metadata['source'] == "alice.pdf" for doc in docs))
+        self.assertEqual(vector_dbs["alice"].count(), 10)
+        
+        # Check resetting a session deletes the rows of its tenant only
+        vector_dbs["alice"].drop_tenant()
+        self.assertEqual(vector_dbs["alice"].count(), 0)
+        self.assertEqual(vector_dbs["bob"].count(), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import shutil
+import tempfile
+import unittest
+
+from config import Config as cfg
+from hash_embeddings import register_hash_embeddings, unregister
+from langchain_core.documents import Document
+from rag.chunk_filter import ChunkFilter
+from rag.rag import ChatPDF
+from rag.vectordb import VectorDB
+from utils.text_doc_processing import source_id_for, source_metadata
+
+
+class TestScalarMetadata(unittest.TestCase):
+    def setUp(self):
+        self.settings = (cfg.VECTOR_STORE_BACKEND, cfg.MMAP_STORE_DIR, cfg.EMBEDDING_MODEL, cfg.HYBRID_RETRIEVAL, cfg.BM25_INDEX_PATH, 
+                         cfg.TENANCY, cfg.INGEST_CACHE, cfg.URL_SYNC_STATE_PATH)
+        self.store_dir = tempfile.mkdtemp()
+        cfg.VECTOR_STORE_BACKEND, cfg.MMAP_STORE_DIR, cfg.EMBEDDING_MODEL = "mmap", self.store_dir, "hash-embeddings"
+        cfg.BM25_INDEX_PATH = os.path.join(self.store_dir, "bm25_index.json")
+        # The process-wide embedding model is the hash stand-in
+        self.registered = register_hash_embeddings()
+        self.chunks = [Document(page_content=f"Chunk {page} of {file_name}.", metadata=source_metadata(file_name, page)) 
+                       for file_name in ("rules.pdf", "history.pdf") for page in range(1, 11)]
+        
+        
+    def tearDown(self):
+        (cfg.VECTOR_STORE_BACKEND, cfg.MMAP_STORE_DIR, cfg.EMBEDDING_MODEL, cfg.HYBRID_RETRIEVAL, cfg.BM25_INDEX_PATH, 
+         cfg.TENANCY, cfg.INGEST_CACHE, cfg.URL_SYNC_STATE_PATH) = self.settings
+        unregister(self.registered)
+        shutil.rmtree(self.store_dir)
+        
+        
+    def test_metadata_and_ids(self):
+        vector_db = VectorDB()
+        vector_db.add_documents(self.chunks)
+        
+        # Check the scalar fields are stored, and the content hash ids make a second insert replace the chunks
+        metadata = vector_db.retriever.invoke("Chunk 3 of rules.pdf.")[0].metadata
+        self.assertEqual((metadata['source'], metadata['file_name'], metadata['page']), ("rules.pdf - page: 3", "rules.pdf", 3))
+        self.assertEqual(metadata['source_id'], source_id_for("rules.pdf"))
+        self.assertIsInstance(metadata['ingest_time'], int)
+        vector_db.add_documents(self.chunks[:5])
+        self.assertEqual(vector_db.count(), 20)
+        
+        
+    def test_filtered_retrieval(self):
+        for hybrid in (False, True):
+            cfg.HYBRID_RETRIEVAL = hybrid
+            vector_db = VectorDB()
+            vector_db.add_documents(self.chunks)
+            
+            # Check the retrieval stays within the source and the page range
+            retriever = vector_db.as_retriever(ChunkFilter(source_ids=(source_id_for("history.pdf"),), pages=(2, 4)))
+            docs = retriever.invoke("Chunk 3 of rules.pdf.")
+            self.assertEqual(len(docs), 3)
+            self.assertTrue(all(doc.metadata['file_name'] == "history.pdf" and 2 <= doc.metadata['page'] <= 4 for doc in docs))
+        
+        
+    def test_delete_and_upsert_source(self):
+        cfg.HYBRID_RETRIEVAL = True
+        vector_db = VectorDB()
+        vector_db.add_documents(self.chunks)
+        
+        # Check deleting a source leaves the other one, and an upsert replaces a source's chunks
+        vector_db.delete_source(source_id_for("rules.pdf"))
+        self.assertEqual(vector_db.count(), 10)
+        self.assertEqual(len(vector_db.bm25_index), 10)
+        new_version = [Document(page_content="Revised chunk of history.pdf.", metadata=source_metadata("history.pdf", 1))]
+        vector_db.upsert_source(source_id_for("history.pdf"), new_version)
+        self.assertEqual(vector_db.count(), 1)
+        self.assertEqual(vector_db.retriever.invoke("Chunk 3 of history.pdf.")[0].page_content, "Revised chunk of history.pdf.")
+        
+        
+    def test_scope_kept_by_set_domain(self):
+        cfg.TENANCY, cfg.INGEST_CACHE, cfg.URL_SYNC_STATE_PATH = "domain", False, os.path.join(self.store_dir, "url_sync_state.json")
+        chat_pdf = ChatPDF()
+        chat_pdf.set_domain("sport")
+        chat_pdf.set_scope(["history.pdf"])
+        chat_pdf.set_domain("science")
+        chat_pdf.vector_db.add_documents(self.chunks)
+        
+        # Check the scope set in the previous domain still restricts the retrieval of the new domain's collection
+        docs = chat_pdf.knowledge_base_system.retriever.invoke("Chunk 3 of rules.pdf.")
+        self.assertTrue(docs)
+        self.assertTrue(all(doc.metadata['file_name'] == "history.pdf" for doc in docs))
+        self.assertEqual(chat_pdf.knowledge_base_system.chunk_filter, ChunkFilter(source_ids=(source_id_for("history.pdf"),)))
+        
+        
+    def test_filter_expr(self):
+        self.assertEqual(ChunkFilter(source_ids=("a1",), pages=(2, 4)).to_expr(), "source_id in ['a1'] and page >= 2 and page <= 4")
+        self.assertFalse(ChunkFilter())
+
+
+if __name__ == '__main__':
+    unittest.main()
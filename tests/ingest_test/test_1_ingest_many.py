@@ -0,0 +1,153 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import hashlib
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from rag.ingest_cache import IngestCache
+from rag.rag import ChatPDF
+from config import Config as cfg
+from utils.upload_source import UploadStatus
+
+
+class TestIngestMany(unittest.TestCase):
+    def setUp(self):
+        cfg.MODEL_TEMPERATURE = 0.0
+        self.domain = "Sport"
+        test_dir = os.path.dirname(__file__)
+        self.file_names = [
+            "Application of Artificial_Intelligence_in_Basketball_Sport.pdf",
+            "amazon.pdf",
+            "Application of Artificial_Intelligence_in_Basketball_Sport.pdf",
+        ]
+        self.sources = [
+            {'file_path': os.path.join(test_dir, '..', 'data', file_name), 'source_extension': ".pdf", 'file_name': file_name, 'domain': self.domain}
+            for file_name in self.file_names
+        ]
+        self.chat_pdf = ChatPDF()
+    
+    
+    def test_ingest_many(self):
+        report = self.chat_pdf.ingest_many(self.sources)
+        statuses = [result['status'] for result in report['results']]
+        
+        # Check the per source report keeps the input order
+        self.assertEqual([result['file_name'] for result in report['results']], self.file_names)
+        self.assertEqual(statuses, [UploadStatus.SUCCESS, UploadStatus.INVALID_DOMAIN, UploadStatus.DUPLICATE_FILE])
+        
+        # Check the aggregate numbers
+        self.assertEqual(report['n_sources'], 3)
+        self.assertEqual(report['n_success'], 1)
+        self.assertTrue(report['n_chunks'] > 0, msg="No chunks inserted")
+        self.assertTrue(report['chunks_per_second'] > 0)
+        
+        
+    def tearDown(self) -> None:
+        self.chat_pdf = None
+        self.domain = None
+        return super().tearDown()
+
+class StandInVectorDB:
+    """
+    Stands in for the vector store and the embedding model, counting the embedded chunks.
+    """
+    def __init__(self):
+        self.vector_store = object()
+        self.embedding_id = "stand-in"
+        self.chunks, self.n_embedded = [], 0
+
+    def embed_documents(self, chunks):
+        self.n_embedded += len(chunks)
+        return np.random.rand(len(chunks), 8).tolist()
+
+    def add_documents(self, chunks, embeddings=None):
+        self.chunks.extend(chunks)
+
+    def save(self):
+        pass
+
+
+class TestIngestManyRouting(unittest.TestCase):
+    def setUp(self):
+        self.settings = (cfg.INGEST_PROBE, cfg.TENANCY)
+        self.cache_dir = tempfile.mkdtemp()
+        test_dir = os.path.dirname(__file__)
+        self.sources = {
+            file_name: {'file_path': os.path.join(test_dir, '..', 'data', file_name), 'source_extension': ".pdf", 'file_name': file_name, 'domain': "Sport"}
+            for file_name in ("Application of Artificial_Intelligence_in_Basketball_Sport.pdf", "amazon.pdf")
+        }
+        self.basketball, self.amazon = self.sources.values()
+        
+        
+    def chat_pdf(self):
+        """
+        ChatPDF with the stand-in vector store, the ingestion cache and a domain detection accepting the basketball document only.
+        """
+        chat_pdf = ChatPDF.__new__(ChatPDF)
+        chat_pdf.vector_db, chat_pdf.ingest_cache, chat_pdf.dedup_index, chat_pdf.answer_cache = StandInVectorDB(), IngestCache(self.cache_dir, 10 ** 9), None, None
+        chat_pdf.detected_chunks = []
+        def summarize_domain(chunks):
+            chat_pdf.detected_chunks.append(len(chunks))
+            return {'summary': "", 'domain': ["sport"] if "basketball" in " ".join(chunk.page_content.lower() for chunk in chunks) else ["retail"]}
+        chat_pdf._summarize_domain = summarize_domain
+        chat_pdf._check_domain = lambda detection, domain: detection is not None and domain.lower() in detection['domain']
+        return chat_pdf
+        
+        
+    def test_session_hashes_and_cache(self):
+        with open(self.amazon['file_path'], 'rb') as f:
+            file_hashes = {hashlib.md5(f.read()).hexdigest()}
+        chat_pdf = self.chat_pdf()
+        report = chat_pdf.ingest_many([self.basketball, self.amazon], file_hashes)
+        
+        # Check a file the session already uploaded is a duplicate, and the batch is added to the session hashes
+        self.assertEqual([result['status'] for result in report['results']], [UploadStatus.SUCCESS, UploadStatus.DUPLICATE_FILE])
+        self.assertEqual(len(file_hashes), 2)
+        self.assertTrue(chat_pdf.vector_db.n_embedded > 0)
+        
+        # Check the cached file goes straight to the insert in a new session: no detection and no embedding
+        cached = self.chat_pdf()
+        report = cached.ingest_many([self.basketball])
+        self.assertEqual(report['results'][0]['status'], UploadStatus.SUCCESS)
+        self.assertEqual((cached.detected_chunks, cached.vector_db.n_embedded), ([], 0))
+        self.assertEqual(len(cached.vector_db.chunks), len(chat_pdf.vector_db.chunks))
+        
+        
+    def test_probe(self):
+        cfg.INGEST_PROBE = True
+        chat_pdf = self.chat_pdf()
+        report = chat_pdf.ingest_many([self.amazon])
+        
+        # Check the off-domain upload is rejected on its probe: one detection, and no full parse cached as rejected
+        self.assertEqual(report['results'][0]['status'], UploadStatus.INVALID_DOMAIN)
+        self.assertEqual(len(chat_pdf.detected_chunks), 1)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        
+        # Check without the probe, the full parse is rejected and cached with its detection
+        cfg.INGEST_PROBE = False
+        self.chat_pdf().ingest_many([self.amazon])
+        self.assertEqual(len([name for name in os.listdir(self.cache_dir) if name.endswith(".json")]), 1)
+        
+        
+    def test_mixed_domains(self):
+        cfg.TENANCY = "domain"
+        
+        # Check a batch is not split across the tenants of several domains
+        with self.assertRaises(Exception):
+            self.chat_pdf().ingest_many([self.basketball, {**self.amazon, 'domain': "Retail"}])
+        
+        
+    def tearDown(self):
+        cfg.INGEST_PROBE, cfg.TENANCY = self.settings
+        shutil.rmtree(self.cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
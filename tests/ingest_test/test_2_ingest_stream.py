@@ -0,0 +1,42 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import unittest
+
+from rag.ingestion import iter_batches, iter_chunks, prepare_chunks
+from config import Config as cfg
+
+
+class TestIngestStream(unittest.TestCase):
+    def setUp(self):
+        test_dir = os.path.dirname(__file__)
+        file_name = "Application of Artificial_Intelligence_in_Basketball_Sport.pdf"
+        self.sources = {'file_path': os.path.join(test_dir, '..', 'data', file_name), 'source_extension': ".pdf", 'file_name': file_name, 'domain': "Sport"}
+    
+    
+    def test_stream_matches_full_load(self):
+        chunks = prepare_chunks(self.sources)
+        streamed_chunks = list(iter_chunks(self.sources))
+        
+        # Check the streaming pipeline produces the same chunks as the list based one
+        self.assertEqual([chunk.page_content for chunk in streamed_chunks], [chunk.page_content for chunk in chunks])
+        self.assertEqual([chunk.metadata for chunk in streamed_chunks], [chunk.metadata for chunk in chunks])
+        
+        
+    def test_bounded_batches(self):
+        batches = list(iter_batches(iter_chunks(self.sources), cfg.INGEST_BATCH_SIZE))
+        
+        # Check no batch is bigger than the configured size and no chunk is lost
+        self.assertTrue(all(len(batch) <= cfg.INGEST_BATCH_SIZE for batch in batches))
+        self.assertEqual(sum(len(batch) for batch in batches), len(prepare_chunks(self.sources)))
+        
+        
+    def tearDown(self) -> None:
+        self.sources = None
+        return super().tearDown()
+
+if __name__ == '__main__':
+    unittest.main()
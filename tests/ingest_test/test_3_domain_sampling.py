@@ -0,0 +1,48 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import unittest
+
+from rag.domain_sampling import (estimate_tokens, pack_under_budget,
+                                 select_representative_chunks)
+from rag.ingestion import prepare_chunks
+
+
+class TestDomainSampling(unittest.TestCase):
+    def setUp(self):
+        test_dir = os.path.dirname(__file__)
+        file_name = "Application of Artificial_Intelligence_in_Basketball_Sport.pdf"
+        sources = {'file_path': os.path.join(test_dir, '..', 'data', file_name), 'source_extension': ".pdf", 'file_name': file_name, 'domain': "Sport"}
+        self.chunks = list(prepare_chunks(sources))
+    
+    
+    def test_representative_chunks(self):
+        samples = select_representative_chunks(self.chunks, 8)
+        
+        # Check the samples are distinct chunks of the document, kept in document order
+        self.assertEqual(len(samples), 8)
+        positions = [self.chunks.index(sample) for sample in samples]
+        self.assertEqual(positions, sorted(set(positions)))
+        
+        
+    def test_bounded_cost(self):
+        token_budget, group_tokens = 1000, 400
+        small_groups = pack_under_budget(select_representative_chunks(self.chunks, 8), token_budget, group_tokens)
+        large_groups = pack_under_budget(select_representative_chunks(self.chunks * 20, 8), token_budget, group_tokens)
+        
+        # Check the token budget holds and the number of map calls does not grow with the document length
+        for groups in (small_groups, large_groups):
+            self.assertTrue(sum(estimate_tokens(chunk.page_content) for group in groups for chunk in group) <= token_budget)
+            self.assertTrue(all(sum(estimate_tokens(chunk.page_content) for chunk in group) <= group_tokens for group in groups))
+        self.assertEqual(len(small_groups), len(large_groups))
+        
+        
+    def tearDown(self) -> None:
+        self.chunks = None
+        return super().tearDown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import unittest
+
+from rag.ingestion import prepare_chunks, probe_chunks
+from config import Config as cfg
+
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        cfg.PROBE_PAGES = 2
+        cfg.PROBE_CHARS = 3000
+        test_dir = os.path.dirname(__file__)
+        file_name = "Application of Artificial_Intelligence_in_Basketball_Sport.pdf"
+        self.sources = {'file_path': os.path.join(test_dir, '..', 'data', file_name), 'source_extension': ".pdf", 'file_name': file_name, 'domain': "Sport"}
+    
+    
+    def test_probe_reads_first_pages(self):
+        chunks = probe_chunks(self.sources)
+        
+        # Check only the first pages are read and the character limit holds (chunks overlap)
+        self.assertTrue(len(chunks) > 0, msg="No probe chunks")
+        self.assertTrue(all(chunk.metadata['source'].endswith(('page: 1', 'page: 2')) for chunk in chunks))
+        self.assertTrue(sum(len(chunk.page_content) for chunk in chunks) <= cfg.PROBE_CHARS + len(chunks) * cfg.SPLITTER_CHUNK_OVERLAP)
+        
+        # Check the probe is the beginning of the full parse
+        full_chunks = prepare_chunks(self.sources)
+        self.assertEqual(chunks[0].page_content, full_chunks[0].page_content)
+        self.assertTrue(len(chunks) < len(full_chunks))
+        
+        
+    def tearDown(self) -> None:
+        cfg.PROBE_PAGES = 3
+        cfg.PROBE_CHARS = 6000
+        self.sources = None
+        return super().tearDown()
+
+if __name__ == '__main__':
+    unittest.main()
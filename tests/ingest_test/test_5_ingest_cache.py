@@ -0,0 +1,174 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from config import Config as cfg
+from langchain_core.documents import Document
+from rag.ingest_cache import IngestCache
+from rag.rag import ChatPDF
+from utils.text_doc_processing import source_metadata
+
+
+class RecordingVectorDB:
+    """
+    Stands in for the vector store and the embedding model, keeping the inserted chunks and counting the embedded ones.
+    """
+    def __init__(self):
+        self.vector_store, self.embedding_id = object(), "stand-in"
+        self.chunks, self.n_embedded = [], 0
+
+    def embed_documents(self, chunks):
+        self.n_embedded += len(chunks)
+        return np.random.rand(len(chunks), 8).tolist()
+
+    def add_documents(self, chunks, embeddings=None):
+        self.chunks.extend(chunks)
+
+    def save(self):
+        pass
+
+
+class TestIngestCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.chunks = [Document(page_content=f"Chunk {i} about basketball.", metadata={'source': f"file.pdf - page: {i}"}) for i in range(4)]
+        self.embeddings = np.random.rand(4, 8).astype(np.float32)
+        self.detection = {'summary': "Basketball training.", 'domain': ["sport", "basketball", "health"]}
+    
+    
+    def test_round_trip(self):
+        cache = IngestCache(self.cache_dir, 10 ** 9)
+        test_file = os.path.join(os.path.dirname(__file__), '..', 'data', 'amazon.pdf')
+        key = cache.make_key(test_file, "BAAI/bge-large-en")
+        
+        # Check the key depends on the embedding model and a miss returns None
+        self.assertNotEqual(key, cache.make_key(test_file, "BAAI/bge-small-en"))
+        self.assertIsNone(cache.get(key))
+        
+        cache.put(key, self.chunks, self.embeddings, self.detection)
+        entry = IngestCache(self.cache_dir, 10 ** 9).get(key)
+        
+        # Check the entry survives a new cache instance
+        self.assertEqual([chunk.page_content for chunk in entry['chunks']], [chunk.page_content for chunk in self.chunks])
+        self.assertEqual([chunk.metadata for chunk in entry['chunks']], [chunk.metadata for chunk in self.chunks])
+        self.assertTrue(np.allclose(entry['embeddings'], self.embeddings))
+        self.assertEqual(entry['detection'], self.detection)
+        
+        # Check the embeddings are mapped, not read into memory
+        self.assertIsInstance(entry['embeddings'], np.memmap)
+        
+        
+    def test_lru_eviction(self):
+        cache = IngestCache(self.cache_dir, 10 ** 9)
+        for key in ("a", "b"):
+            cache.put(key, self.chunks, self.embeddings, self.detection)
+            time.sleep(0.01)
+        entry_bytes = sum(os.path.getsize(os.path.join(self.cache_dir, name)) for name in os.listdir(self.cache_dir)) // 2
+        
+        # Use "a", so "b" is the least recently used entry when "c" goes over the cap
+        time.sleep(0.01)
+        cache.get("a")
+        cache.max_bytes = 2 * entry_bytes
+        cache.put("c", self.chunks, self.embeddings, self.detection)
+        
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        
+        
+    def test_batch_writer(self):
+        cache = IngestCache(self.cache_dir, 10 ** 9)
+        cache.put("a", self.chunks, self.embeddings, self.detection)
+        
+        # Check an entry written in batches reads back as a whole
+        with cache.writer("b", len(self.chunks), self.detection) as writer:
+            for start in range(0, len(self.chunks), 3):
+                writer.write(self.chunks[start:start + 3], self.embeddings[start:start + 3])
+        entry = cache.get("b")
+        self.assertEqual([chunk.page_content for chunk in entry['chunks']], [chunk.page_content for chunk in self.chunks])
+        self.assertTrue(np.allclose(entry['embeddings'], self.embeddings))
+        
+        # Check an interrupted write keeps the previous entry and leaves no temporary file
+        with self.assertRaises(RuntimeError):
+            with cache.writer("a", len(self.chunks), self.detection) as writer:
+                writer.write(self.chunks[:1], self.embeddings[:1])
+                raise RuntimeError("embedding failed")
+        self.assertEqual(len(cache.get("a")['chunks']), len(self.chunks))
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["a.json", "a.npy", "b.json", "b.npy"])
+        
+        # Check the same without the number of chunks up front (streamed upload)
+        with cache.writer("c", None, self.detection) as writer:
+            for start in range(0, len(self.chunks), 3):
+                writer.write(self.chunks[start:start + 3], self.embeddings[start:start + 3])
+        self.assertTrue(np.allclose(cache.get("c")['embeddings'], self.embeddings))
+        with self.assertRaises(RuntimeError):
+            with cache.writer("d", None, self.detection) as writer:
+                writer.write(self.chunks[:1], self.embeddings[:1])
+                raise RuntimeError("embedding failed")
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["a.json", "a.npy", "b.json", "b.npy", "c.json", "c.npy"])
+        
+        
+    def test_renamed_upload(self):
+        cache = IngestCache(self.cache_dir, 10 ** 9)
+        chunks = [Document(page_content=f"Chunk {i} about basketball.", metadata=source_metadata("first.pdf", i + 1)) for i in range(4)]
+        cache.put("a", chunks, self.embeddings, self.detection)
+        
+        chat_pdf = self.chat_pdf(cache)
+        report = chat_pdf._ingest_cached(cache.get("a"), "a", {'file_name': "second.pdf", 'domain': "Sport"}, time.time())
+        
+        # Check the chunks of a file uploaded again under another name carry the new name
+        self.assertEqual(report['chunks'], 4)
+        self.assertEqual([chunk.metadata for chunk in chat_pdf.vector_db.chunks], [source_metadata("second.pdf", i + 1) for i in range(4)])
+        
+        
+    def test_streamed_upload(self):
+        settings = (cfg.INGEST_STREAMING, cfg.INGEST_BATCH_SIZE)
+        cfg.INGEST_STREAMING, cfg.INGEST_BATCH_SIZE = True, 4
+        file_name = "Application of Artificial_Intelligence_in_Basketball_Sport.pdf"
+        sources = {'file_path': os.path.join(os.path.dirname(__file__), '..', 'data', file_name), 'source_extension': ".pdf", 'file_name': file_name, 'domain': "Sport"}
+        try:
+            cache = IngestCache(self.cache_dir, 10 ** 9)
+            streamed = self.chat_pdf(cache)
+            streamed.ingest(sources)
+            cached = self.chat_pdf(cache)
+            cached.ingest(sources)
+        finally:
+            cfg.INGEST_STREAMING, cfg.INGEST_BATCH_SIZE = settings
+        
+        # Check a streamed upload is cached batch by batch with all its embeddings, without temporary files left
+        n_chunks = len(streamed.vector_db.chunks)
+        self.assertGreater(n_chunks, 4)
+        self.assertEqual(len([name for name in os.listdir(self.cache_dir) if name.endswith(".json")]), 1)
+        self.assertFalse([name for name in os.listdir(self.cache_dir) if name.endswith(".tmp")])
+        
+        # Check uploading it again hits the cache: the same chunks, nothing embedded
+        self.assertEqual(cached.vector_db.n_embedded, 0)
+        self.assertEqual([chunk.page_content for chunk in cached.vector_db.chunks], [chunk.page_content for chunk in streamed.vector_db.chunks])
+        
+        
+    def chat_pdf(self, cache):
+        """
+        ChatPDF with the stand-in vector store and the given ingestion cache, accepting every upload.
+        """
+        chat_pdf = ChatPDF.__new__(ChatPDF)
+        chat_pdf.vector_db, chat_pdf.ingest_cache, chat_pdf.dedup_index, chat_pdf.answer_cache = RecordingVectorDB(), cache, None, None
+        chat_pdf.ingest_latency = {"accepted": [], "rejected": []}
+        chat_pdf._summarize_domain = lambda chunks: self.detection
+        chat_pdf._check_domain = lambda detection, domain: True
+        return chat_pdf
+        
+        
+    def tearDown(self) -> None:
+        shutil.rmtree(self.cache_dir)
+        return super().tearDown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import functools
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from rag.url_sync import UrlSyncState, fetch_if_modified
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class TestUrlSync(unittest.TestCase):
+    def setUp(self):
+        self.site_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.site_dir, "page.html"), "w") as f:
+            f.write("<html><body><h1>Basketball</h1><p>AI in basketball training.</p></body></html>")
+        
+        handler = functools.partial(QuietHandler, directory=self.site_dir)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/page.html"
+    
+    
+    def test_conditional_fetch(self):
+        state = UrlSyncState(os.path.join(self.site_dir, "state.json"), reset=True)
+        
+        document, etag, last_modified = fetch_if_modified(self.url, state.get(self.url))
+        self.assertIn("AI in basketball training.", document.page_content)
+        self.assertIsNotNone(last_modified)
+        state.set(self.url, etag, last_modified, ["chunk-id"])
+        
+        # Check the state survives a restart and an unchanged page is not downloaded again
+        state = UrlSyncState(os.path.join(self.site_dir, "state.json"))
+        self.assertEqual(state.get(self.url)['chunk_ids'], ["chunk-id"])
+        document, _, _ = fetch_if_modified(self.url, state.get(self.url))
+        self.assertIsNone(document)
+        
+        
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.site_dir)
+        return super().tearDown()
+
+if __name__ == '__main__':
+    unittest.main()
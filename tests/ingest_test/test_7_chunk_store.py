@@ -0,0 +1,42 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import pickle
+import unittest
+
+from rag.chunk_store import ChunkStore
+from rag.ingestion import build_text_splitter, lazy_load_documents, process_documents
+
+
+class TestChunkStore(unittest.TestCase):
+    def setUp(self):
+        test_dir = os.path.dirname(__file__)
+        file_name = "Application of Artificial_Intelligence_in_Basketball_Sport.pdf"
+        self.sources = {'file_path': os.path.join(test_dir, '..', 'data', file_name), 'source_extension': ".pdf", 'file_name': file_name, 'domain': "Sport"}
+    
+    
+    def test_same_chunks_as_documents(self):
+        chunk_store = ChunkStore()
+        chunk_store.add_source(self.sources['file_name'], lazy_load_documents(self.sources), build_text_splitter())
+        chunks = process_documents(list(lazy_load_documents(self.sources)), self.sources['file_name'])
+        
+        # Check the lazily built Documents match the ones of the Document based pipeline
+        self.assertEqual(len(chunk_store), len(chunks))
+        self.assertEqual([chunk.page_content for chunk in chunk_store], [chunk.page_content for chunk in chunks])
+        self.assertEqual([chunk.metadata for chunk in chunk_store], [chunk.metadata for chunk in chunks])
+        self.assertEqual(chunk_store[-1].page_content, chunks[-1].page_content)
+        
+        # Check the overlapping text is not copied and the store survives a process boundary
+        self.assertTrue(chunk_store.nbytes() < sum(len(chunk.page_content) for chunk in chunks))
+        self.assertEqual(list(pickle.loads(pickle.dumps(chunk_store))), list(chunk_store))
+        
+        
+    def tearDown(self) -> None:
+        self.sources = None
+        return super().tearDown()
+
+if __name__ == '__main__':
+    unittest.main()
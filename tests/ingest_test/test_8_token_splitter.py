@@ -0,0 +1,48 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import re
+import unittest
+
+from rag.splitter import SentenceTokenSplitter
+
+
+def word_offsets(text):
+    return [(match.start(), match.end()) for match in re.finditer(r"\w+|[^\w\s]", text)]
+
+
+class TestTokenSplitter(unittest.TestCase):
+    def setUp(self):
+        self.splitter = SentenceTokenSplitter(chunk_size=30, chunk_overlap=6, token_offsets=word_offsets)
+        sentences = [f"Sentence number {i} talks about basketball training and AI." for i in range(40)]
+        self.text = " ".join(sentences) + " " + " ".join(["word"] * 100)
+    
+    
+    def test_chunk_sizes(self):
+        chunks = self.splitter.split_text(self.text)
+        
+        # Check every chunk fits in the token budget and the whole text is covered
+        self.assertTrue(all(len(word_offsets(chunk)) <= 30 for chunk in chunks))
+        self.assertTrue(self.text.startswith(chunks[0]))
+        self.assertTrue(self.text.endswith(chunks[-1]))
+        
+        
+    def test_sentence_boundaries(self):
+        offsets = self.splitter.split_offsets(self.text)
+        
+        # Check the chunks of the sentence part end at a sentence end and overlap the next chunk
+        sentence_part = [(start, end) for start, end in offsets if end < self.text.index("word word")]
+        self.assertTrue(len(sentence_part) > 1)
+        self.assertTrue(all(self.text[end - 1] == "." for _, end in sentence_part))
+        self.assertTrue(all(next_start < end for (_, end), (next_start, _) in zip(offsets, offsets[1:])))
+        
+        
+    def tearDown(self) -> None:
+        self.splitter = None
+        return super().tearDown()
+
+if __name__ == '__main__':
+    unittest.main()
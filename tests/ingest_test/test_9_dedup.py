@@ -0,0 +1,69 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import shutil
+import tempfile
+import unittest
+
+from rag.chunk_store import ChunkStore
+from rag.dedup import MinHashIndex
+from rag.ingestion import build_text_splitter, lazy_load_documents
+
+
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.index_dir, "dedup_index.npy")
+        self.text = ("Basketball is a team sport in which two teams of five players face each other on a court. "
+                     "The objective is to score by shooting the ball through the hoop of the opposing team, "
+                     "while preventing the other team from shooting through their own hoop.")
+        self.near_duplicate = self.text.upper() + " (Wikipedia)"
+        self.other = ("Machine learning models are trained on large datasets to recognise patterns, and the quality "
+                      "of the training data has a direct effect on the accuracy of their predictions.")
+    
+    
+    def test_duplicates_in_one_upload(self):
+        index = MinHashIndex(self.index_path)
+        keep = index.filter_duplicates([self.text, self.other, self.text, self.near_duplicate])
+        
+        # Check the exact and the near-duplicate are skipped and distinct texts are kept
+        self.assertEqual(keep, [True, True, False, False])
+        
+        
+    def test_duplicates_across_uploads(self):
+        index = MinHashIndex(self.index_path)
+        index.filter_duplicates([self.text])
+        index.save()
+        
+        # Check a reloaded index still knows the previous upload, and a reset one does not
+        self.assertEqual(MinHashIndex(self.index_path).filter_duplicates([self.near_duplicate, self.other]), [False, True])
+        self.assertEqual(MinHashIndex(self.index_path, reset=True).filter_duplicates([self.near_duplicate]), [True])
+        
+        
+    def test_chunk_store_subset(self):
+        test_dir = os.path.dirname(__file__)
+        file_name = "Application of Artificial_Intelligence_in_Basketball_Sport.pdf"
+        sources = {'file_path': os.path.join(test_dir, '..', 'data', file_name), 'source_extension': ".pdf", 'file_name': file_name}
+        chunk_store = ChunkStore()
+        chunk_store.add_source(file_name, lazy_load_documents(sources), build_text_splitter())
+        
+        # Check a document uploaded twice is reduced to its first copy
+        index = MinHashIndex(self.index_path)
+        index.filter_duplicates([chunk.page_content for chunk in chunk_store])
+        keep = index.filter_duplicates([chunk.page_content for chunk in chunk_store])
+        self.assertFalse(any(keep))
+        
+        subset = chunk_store.subset([0, 2])
+        self.assertEqual([chunk.page_content for chunk in subset], [chunk_store[0].page_content, chunk_store[2].page_content])
+        self.assertIs(subset.buffers, chunk_store.buffers)
+        
+        
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
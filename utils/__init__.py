@@ -1,2 +1,2 @@
-from .text_doc_processing import print_documents, clean_text, convert_str_to_document, normalize_documents, extract_limited_chat_history, trim_url_to_domain 
+from .text_doc_processing import print_documents, clean_text, iter_clean_text, convert_str_to_document, normalize_documents, iter_normalize_documents, extract_limited_chat_history, trim_url_to_domain, source_id_for, source_metadata 
 from .upload_source import upload_document, upload_url
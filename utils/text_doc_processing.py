@@ -1,3 +1,4 @@
+import hashlib
 import re
 from urllib.parse import urlparse
 
@@ -35,13 +36,31 @@ def clean_text(chunks, file_name: str):
     print("text_doc_processing.py - clean_text()")
     
     for chunk in chunks:
-        chunk.page_content = chunk.page_content.replace('\n', ' ')
-        chunk.page_content = re.sub(r'\s+', ' ', chunk.page_content).strip()
-        chunk.metadata['source'] = file_name
+        _clean_document(chunk, file_name)
         
     return chunks
 
 
+def iter_clean_text(documents, file_name: str):
+    """
+    Lazy version of clean_text(), cleans each document as it is pulled from the iterable.
+
+    Yields:
+        Document: Document object with cleaned text.
+    """
+    print("text_doc_processing.py - iter_clean_text()")
+    
+    for doc in documents:
+        yield _clean_document(doc, file_name)
+
+
+def _clean_document(doc, file_name: str):
+    doc.page_content = doc.page_content.replace('\n', ' ')
+    doc.page_content = re.sub(r'\s+', ' ', doc.page_content).strip()
+    doc.metadata['source'] = file_name
+    return doc
+
+
 def convert_str_to_document(input: str):
     """
     Converts the string input to a list of Document objects.
@@ -81,28 +100,62 @@ def normalize_documents(documents):
         list: List of Document objects with normalized metadata
     """
     print("text_doc_processing.py - normalize_documents()")
-    normalized_documents = []
+    return [_normalize_document(doc) for doc in documents]
+
+
+def iter_normalize_documents(documents):
+    """
+    Lazy version of normalize_documents(), normalizes each document as it is pulled from the iterable.
 
+    Yields:
+        Document: Document object with normalized metadata
+    """
+    print("text_doc_processing.py - iter_normalize_documents()")
+    
     for doc in documents:
-        metadata = doc.metadata if hasattr(doc, 'metadata') else doc['metadata']
-        page_content = doc.page_content if hasattr(doc, 'page_content') else doc['page_content']
-        
-        # Handle PDF documents and increment the page number by one
-        if metadata['source'].endswith('.pdf'):
-            # Extract the page number from metadata, if it exists
-            page_number = int(metadata.get('page', 0)) + 1
-            normalized_source = f"{metadata['source']} - page: {page_number}"
-        else:
-            normalized_source = metadata['source']
-        
-        normalized_doc = Document(
-            metadata={'source': normalized_source},
-            page_content=page_content
-        )
-        
-        normalized_documents.append(normalized_doc)
+        yield _normalize_document(doc)
+
+
+def source_id_for(file_name: str) -> str:
+    """
+    Returns:
+        str: Deterministic id of an uploaded source (file name or URL).
+    """
+    return hashlib.sha256(file_name.encode()).hexdigest()[:16]
+
+
+def source_metadata(file_name: str, page: int = 0) -> dict:
+    """
+    Metadata of a chunk: the 'source' shown with the answers ("<file> - page: N" for PDFs) and 
+    the scalar fields the retrieval can filter on, 'source_id', 'file_name' and 'page'
+    (starting at 1, 0 for the sources without pages).
+
+    Returns:
+        dict: The chunk metadata.
+    """
+    return {
+        'source': f"{file_name} - page: {page}" if page else file_name,
+        'source_id': source_id_for(file_name),
+        'file_name': file_name,
+        'page': page,
+    }
+
+
+def _normalize_document(doc):
+    metadata = doc.metadata if hasattr(doc, 'metadata') else doc['metadata']
+    page_content = doc.page_content if hasattr(doc, 'page_content') else doc['page_content']
+    
+    # Handle PDF documents and increment the page number by one
+    if metadata['source'].endswith('.pdf'):
+        # Extract the page number from metadata, if it exists
+        page_number = int(metadata.get('page', 0)) + 1
+    else:
+        page_number = 0
     
-    return normalized_documents
+    return Document(
+        metadata=source_metadata(metadata['source'], page_number),
+        page_content=page_content
+    )
 
 
 def extract_limited_chat_history(chat_rephrased_history, max_length=3500):
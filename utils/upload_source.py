@@ -22,12 +22,12 @@ def upload_document(domain: str, st):
         
         # Check if the file has already been uploaded (by comparing hashes)
         if "file_hashes" not in st.session_state:
-            st.session_state["file_hashes"] = []
+            st.session_state["file_hashes"] = set()
         
         if file_hash in st.session_state["file_hashes"]:
             return {'status': UploadStatus.DUPLICATE_FILE, 'file_name': file.name}
         
-        st.session_state["file_hashes"].append(file_hash)
+        st.session_state["file_hashes"].add(file_hash)
         
         _, file_extension = os.path.splitext(file.name)
         file_extension = file_extension.lower()
@@ -53,7 +53,7 @@ def upload_document(domain: str, st):
         # Add the file name to the session state and remove the temporary file
         st.session_state['file_names'].append(file.name)
         os.remove(file_path)
-        return {'status': UploadStatus.SUCCESS, 'file_name': file.name}
+        return {'status': UploadStatus.SUCCESS, 'file_name': file.name, 'duplicates': answer.get('duplicates', 0)}
         
 
 def upload_url(domain: str, st):